@@ -0,0 +1,30 @@
+import hmac
+import logging
+from functools import wraps
+from flask import jsonify, request
+
+logger = logging.getLogger(__name__)
+
+# Add admin constants
+ADMIN_HEADER = 'X-Admin-Token'
+
+
+def admin_required(get_token):
+    """Decorate a view so it only answers requests carrying the admin token.
+
+    `get_token` is called per request so a reloaded token applies at once.
+    Without a configured token the admin routes don't exist (404).
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            token = get_token()
+            if not token:
+                return jsonify({"error": "Not found", "status": "error"}), 404
+            supplied = request.headers.get(ADMIN_HEADER, '')
+            if not hmac.compare_digest(supplied.encode('utf-8'), token.encode('utf-8')):
+                logger.warning(f"🔒 Rejected admin request to {request.path}")
+                return jsonify({"error": "🔒 Admin token required", "status": "error"}), 403
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
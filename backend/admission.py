@@ -0,0 +1,116 @@
+import threading
+import time
+from errors import ServiceBusyError
+from tokens import estimate_tokens
+
+# Add admission defaults
+DEFAULT_TOKENS_PER_MINUTE = 1000000
+DEFAULT_MAX_WAIT = 10.0  # seconds a request may queue for budget
+DEFAULT_MAX_QUEUE = 32   # waiters per process before shedding
+
+
+class AdmissionTicket:
+    """Budget reserved for one upstream call."""
+
+    def __init__(self, estimate, waited=0.0):
+        self.estimate = estimate
+        self.waited = waited
+
+
+class TokenAdmissionController:
+    """Keeps upstream calls inside a global tokens-per-minute budget.
+
+    The budget is a token bucket in the shared rate limit storage, so every
+    worker draws from the same quota. Estimates are charged up front and
+    corrected with the usage metadata from the model response.
+    """
+
+    def __init__(self, storage, tokens_per_minute=DEFAULT_TOKENS_PER_MINUTE,
+                 max_wait=DEFAULT_MAX_WAIT, max_queue=DEFAULT_MAX_QUEUE, key='admission:tpm'):
+        self.storage = storage
+        self.capacity = tokens_per_minute
+        self.refill_rate = tokens_per_minute / 60.0
+        self.max_wait = max_wait
+        self.max_queue = max_queue
+        self.key = key
+        # Waiters poll the bucket one at a time, in arrival order
+        self.queue_lock = threading.Lock()
+        # Guards the waiter count and metrics, requests admit on many threads
+        self.lock = threading.Lock()
+        self.waiting = 0
+        self.metrics = {
+            'admitted': 0,
+            'queued': 0,
+            'shed': 0,
+            'estimated_tokens': 0,
+            'actual_tokens': 0
+        }
+
+    def set_rate(self, tokens_per_minute):
+        """Change the budget in place, e.g. after a config reload."""
+        self.refill_rate = tokens_per_minute / 60.0
+        self.capacity = tokens_per_minute
+
+    def admit(self, prompt):
+        """Reserve budget for `prompt`, waiting up to max_wait or raising ServiceBusyError."""
+        estimate = estimate_tokens(prompt)
+        if estimate > self.capacity:
+            with self.lock:
+                self.metrics['shed'] += 1
+            raise ServiceBusyError("📏 Message is too long to process, please shorten it", retry_after=0, status_code=413)
+
+        allowed, tokens = self.storage.take(self.key, self.capacity, self.refill_rate, estimate)
+        if allowed:
+            return self._admitted(estimate)
+
+        with self.lock:
+            full = self.waiting >= self.max_queue
+            if not full:
+                self.waiting += 1
+                self.metrics['queued'] += 1
+        if full:
+            self._shed((estimate - tokens) / self.refill_rate)
+
+        started = time.monotonic()
+        deadline = started + self.max_wait
+        try:
+            with self.queue_lock:
+                while True:
+                    allowed, tokens = self.storage.take(self.key, self.capacity, self.refill_rate, estimate)
+                    if allowed:
+                        return self._admitted(estimate, time.monotonic() - started)
+                    wait = (estimate - tokens) / self.refill_rate
+                    if time.monotonic() + wait > deadline:
+                        self._shed(wait)
+                    time.sleep(wait)
+        finally:
+            with self.lock:
+                self.waiting -= 1
+
+    def reconcile(self, ticket, usage_metadata):
+        """Charge or refund the difference between the estimate and the real prompt size."""
+        actual = getattr(usage_metadata, 'prompt_token_count', None) if usage_metadata else None
+        if not actual:
+            return
+        with self.lock:
+            self.metrics['actual_tokens'] += actual
+        delta = actual - ticket.estimate
+        if delta:
+            self.storage.take(self.key, self.capacity, self.refill_rate, delta, force=True)
+
+    def refund(self, ticket):
+        """Give back the budget of a call that never went upstream."""
+        with self.lock:
+            self.metrics['estimated_tokens'] -= ticket.estimate
+        self.storage.take(self.key, self.capacity, self.refill_rate, -ticket.estimate, force=True)
+
+    def _admitted(self, estimate, waited=0.0):
+        with self.lock:
+            self.metrics['admitted'] += 1
+            self.metrics['estimated_tokens'] += estimate
+        return AdmissionTicket(estimate, waited)
+
+    def _shed(self, retry_after):
+        with self.lock:
+            self.metrics['shed'] += 1
+        raise ServiceBusyError("🚦 The AI service is busy right now, please try again shortly", retry_after=retry_after)
@@ -1,13 +1,39 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 from flask_cors import CORS
 from datetime import datetime
-from config import setup_config
-from chat import ChatService
+from config import (
+    setup_config, MODEL_CONFIG, RATE_LIMIT_CONFIG, ADMISSION_CONFIG, SCHEDULER_CONFIG, CHAT_CONFIG, COMPRESSION_CONFIG,
+    HISTORY_LOG_CONFIG, LOGGING_CONFIG, RELOAD_CONFIG, ADMIN_CONFIG, DRAIN_CONFIG,
+    WEBSOCKET_CONFIG, IDEMPOTENCY_CONFIG, SESSION_STORE_CONFIG, PROXY_CONFIG
+)
+from chat import ChatService, MAX_BATCH_ITEMS
 from errors import handle_chat_error, handle_error
+import atexit
+import itertools
 import logging
+import os
+import time
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from limits.storage.memory import MemoryStorage 
+from werkzeug.middleware.proxy_fix import ProxyFix
+from ratelimit import TokenBucketLimiter, create_bucket_storage
+from admission import TokenAdmissionController
+from scheduler import RequestScheduler
+from compression import init_compression
+from json_provider import FastJSONProvider
+from history_log import ConversationLog
+from tokens import estimator as token_estimator
+from routing import ModelRouter
+from config_reload import ConfigReloader
+from logging_setup import setup_logging, init_request_context
+from admin import admin_required
+from session_transfer import CODECS, SESSION_META, default_codec, export_stream, read_sessions
+from memory_stats import AllocationTracer, deep_sizeof, process_memory, session_report, TOP_SESSIONS
+from drain import DrainController
+from chat_socket import init_chat_socket, SOCKET_PATH
+from idempotency import IdempotencyCache
+from session_store import TieredSessionStore
 
 # Add version and description
 __version__ = "1.0.0"
@@ -15,35 +41,50 @@ __description__ = "ChatGenie Backend Server using Flask and Gemini AI"
 
 # Initialize Flask app with CORS support for frontend
 app = Flask(__name__)
+app.json = FastJSONProvider(app)  # orjson for request parsing and jsonify
+if PROXY_CONFIG["trusted_hops"]:
+    # Client address from X-Forwarded-For, so rate limits and idempotency scopes are per client, not per proxy
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=PROXY_CONFIG["trusted_hops"])
 app.config['CORS_ORIGINS'] = ['http://localhost:5173']  # Add before CORS setup
 CORS(app, resources={
     r"/chat": {
         "origins": ["http://localhost:5173"],  # Allow requests from Vite dev server
         "methods": ["POST", "OPTIONS"],        # Allow POST and preflight requests
-        "allow_headers": ["Content-Type", "Authorization"],
-        "expose_headers": ["Content-Type"]
+        "allow_headers": ["Content-Type", "Content-Encoding", "Authorization", "X-User-Id", "X-Request-Id",
+                          "Idempotency-Key"],
+        "expose_headers": ["Content-Type", "Retry-After", "X-Request-Id", "Idempotent-Replayed"]
+    },
+    r"/sessions/*": {
+        "origins": ["http://localhost:5173"],
+        "methods": ["GET", "OPTIONS"],
+        "allow_headers": ["If-None-Match", "X-User-Id"],
+        "expose_headers": ["ETag"]
     }
 })
 
+# Add logging configuration (JSON file with rotation, written off the request path)
+log_listener = setup_logging(**LOGGING_CONFIG)
+atexit.register(log_listener.stop)
+logger = logging.getLogger(__name__)
+
+# Tag log records with request IDs and log each request, sampling routine successes
+init_request_context(app)
+
+# Negotiate gzip/brotli/zstd for responses and accept compressed request bodies
+init_compression(app, min_size=COMPRESSION_CONFIG["min_size"])
+
 # Update rate limiting configuration for development
 limiter = Limiter(
     key_func=get_remote_address,
     app=app,
-    default_limits=["1000 per day", "200 per hour"], # Increased limits
+    default_limits=[RATE_LIMIT_CONFIG["ip_limits"]], # Increased limits
     storage_uri="memory://",
     strategy="fixed-window-elastic-expiry" # Better strategy for bursts
 )
 
-# Add logging configuration
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('chatgenie.log', encoding='utf-8'),  # Add encoding
-        logging.StreamHandler()
-    ]
-)
-logger = logging.getLogger(__name__)
+# Token bucket limits for chat, shared across workers and keyed per user/session
+bucket_storage = create_bucket_storage(RATE_LIMIT_CONFIG["storage_uri"])
+rate_limiter = TokenBucketLimiter(bucket_storage, ip_factor=RATE_LIMIT_CONFIG["ip_bucket_factor"])
 
 # Add config validation
 def validate_cors_config():
@@ -57,31 +98,320 @@ def run_startup_checks():
     # Add other checks as needed
     return True
 
+# The debug reloader's parent process only watches files, it must not own the log
+def is_reloader_parent():
+    return __name__ == '__main__' and os.environ.get('WERKZEUG_RUN_MAIN') != 'true'
+
 # Set up AI model and chat service
 try:
-    model = setup_config()
-    chat_service = ChatService(model)
-    logger.info("Successfully initialized Gemini 2.0 Flash model")
+    models = setup_config()
+    model = models["capable"]
+    # Cascade simple turns to the fast model when there is one
+    router = ModelRouter(models) if len(models) > 1 else None
+    # Global token budget so large prompts can't exhaust the upstream quota
+    admission = TokenAdmissionController(bucket_storage, **ADMISSION_CONFIG)
+    # Bounded upstream slots shared fairly between users, interactive first
+    scheduler = RequestScheduler(**SCHEDULER_CONFIG)
+    # Durable chat history: recover sessions from the log, then keep appending
+    history_log = None
+    if HISTORY_LOG_CONFIG["enabled"] and not is_reloader_parent():
+        history_log = ConversationLog(
+            HISTORY_LOG_CONFIG["directory"],
+            fsync_interval=HISTORY_LOG_CONFIG["fsync_interval"]
+        )
+    # Idle sessions leave memory for a SQLite file and come back on their next request
+    session_store = None
+    if SESSION_STORE_CONFIG["enabled"] and not is_reloader_parent():
+        session_store = TieredSessionStore(
+            SESSION_STORE_CONFIG["path"],
+            idle_seconds=SESSION_STORE_CONFIG["idle_seconds"],
+            spill_interval=SESSION_STORE_CONFIG["spill_interval"]
+        ).start()
+        atexit.register(session_store.close)
+    chat_service = ChatService(
+        model,
+        admission=admission,
+        scheduler=scheduler,
+        history_log=history_log,
+        router=router,
+        session_store=session_store,
+        generation_config=MODEL_CONFIG["generation_config"],
+        **CHAT_CONFIG
+    )
+    if history_log:
+        chat_service.restore_sessions(history_log.recover())
+        history_log.start()
+        atexit.register(history_log.close)
+    # Apply edits to .env or the JSON config file without a restart
+    config_reloader = None
+    if RELOAD_CONFIG["enabled"] and not is_reloader_parent():
+        config_reloader = ConfigReloader(
+            chat_service,
+            admission=admission,
+            env_file=RELOAD_CONFIG["env_file"],
+            config_file=RELOAD_CONFIG["config_file"],
+            interval=RELOAD_CONFIG["interval"]
+        ).start()
+    # Sessions exported by the last drain when there's no conversation log to recover from
+    drain_export = DRAIN_CONFIG["export_path"]
+    if drain_export and not history_log and not is_reloader_parent() and os.path.exists(drain_export):
+        with open(drain_export, 'rb') as f:
+            for session_id, meta, messages in read_sessions(f):
+                chat_service.restore_session(session_id, messages, {k: meta[k] for k in SESSION_META if k in meta})
+        os.replace(drain_export, drain_export + '.imported')
+        logger.info(f"Restored {len(chat_service.chat_history)} sessions from {drain_export}")
+    logger.info(f"Successfully initialized models: {', '.join(models)}")
 except Exception as e:
     logger.error(f"Error initializing Gemini: {str(e)}")
     raise
 
+# On SIGTERM stop taking new chats, let running ones finish, flush sessions, then exit
+drain = DrainController(DRAIN_CONFIG["timeout"])
+
+def export_sessions_on_drain():
+    path = DRAIN_CONFIG["export_path"]
+    if history_log or not path:
+        return
+    # Write next to the target and rename, a half-written file is never picked up
+    with open(path + '.tmp', 'wb') as f:
+        for chunk in export_stream(session_items()):
+            f.write(chunk)
+    os.replace(path + '.tmp', path)
+    logger.info(f"Exported {len(chat_service.chat_history)} sessions to {path}")
+
+def session_items(session_ids=None):
+    # Sessions to export; idle ones are read from disk without being loaded back into memory
+    if session_store:
+        return session_store.iter_items(session_ids)
+    history = chat_service.chat_history
+    if session_ids is None:
+        # Copy, requests keep adding sessions while we stream
+        return list(history.items())
+    return ((session_id, history[session_id]) for session_id in session_ids if session_id in history)
+
+# Many turns over one WebSocket per session, with streamed chunks and queue events
+def chat_socket_rate_limit(key, ip):
+    # Same buckets as POST /chat so switching transport doesn't double the allowance
+    return rate_limiter.check_client("chat", key, ip,
+                                     RATE_LIMIT_CONFIG["chat_capacity"], RATE_LIMIT_CONFIG["chat_period"])
+
+chat_socket = init_chat_socket(app, chat_service, rate_limit=chat_socket_rate_limit, drain=drain, **WEBSOCKET_CONFIG)
+
+if config_reloader:
+    drain.add_hook('config reloader', config_reloader.stop)
+if history_log:
+    drain.add_hook('conversation log', history_log.close)
+drain.add_hook('session export', export_sessions_on_drain)
+if not is_reloader_parent():
+    drain.install()
+
+# Retried requests with the same Idempotency-Key get the first answer instead of a new turn
+idempotency = IdempotencyCache(**IDEMPOTENCY_CONFIG)
+
 # Main chat endpoint that handles message processing
 @app.route('/chat', methods=['POST'])
-@limiter.limit("5 per minute")
+@drain.guard
+@idempotency.idempotent  # before the rate limiter, a replay shouldn't cost a token
+@rate_limiter.limit(
+    capacity=lambda: RATE_LIMIT_CONFIG["chat_capacity"],  # read per request so reloads apply
+    period=lambda: RATE_LIMIT_CONFIG["chat_period"],
+    scope="chat"
+)
 def chat_endpoint():
     try:
         # Process incoming chat request
         data = chat_service.validate_request(request)
+        data['user_id'] = request.headers.get('X-User-Id')
+        g.session_id = data['session_id']
         session = chat_service.get_or_create_session(data)
-        response = chat_service.generate_response(session, data)
+        # Rapid messages from a session that opted in share one model turn
+        response, data = chat_service.respond(session, data)
         return chat_service.format_chat_response(response, data)
     except Exception as e:
         return handle_chat_error(e)
 
+# Batch items are charged against their own bucket, one token per item
+def batch_size():
+    data = request.get_json(silent=True)
+    items = data.get('items') if isinstance(data, dict) else None
+    return min(max(1, len(items)), MAX_BATCH_ITEMS) if isinstance(items, list) else 1
+
+# Batch endpoint for offline and evaluation jobs, streams NDJSON as items finish
+@app.route('/chat/batch', methods=['POST'])
+@drain.guard
+@rate_limiter.limit(
+    capacity=lambda: RATE_LIMIT_CONFIG["batch_capacity"],
+    period=lambda: RATE_LIMIT_CONFIG["batch_period"],
+    scope="batch",
+    cost=batch_size
+)
+def chat_batch_endpoint():
+    try:
+        data = request.get_json(silent=True)
+        items = data.get('items') if isinstance(data, dict) else None
+        if not isinstance(items, list) or not items:
+            raise ValueError("📝 Hey! You need to include a list of items")
+        if len(items) > MAX_BATCH_ITEMS:
+            raise ValueError(f"Batch has too many items (max {MAX_BATCH_ITEMS})")
+    except Exception as e:
+        return handle_chat_error(e)
+
+    results = chat_service.generate_batch(
+        items,
+        username=data.get('username'),
+        user_id=request.headers.get('X-User-Id')
+    )
+    lines = (app.json.dumps_bytes(result) + b"\n" for result in results)
+    return Response(stream_with_context(lines), mimetype='application/x-ndjson')
+
+# Delta sync: clients pass the last seq they hold and get only newer messages
+@app.route('/sessions/<session_id>/messages', methods=['GET'])
+def session_messages(session_id):
+    since = request.args.get('since', 0, type=int)
+    limit = request.args.get('limit', 100, type=int)
+    # Someone else's session looks the same as a missing one
+    result = chat_service.get_messages_since(session_id, since, limit, request.headers.get('X-User-Id'))
+    if result is None:
+        return jsonify({"error": "Session not found", "status": "error"}), 404
+    messages, last_seq, has_more = result
+
+    # The page only changes when the session gets a new seq, so skip the body if it's current
+    etag = f"{session_id}:{last_seq}:{since}:{limit}"
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        response = jsonify({
+            "sessionId": session_id,
+            "messages": messages,
+            "lastSeq": last_seq,
+            "nextSince": messages[-1].get('seq', since) if messages else since,
+            "hasMore": has_more
+        })
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+# Models in use right now, a config reload may have replaced the startup ones
+def current_models():
+    if chat_service.router:
+        return chat_service.router.models
+    return {"capable": chat_service.model}
+
+# Add metrics endpoint for queueing, admission and rate limit counters
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return jsonify({
+        "chat": chat_service.metrics,
+        "scheduler": scheduler.stats(),
+        "admission": admission.metrics,
+        "rateLimit": rate_limiter.metrics,
+        "upstream": {name: m.stats() for name, m in current_models().items() if hasattr(m, 'stats')},
+        "routing": chat_service.router.stats() if chat_service.router else None,
+        "config": config_reloader.metrics if config_reloader else None,
+        "profiles": chat_service.profile_stats.snapshot(),
+        "compaction": chat_service.compactor.metrics if chat_service.compactor else None,
+        "tokens": token_estimator.stats(),
+        "drain": dict(drain.metrics, draining=drain.draining.is_set(), inflight=drain.inflight),
+        "websocket": chat_socket.metrics if chat_socket else None,
+        "coalescing": chat_service.coalescer.metrics,
+        "idempotency": idempotency.stats(),
+        "sessions": session_store.stats() if session_store else None
+    })
+
+# Admin memory introspection, nothing is measured until it's asked for
+allocation_tracer = AllocationTracer()
+
+@app.route('/admin/memory', methods=['GET'])
+@admin_required(lambda: ADMIN_CONFIG["token"])
+def admin_memory():
+    started = time.perf_counter()
+    trace = request.args.get('trace')  # start, stop or snapshot
+    try:
+        if trace == 'start':
+            tracing = allocation_tracer.start(request.args.get('frames', 1, type=int))
+        elif trace == 'stop':
+            tracing = allocation_tracer.stop()
+        elif trace == 'snapshot':
+            tracing = allocation_tracer.snapshot(request.args.get('limit', 25, type=int))
+        elif trace:
+            raise ValueError("trace must be start, stop or snapshot")
+        else:
+            tracing = allocation_tracer.status()
+    except ValueError as e:
+        return jsonify({"error": str(e), "status": "error"}), 400
+
+    # Shared models are reachable from every chat instance, don't charge them to sessions
+    models = list(current_models().values())
+    exclude = models + [inner for model in models for inner in getattr(model, 'models', [])]
+    report = {
+        "process": process_memory(),
+        # Resident sessions only, the ones moved to disk are counted under sessionStore
+        "sessions": session_report(session_store.hot if session_store else chat_service.chat_history, exclude,
+                                   request.args.get('top', TOP_SESSIONS, type=int)),
+        "sessionStore": session_store.stats() if session_store else None,
+        "rateLimit": {
+            "buckets": deep_sizeof(getattr(bucket_storage, 'buckets', {})),
+            "limiter": deep_sizeof([getattr(getattr(limiter, '_storage', None), name, None)
+                                    for name in ('storage', 'expirations', 'events')])
+        },
+        "historyLog": {"queued": history_log.queue.qsize()} if history_log else None,
+        "tracemalloc": tracing
+    }
+    report["elapsedMs"] = round((time.perf_counter() - started) * 1000, 1)
+    return jsonify(report)
+
+# Stream sessions out for migrations and rolling deploys, one session in memory at a time
+@app.route('/admin/sessions/export', methods=['GET'])
+@admin_required(lambda: ADMIN_CONFIG["token"])
+def admin_export_sessions():
+    codec = request.args.get('codec') or default_codec()
+    if codec not in CODECS:
+        return jsonify({"error": f"codec must be one of {', '.join(CODECS)}", "status": "error"}), 400
+    wanted = request.args.get('sessions')
+    # Snapshot the ids, sessions created during the export aren't included
+    sessions = session_items(wanted.split(',') if wanted else list(chat_service.chat_history))
+    try:
+        stream = export_stream(sessions, codec)
+        header = next(stream)
+    except ValueError as e:
+        return jsonify({"error": str(e), "status": "error"}), 400
+    response = Response(stream_with_context(itertools.chain([header], stream)), mimetype='application/octet-stream')
+    response.headers['Content-Disposition'] = 'attachment; filename="sessions.cgs"'
+    return response
+
+@app.route('/admin/sessions/import', methods=['POST'])
+@admin_required(lambda: ADMIN_CONFIG["token"])
+def admin_import_sessions():
+    replace = request.args.get('on_conflict', 'skip') == 'replace'
+    counts = {"imported": 0, "skipped": 0, "messages": 0}
+    try:
+        # Read the body as it arrives instead of buffering the whole upload
+        for session_id, meta, messages in read_sessions(request.stream):
+            if session_id in chat_service.chat_history and not replace:
+                counts["skipped"] += 1
+                continue
+            chat_service.restore_session(session_id, messages, {k: meta[k] for k in SESSION_META if k in meta})
+            if history_log:
+                history_log.drop(session_id)
+                history_log.append(session_id, messages)
+            counts["imported"] += 1
+            counts["messages"] += len(messages)
+    except ValueError as e:
+        # Sessions before the bad record are already in, say how many
+        return jsonify(dict(counts, error=str(e), status="error")), 400
+    logger.info(f"Imported {counts['imported']} sessions ({counts['messages']} messages), skipped {counts['skipped']}")
+    return jsonify(dict(counts, status="success"))
+
 # Add health check endpoint
 @app.route('/health', methods=['GET'])
 def health_check():
+    # Not ready while draining so load balancers and router.py stop sending traffic
+    if drain.draining.is_set():
+        return jsonify({
+            "status": "draining",
+            "version": __version__,
+            "timestamp": datetime.now().isoformat()
+        }), 503
     return jsonify({
         "status": "healthy",
         "version": __version__,
@@ -97,7 +427,11 @@ def root():
         "description": __description__,
         "endpoints": {
             "chat": "/chat",
-            "health": "/health"
+            "batch": "/chat/batch",
+            "websocket": SOCKET_PATH if chat_socket else None,
+            "messages": "/sessions/<session_id>/messages",
+            "health": "/health",
+            "metrics": "/metrics"
         }
     })
 
@@ -114,13 +448,14 @@ if __name__ == '__main__':
         logger.info("Starting ChatGenie server (Development Mode)...")
         logger.info(f"Server time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
         logger.info("Debug mode: enabled")
-        logger.info("Server port: 5000")
+        port = int(os.environ.get('PORT', 5000))  # set per worker when running behind router.py
+        logger.info(f"Server port: {port}")
         logger.info("CORS enabled for: http://localhost:5173")
         
         # Development server configuration
         app.run(
             host='0.0.0.0', 
-            port=5000, 
+            port=port, 
             debug=True,
             use_reloader=True
         )
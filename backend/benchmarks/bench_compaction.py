@@ -0,0 +1,109 @@
+"""Compare prompt history tokens with and without HistoryCompactor on a replay corpus.
+
+Each conversation is replayed turn by turn, building the chat history the
+way ChatService.generate_response does. Besides the history text in the
+prompt it reports the whole request: the prompt plus the SDK chat history,
+which the SDK resends every turn and which otherwise keeps every earlier
+full prompt. Run from the backend directory:
+    python benchmarks/bench_compaction.py
+    python benchmarks/bench_compaction.py --log-dir chat_log   # replay real sessions
+"""
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from chat import sdk_history, summarize_history  # noqa: E402
+from compaction import HistoryCompactor  # noqa: E402
+from tokens import estimate_tokens  # noqa: E402
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'replay_corpus.jsonl')
+
+
+def load_corpus(path=CORPUS):
+    with open(path, encoding='utf-8') as f:
+        return {c['name']: c['messages'] for c in map(json.loads, f) if c}
+
+
+def load_log(directory):
+    from history_log import ConversationLog
+    return ConversationLog(directory).recover()
+
+
+def plain_history(history):
+    return chr(10).join(f"{msg['role']}: {msg['content']}" for msg in history) if history else "No previous messages"
+
+
+def replay(messages, compactor):
+    """Return (plain tokens, compacted tokens, turns) for one conversation."""
+    session = {}
+    plain = compacted = turns = 0
+    for index, message in enumerate(messages):
+        if message['role'] != 'user':
+            continue
+        history = summarize_history(messages[:index][-10:])
+        plain += estimate_tokens(plain_history(history))
+        compacted += estimate_tokens(compactor.render(history, message['content'], session))
+        turns += 1
+    return plain, compacted, turns
+
+
+def turn_tokens(turns):
+    return sum(estimate_tokens(turn['parts'][0]) for turn in turns)
+
+
+def replay_requests(messages, compactor):
+    """Return (plain tokens, compacted tokens, turns) for the full requests of one conversation.
+
+    Without compaction the SDK chat accumulates each prompt and reply as
+    sent; with it the chat history is reseeded with the compacted messages.
+    """
+    session = {}
+    chat = []
+    plain = compacted = turns = 0
+    for index, message in enumerate(messages):
+        if message['role'] != 'user':
+            continue
+        history = summarize_history(messages[:index][-10:])
+        prompt = plain_history(history) + chr(10) + message['content']
+        plain += turn_tokens(chat) + estimate_tokens(prompt)
+        reply = messages[index + 1]['content'] if index + 1 < len(messages) else ''
+        chat += [{"role": "user", "parts": [prompt]}, {"role": "model", "parts": [reply]}]
+
+        seeded = sdk_history(session, compactor, messages[:index])
+        prompt = compactor.render(history, message['content'], session) + chr(10) + message['content']
+        compacted += turn_tokens(seeded) + estimate_tokens(prompt)
+        turns += 1
+    return plain, compacted, turns
+
+
+def row(plain, compacted):
+    return f"{plain:>12}{compacted:>13}{(1 - compacted / plain if plain else 0.0):>8.1%}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--corpus', default=CORPUS, help='JSONL file of {"name", "messages"} conversations')
+    parser.add_argument('--log-dir', help='replay sessions from a ConversationLog directory instead')
+    args = parser.parse_args(argv)
+
+    conversations = load_log(args.log_dir) if args.log_dir else load_corpus(args.corpus)
+    compactor = HistoryCompactor()
+    totals = [0, 0, 0, 0, 0]
+    print(f"{'':<35}{'history text':^33}{'whole request':^33}")
+    print(f"{'conversation':<28}{'turns':>7}" + f"{'plain tok':>12}{'compact tok':>13}{'saved':>8}" * 2)
+    for name, messages in conversations.items():
+        plain, compacted, turns = replay(messages, compactor)
+        request_plain, request_compacted, _ = replay_requests(messages, compactor)
+        totals = [a + b for a, b in zip(totals, (plain, compacted, request_plain, request_compacted, turns))]
+        print(f"{name[:27]:<28}{turns:>7}{row(plain, compacted)}{row(request_plain, request_compacted)}")
+    plain, compacted, request_plain, request_compacted, turns = totals
+    print(f"{'total':<28}{turns:>7}{row(plain, compacted)}{row(request_plain, request_compacted)}")
+    print(f"blocks elided: {compactor.metrics['elided']}, re-inflated: {compactor.metrics['inflated']}")
+    return totals
+
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""Compare per-request JSON CPU time of Flask's default provider and FastJSONProvider.
+
+Run from the backend directory:
+    python benchmarks/bench_json.py
+"""
+import os
+import sys
+import timeit
+from collections import Counter
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from json_provider import FastJSONProvider, orjson  # noqa: E402
+
+# Payload sizes seen by /chat: a short prompt in, up to MAX_RESPONSE_LENGTH out
+REQUEST_BODY = (
+    '{"message": "How do I paginate a SQL query in Flask without loading every row?", '
+    '"username": "User", "timestamp": "2025-03-01 12:00:00", '
+    '"sessionId": "1740830400.123456", "regenerate": false}'
+).encode('utf-8')
+RESPONSE_SIZES = {'short': 400, 'code-heavy': 8192}
+
+
+def response_payload(size):
+    text = ("## Answer\n```python\nrows = query.limit(50).offset(page * 50)\n```\n" * 200)[:size]
+    return {"response": text, "timestamp": "2025-03-01 12:00:00", "status": "success", "sessionId": "abc"}
+
+
+def per_call_us(func, number):
+    return min(timeit.repeat(func, number=number, repeat=5)) / number * 1e6
+
+
+def main(number=5000):
+    app = Flask(__name__)
+    providers = {'stdlib': DefaultJSONProvider(app), 'fast': FastJSONProvider(app)}
+    print(f"orjson available: {orjson is not None}")
+    results = {}
+    for name, provider in providers.items():
+        results[name] = {'parse request': per_call_us(lambda: provider.loads(REQUEST_BODY), number)}
+        for label, size in RESPONSE_SIZES.items():
+            payload = response_payload(size)
+            with app.app_context():
+                results[name][f'jsonify {label} ({size} B)'] = per_call_us(lambda: provider.response(payload), number)
+        metrics = {"errors": Counter({f"error {i}": i for i in range(50)}), "total_requests": 1000}
+        results[name]['metrics'] = per_call_us(lambda: provider.dumps(metrics), number)
+
+    print(f"{'operation':<32}{'stdlib us':>12}{'fast us':>12}{'saved us':>12}")
+    for operation in results['stdlib']:
+        slow, fast = results['stdlib'][operation], results['fast'][operation]
+        print(f"{operation:<32}{slow:>12.2f}{fast:>12.2f}{slow - fast:>12.2f}")
+
+
+if __name__ == '__main__':
+    main()
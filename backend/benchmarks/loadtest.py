@@ -0,0 +1,412 @@
+"""Drive ChatGenie with concurrent multi-turn conversations and check latency SLOs.
+
+Each virtual user replays conversations from the replay corpus, one turn at a
+time with a think time between turns. The report has throughput, latency
+percentiles and error rate; with --slo the exit code is 1 when a limit is
+broken, so CI can catch regressions.
+
+Run from the backend directory. Against a server with the local fake model:
+    python benchmarks/loadtest.py --spawn --users 20 --duration 30 --slo benchmarks/slo.json
+Compare server modes:
+    python benchmarks/loadtest.py --spawn --server dev
+    python benchmarks/loadtest.py --spawn --server gunicorn --env SCHEDULER_SLOTS=16
+Against a running server:
+    python benchmarks/loadtest.py --url http://127.0.0.1:5000 --mode batch
+Compare transports (ws keeps one WebSocket per conversation, needs flask-sock):
+    python benchmarks/loadtest.py --spawn --mode ws
+"""
+import argparse
+import json
+import math
+import os
+import random
+import shlex
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+import requests
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CORPUS = os.path.join(BACKEND_DIR, 'benchmarks', 'replay_corpus.jsonl')
+
+# Spawned servers answer with the fake model and don't rate limit the load generator
+SPAWN_ENV = {
+    'FAKE_MODEL': 'true',
+    'RATE_LIMIT_STORAGE_URI': 'memory://',
+    'RATE_LIMIT_CHAT_CAPACITY': '1000000',
+    'RATE_LIMIT_BATCH_CAPACITY': '1000000',
+    'RATE_LIMIT_IP_LIMITS': '1000000 per minute',
+    'HISTORY_LOG_ENABLED': 'false',
+    'CONFIG_RELOAD': 'false',
+    'UPSTREAM_WARMUP': 'false'
+}
+SERVERS = {
+    # Threaded werkzeug without the debugger or reloader
+    'werkzeug': "{python} -c \"import app; app.app.run(host='127.0.0.1', port={port}, threaded=True)\"",
+    # What `python app.py` runs: debug mode with the reloader
+    'dev': "{python} app.py",
+    'gunicorn': "gunicorn --workers {workers} --worker-class gthread --threads 16 --bind 127.0.0.1:{port} app:app"
+}
+SLO_KEYS = {'p50_ms', 'p95_ms', 'p99_ms', 'max_ms', 'max_error_rate', 'min_throughput'}
+
+
+def load_conversations(path=CORPUS):
+    """User turns of each conversation in the corpus."""
+    with open(path, encoding='utf-8') as f:
+        conversations = [json.loads(line)['messages'] for line in f if line.strip()]
+    return [[m['content'] for m in messages if m['role'] == 'user'] for messages in conversations]
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a sorted list."""
+    if not values:
+        return None
+    rank = max(1, math.ceil(pct / 100 * len(values)))
+    return values[rank - 1]
+
+
+class Results:
+    """Thread-safe samples per endpoint."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.first_byte = defaultdict(list)
+        self.requests = Counter()
+        self.errors = defaultdict(Counter)
+
+    def record(self, endpoint, latency, error=None, first_byte=None):
+        with self.lock:
+            self.requests[endpoint] += 1
+            self.latencies[endpoint].append(latency)
+            if first_byte is not None:
+                self.first_byte[endpoint].append(first_byte)
+            if error:
+                self.errors[endpoint][error] += 1
+
+    def summary(self, elapsed):
+        report = {}
+        for endpoint in sorted(self.requests):
+            count = self.requests[endpoint]
+            errors = sum(self.errors[endpoint].values())
+            report[endpoint] = dict(
+                requests=count,
+                errors=errors,
+                error_rate=round(errors / count, 4),
+                throughput=round(count / elapsed, 2),
+                errors_by_kind=dict(self.errors[endpoint]),
+                **latency_summary(self.latencies[endpoint])
+            )
+            if self.first_byte[endpoint]:
+                report[endpoint]['first_byte'] = latency_summary(self.first_byte[endpoint])
+        return report
+
+
+def latency_summary(samples):
+    ordered = sorted(samples)
+    return {
+        f"{name}_ms": round(value * 1000, 1) if value is not None else None
+        for name, value in (
+            ('p50', percentile(ordered, 50)),
+            ('p95', percentile(ordered, 95)),
+            ('p99', percentile(ordered, 99)),
+            ('max', ordered[-1] if ordered else None)
+        )
+    }
+
+
+def error_kind(response):
+    """None for a good answer, otherwise a short label for the report."""
+    if response.status_code != 200:
+        return f"http_{response.status_code}"
+    try:
+        body = response.json()
+    except ValueError:
+        return 'bad_json'
+    # Quota errors come back as 200 with status "delayed"
+    return None if body.get('status') == 'success' else f"status_{body.get('status')}"
+
+
+class VirtualUser(threading.Thread):
+    """Replays conversations turn by turn until the deadline."""
+
+    def __init__(self, index, args, conversations, results, deadline):
+        super().__init__(name=f"user-{index}", daemon=True)
+        self.index = index
+        self.args = args
+        self.conversations = conversations
+        self.results = results
+        self.deadline = deadline
+        self.random = random.Random(args.seed + index)
+        self.http = requests.Session()
+        self.http.headers['X-User-Id'] = f"loadtest-{index}"
+
+    def run(self):
+        time.sleep(self.args.ramp_up * self.index / max(1, self.args.users))
+        round_number = 0
+        while time.monotonic() < self.deadline:
+            conversation = self.conversations[(self.index + round_number) % len(self.conversations)]
+            session_id = f"loadtest-{self.index}-{round_number}-{self.args.seed}"
+            if self.args.mode == 'batch':
+                self.batch(conversation, session_id)
+            elif self.args.mode == 'ws':
+                self.websocket(conversation, session_id)
+            else:
+                for message in conversation:
+                    if time.monotonic() >= self.deadline:
+                        return
+                    self.chat(message, session_id)
+                    self.think()
+            round_number += 1
+
+    def think(self):
+        if self.args.think_time:
+            time.sleep(self.random.uniform(0.5, 1.5) * self.args.think_time)
+
+    def chat(self, message, session_id):
+        payload = {
+            "message": message,
+            "sessionId": session_id,
+            "username": f"loadtest{self.index}",
+            "timestamp": datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        }
+        started = time.perf_counter()
+        try:
+            response = self.http.post(f"{self.args.url}/chat", json=payload, timeout=self.args.timeout)
+            error = error_kind(response)
+        except requests.RequestException as e:
+            error = type(e).__name__
+        self.results.record('chat', time.perf_counter() - started, error)
+
+    def batch(self, conversation, session_id):
+        # Independent questions, each in its own session, streamed back as NDJSON
+        items = [{"message": message, "sessionId": f"{session_id}-{n}"}
+                 for n, message in enumerate(conversation[:self.args.batch_size])]
+        started = time.perf_counter()
+        first_byte = None
+        error = None
+        try:
+            with self.http.post(f"{self.args.url}/chat/batch", json={"items": items},
+                                timeout=self.args.timeout, stream=True) as response:
+                if response.status_code != 200:
+                    error = f"http_{response.status_code}"
+                else:
+                    for line in response.iter_lines():
+                        if first_byte is None:
+                            first_byte = time.perf_counter() - started
+                        if line and json.loads(line).get('status') != 'success':
+                            error = error or 'item_error'
+        except (requests.RequestException, ValueError) as e:
+            error = type(e).__name__
+        self.results.record('chat/batch', time.perf_counter() - started, error, first_byte)
+        self.think()
+
+    def websocket(self, conversation, session_id):
+        # One connection for the whole conversation, first byte is the first streamed chunk
+        from simple_websocket import Client
+        url = self.args.url.replace('http', 'ws', 1) + f"/chat/ws?sessionId={session_id}"
+        try:
+            ws = Client.connect(url, headers={'X-User-Id': f"loadtest-{self.index}"})
+            ws.receive(self.args.timeout)
+        except Exception as e:
+            self.results.record('chat/ws', 0.0, f"connect_{type(e).__name__}")
+            return
+        try:
+            for message in conversation:
+                if time.monotonic() >= self.deadline:
+                    return
+                started = time.perf_counter()
+                first_byte = None
+                error = None
+                try:
+                    ws.send(json.dumps({"message": message, "username": f"loadtest{self.index}"}))
+                    while True:
+                        raw = ws.receive(self.args.timeout)
+                        if raw is None:
+                            error = 'Timeout'
+                            break
+                        event = json.loads(raw)
+                        if event['type'] == 'chunk' and first_byte is None:
+                            first_byte = time.perf_counter() - started
+                        if event['type'] in ('done', 'error'):
+                            error = None if event['type'] == 'done' else 'ws_error'
+                            break
+                except Exception as e:
+                    self.results.record('chat/ws', time.perf_counter() - started, type(e).__name__)
+                    return
+                self.results.record('chat/ws', time.perf_counter() - started, error, first_byte)
+                self.think()
+        finally:
+            ws.close()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def spawn_server(args):
+    """Start a local server with the fake model, returning (process, url)."""
+    port = free_port()
+    env = dict(os.environ, **SPAWN_ENV, PORT=str(port))
+    for item in args.env:
+        key, _, value = item.partition('=')
+        env[key] = value
+    command = args.server_cmd or SERVERS[args.server]
+    command = command.format(python=shlex.quote(sys.executable), port=port, workers=args.workers)
+    process = subprocess.Popen(
+        shlex.split(command), cwd=BACKEND_DIR, env=env,
+        stdout=subprocess.DEVNULL, stderr=None if args.verbose else subprocess.DEVNULL,
+        start_new_session=hasattr(os, 'killpg')
+    )
+    # `python app.py` listens on all interfaces, the others on loopback
+    url = f"http://127.0.0.1:{port}"
+    if not wait_healthy(url, process, args.startup_timeout):
+        stop_server(process)
+        raise RuntimeError(f"Server did not become healthy within {args.startup_timeout}s: {command}")
+    return process, url
+
+
+def wait_healthy(url, process=None, timeout=60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process and process.poll() is not None:
+            return False
+        try:
+            if requests.get(f"{url}/health", timeout=1).status_code == 200:
+                return True
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    return False
+
+
+def stop_server(process):
+    # The dev server's reloader runs the app in a child, stop the whole group
+    try:
+        if hasattr(os, 'killpg'):
+            os.killpg(process.pid, signal.SIGTERM)
+        else:
+            process.terminate()
+        process.wait(timeout=10)
+    except (ProcessLookupError, subprocess.TimeoutExpired):
+        process.kill()
+
+
+def check_slo(report, slo):
+    """Return a list of human-readable SLO violations.
+
+    The SLO file maps endpoints ("chat", "chat/batch") to limits, or holds
+    limits directly, which then apply to every endpoint.
+    """
+    violations = []
+    for endpoint, stats in report.items():
+        limits = slo.get(endpoint, slo) if isinstance(slo.get(endpoint), dict) else slo
+        unknown = set(k for k, v in limits.items() if not isinstance(v, dict)) - SLO_KEYS
+        if unknown:
+            raise ValueError(f"Unknown SLO keys: {', '.join(sorted(unknown))}")
+        for key in ('p50_ms', 'p95_ms', 'p99_ms', 'max_ms'):
+            if key in limits and stats[key] is not None and stats[key] > limits[key]:
+                violations.append(f"{endpoint}: {key} {stats[key]} > {limits[key]}")
+        if 'max_error_rate' in limits and stats['error_rate'] > limits['max_error_rate']:
+            violations.append(f"{endpoint}: error_rate {stats['error_rate']} > {limits['max_error_rate']}")
+        if 'min_throughput' in limits and stats['throughput'] < limits['min_throughput']:
+            violations.append(f"{endpoint}: throughput {stats['throughput']}/s < {limits['min_throughput']}/s")
+    return violations
+
+
+def print_report(report):
+    print(f"{'endpoint':<12}{'requests':>10}{'req/s':>9}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for endpoint, stats in report.items():
+        print(f"{endpoint:<12}{stats['requests']:>10}{stats['throughput']:>9}{stats['error_rate']:>8.1%}"
+              f"{stats['p50_ms']:>10}{stats['p95_ms']:>10}{stats['p99_ms']:>10}{stats['max_ms']:>10}")
+        if stats['errors_by_kind']:
+            print(f"{'':<12}errors: {', '.join(f'{k}={v}' for k, v in stats['errors_by_kind'].items())}")
+        if 'first_byte' in stats:
+            fb = stats['first_byte']
+            print(f"{'':<12}first byte p50 {fb['p50_ms']} ms, p95 {fb['p95_ms']} ms, p99 {fb['p99_ms']} ms")
+
+
+def run(args):
+    """Run one load test and return the report."""
+    conversations = load_conversations(args.corpus)
+    results = Results()
+    started = time.monotonic()
+    deadline = started + args.duration
+    users = [VirtualUser(i, args, conversations, results, deadline) for i in range(args.users)]
+    for user in users:
+        user.start()
+    for user in users:
+        user.join(args.duration + args.timeout + args.ramp_up)
+    return results.summary(time.monotonic() - started)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://127.0.0.1:5000', help='server to test, ignored with --spawn')
+    parser.add_argument('--spawn', action='store_true', help='start a local server with the fake model')
+    parser.add_argument('--server', choices=sorted(SERVERS), default='werkzeug', help='server mode for --spawn')
+    parser.add_argument('--server-cmd', help='custom command for --spawn, with {python}, {port} and {workers}')
+    parser.add_argument('--workers', type=int, default=2, help='worker processes for --server gunicorn')
+    parser.add_argument('--env', action='append', default=[], metavar='KEY=VALUE',
+                        help='extra environment for the spawned server, e.g. FAKE_MODEL_LATENCY=0.5')
+    parser.add_argument('--users', type=int, default=10, help='concurrent virtual users')
+    parser.add_argument('--duration', type=float, default=30.0, help='seconds to generate load')
+    parser.add_argument('--ramp-up', type=float, default=0.0, help='seconds over which users start')
+    parser.add_argument('--think-time', type=float, default=1.0, help='mean seconds between a user\'s turns')
+    parser.add_argument('--mode', choices=('chat', 'batch', 'ws'), default='chat')
+    parser.add_argument('--batch-size', type=int, default=4, help='items per batch in batch mode')
+    parser.add_argument('--timeout', type=float, default=60.0, help='per-request timeout in seconds')
+    parser.add_argument('--corpus', default=CORPUS, help='JSONL conversations to replay')
+    parser.add_argument('--slo', help='JSON file of latency and error limits, exit 1 when broken')
+    parser.add_argument('--json', help='also write the report to this file')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--startup-timeout', type=float, default=60.0)
+    parser.add_argument('--verbose', action='store_true', help='show the spawned server\'s log')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    slo = None
+    if args.slo:
+        with open(args.slo, encoding='utf-8') as f:
+            slo = json.load(f)
+    process = None
+    try:
+        if args.spawn:
+            process, args.url = spawn_server(args)
+        elif not wait_healthy(args.url, timeout=5):
+            print(f"No healthy server at {args.url}", file=sys.stderr)
+            return 2
+        print(f"Load testing {args.url}: {args.users} users, {args.duration:.0f}s, mode {args.mode}")
+        report = run(args)
+    finally:
+        if process:
+            stop_server(process)
+
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'args': vars(args), 'report': report}, f, indent=2)
+    if not report:
+        print("No requests completed", file=sys.stderr)
+        return 2
+    if slo:
+        violations = check_slo(report, slo)
+        for violation in violations:
+            print(f"SLO violated: {violation}", file=sys.stderr)
+        if violations:
+            return 1
+        print("SLO met")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -10,17 +10,151 @@ def summarize_history(history):
         return history[-5:]
     return history
 from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from bisect import bisect_right
+from contextlib import contextmanager, nullcontext
+import queue
+import threading
+import time
+import uuid
+from profiles import GENERATION_PROFILES, LatencyStats, classify_message, generation_config_for
+from compaction import HistoryCompactor
+from tokens import estimate_tokens, estimator, message_tokens
+from coalesce import TurnCoalescer, MAX_WINDOW_MS
 
 # Add constants
 MAX_HISTORY_LENGTH = 50
+BATCH_MAX_WORKERS = 4  # Concurrent upstream calls per batch
+MAX_BATCH_ITEMS = 500
+MAX_SYNC_PAGE = 500  # messages per history sync page
 # Update SESSION_TIMEOUT if needed
 SESSION_TIMEOUT = 3600  # 1 hour in seconds
+# Request data tied to the client connection, background work for the turn doesn't get it
+CONNECTION_KEYS = ('on_event', 'stream')
+
+# Response stand-in for answers that didn't come from a live model call
+class CachedResponse:
+    def __init__(self, text):
+        self.text = text
+        self.usage_metadata = None
+
+def has_last_turn(session, message):
+    # True when the session ends with a user/assistant pair for this message
+    messages = session.get('messages', [])
+    return (len(messages) >= 2 and messages[-1]['role'] == 'assistant'
+            and messages[-2]['role'] == 'user' and messages[-2]['content'] == message)
+
+def rewind_chat_instance(chat_instance):
+    # Remove the last exchange from the SDK's own chat history
+    try:
+        chat_instance.rewind()
+    except (AttributeError, IndexError):
+        pass
+
+def record_chat_turn(chat_instance, context, text):
+    # Add an exchange that didn't go through send_message to the SDK history
+    if not hasattr(chat_instance, 'history'):
+        return
+    chat_instance.history = list(chat_instance.history) + [
+        {"role": "user", "parts": [context]},
+        {"role": "model", "parts": [text]}
+    ]
+
+def assign_sequence_numbers(session, messages):
+    # Give each new message the next monotonic per-session sequence number
+    next_seq = session.get('next_seq', 1)
+    for message in messages:
+        message['seq'] = next_seq
+        next_seq += 1
+    session['next_seq'] = next_seq
+
+def sdk_history(session, compactor=None, messages=None, budget=None):
+    # Seed a new SDK chat with the stored messages so it keeps the conversation
+    messages = (session.get('messages', []) if messages is None else messages)[-MAX_HISTORY_LENGTH:]
+    if budget:
+        # The chat history is sent with every turn, so it keeps to the same token budget as the prompt
+        messages, _ = history_window(messages, budget)
+    contents = compactor.compact_messages(messages, session) if compactor else [m['content'] for m in messages]
+    return [
+        {"role": "model" if message['role'] == 'assistant' else "user", "parts": [content]}
+        for message, content in zip(messages, contents)
+    ]
+
+def chat_turn_text(turn):
+    # SDK history entries are Content objects, dicts when we seeded them, strings in some test doubles
+    parts = turn['parts'] if isinstance(turn, dict) else getattr(turn, 'parts', [turn])
+    return ''.join(part if isinstance(part, str) else getattr(part, 'text', '') for part in parts)
+
+def seed_chat_history(chat_instance, turns):
+    # Replace the SDK's own history, which keeps every full prompt and resends it each turn
+    if hasattr(chat_instance, 'history'):
+        chat_instance.history = list(turns)
+
+def history_window(messages, budget):
+    # Newest messages that fit the token budget, summing the stored counts
+    total = 0
+    start = len(messages)
+    while start > 0:
+        tokens = message_tokens(messages[start - 1])
+        # The newest message always goes in, even when it's over budget alone
+        if total + tokens > budget and start < len(messages):
+            break
+        total += tokens
+        start -= 1
+    return messages[start:], total
+
+def reply_token_count(response):
+    # Tokens Gemini counted for the reply, None for cached or mocked responses
+    usage = getattr(response, 'usage_metadata', None)
+    count = getattr(usage, 'candidates_token_count', None) if usage else None
+    return count if isinstance(count, int) and count > 0 else None
+
+def candidate_texts(response):
+    # Collect the text of every candidate in a generate_content response
+    texts = []
+    for candidate in getattr(response, 'candidates', None) or []:
+        parts = getattr(candidate.content, 'parts', [])
+        text = ''.join(getattr(part, 'text', '') for part in parts)
+        if text:
+            texts.append(text)
+    return texts
 
 # Handles chat operations, sessions, and AI responses
 class ChatService:
-    def __init__(self, model):
+    def __init__(self, model, admission=None, scheduler=None, spare_candidates=0, history_log=None,
+                 adaptive_profiles=False, router=None, compact_history=False, history_token_budget=None,
+                 coalesce_window_ms=0, session_store=None, generation_config=None):
         self.model = model
-        self.chat_history = {}
+        # Optional TokenAdmissionController guarding the upstream quota
+        self.admission = admission
+        # Optional RequestScheduler sharing upstream slots between users
+        self.scheduler = scheduler
+        # Alternative answers fetched per turn so regenerate can skip the model
+        self.spare_candidates = spare_candidates
+        self.background = None
+        # Optional ConversationLog that makes session messages durable
+        self.history_log = history_log
+        # Pick max tokens and temperature per message instead of one config for all
+        self.adaptive_profiles = adaptive_profiles
+        # The models' own generation config, profiles are scaled to it so reloaded values still apply
+        self.generation_config = generation_config
+        self.profile_stats = LatencyStats()
+        # Optional ModelRouter; `model` is then the router's capable model
+        self.router = router
+        # Stubs out old code blocks and tables in the prompt history
+        self.compactor = HistoryCompactor() if compact_history else None
+        # Most tokens of chat history put in a prompt (None keeps the message count limit only)
+        self.history_token_budget = history_token_budget
+        # Debounce window merging a session's rapid messages into one turn (0 unless a session opts in)
+        self.coalesce_window_ms = coalesce_window_ms
+        self.coalescer = TurnCoalescer()
+        # Bumped by swap_models so sessions know their chat instances are stale
+        self.model_generation = 0
+        # Guards model, router and model_generation, and counts running turns per generation
+        self.models_lock = threading.Condition()
+        self.turns_by_generation = Counter()
+        # Optional TieredSessionStore that moves idle sessions to disk, a plain dict otherwise
+        self.chat_history = session_store if session_store is not None else {}
         self.last_cleanup = datetime.now()
         self.metrics = {
             'total_requests': 0,
@@ -42,6 +176,8 @@ class ChatService:
         
         for session_id in expired_sessions:
             del self.chat_history[session_id]
+            if self.history_log:
+                self.history_log.drop(session_id)
         
         cleaned = initial_count - len(self.chat_history)
         self.metrics['cleaned_sessions'] = self.metrics.get('cleaned_sessions', 0) + cleaned
@@ -55,25 +191,7 @@ class ChatService:
                 raise ValueError(error_msg)
                 
             try:
-                data = request.json
-                if not data:
-                    error_msg = "🚫 Oops! No data was sent with the request"
-                    self.metrics['errors'][error_msg] += 1
-                    raise ValueError(error_msg)
-                
-                message = data.get('message')
-                if not message:
-                    error_msg = "📝 Hey! You need to include a message"
-                    self.metrics['errors'][error_msg] += 1
-                    raise ValueError(error_msg)
-                    
-                return {
-                    'message': message,
-                    'timestamp': data.get('timestamp', datetime.now().strftime('%Y-%m-%d %H:%M:%S')),
-                    'username': data.get('username', 'User'),
-                    'session_id': data.get('sessionId', str(datetime.now().timestamp())),
-                    'regenerate': data.get('regenerate', False)
-                }
+                return self.parse_payload(request.json)
             except AttributeError:
                 error_msg = "Invalid request format"
                 self.metrics['errors'][error_msg] += 1
@@ -83,6 +201,101 @@ class ChatService:
                 self.metrics['errors'][str(e)] += 1
             raise
 
+    def parse_payload(self, data, default_session_id=None):
+        """Turn a chat payload into the data dict used by the service."""
+        if not data:
+            error_msg = "🚫 Oops! No data was sent with the request"
+            self.metrics['errors'][error_msg] += 1
+            raise ValueError(error_msg)
+
+        message = data.get('message')
+        if not message:
+            error_msg = "📝 Hey! You need to include a message"
+            self.metrics['errors'][error_msg] += 1
+            raise ValueError(error_msg)
+
+        profile = data.get('profile')
+        if profile is not None and profile not in GENERATION_PROFILES:
+            error_msg = f"Unknown profile '{profile}', use one of: {', '.join(GENERATION_PROFILES)}"
+            self.metrics['errors'][error_msg] += 1
+            raise ValueError(error_msg)
+
+        coalesce_ms = data.get('coalesceMs')
+        if coalesce_ms is not None and (isinstance(coalesce_ms, bool) or not isinstance(coalesce_ms, (int, float))
+                                        or coalesce_ms < 0):
+            error_msg = "coalesceMs must be a number of milliseconds"
+            self.metrics['errors'][error_msg] += 1
+            raise ValueError(error_msg)
+
+        return {
+            'message': message,
+            'timestamp': data.get('timestamp', datetime.now().strftime('%Y-%m-%d %H:%M:%S')),
+            'username': data.get('username', 'User'),
+            # Server-issued ids are random, the sync endpoint serves a session to whoever knows its id
+            'session_id': data.get('sessionId', default_session_id or uuid.uuid4().hex),
+            'regenerate': data.get('regenerate', False),
+            'profile': profile,
+            'coalesce_ms': coalesce_ms
+        }
+
+    def generate_batch(self, items, max_workers=BATCH_MAX_WORKERS, username=None, user_id=None):
+        """Run many chat turns on a bounded pool, yielding results as they finish.
+
+        Turns that share a session run one after another in their original
+        order; different sessions run concurrently.
+        """
+        turns_by_session = {}
+        total = 0
+        for index, item in enumerate(items):
+            total += 1
+            try:
+                if not isinstance(item, dict):
+                    raise ValueError("Invalid request format")
+                if username and 'username' not in item:
+                    item = dict(item, username=username)
+                # Items without a session each get their own
+                data = self.parse_payload(item, default_session_id=f"batch-{uuid.uuid4().hex}")
+            except (ValueError, AttributeError) as e:
+                total -= 1
+                yield {"index": index, "status": "error", "error": str(e)}
+                continue
+            data['priority'] = 'batch'
+            data['user_id'] = user_id
+            turns_by_session.setdefault(data['session_id'], []).append((index, data))
+
+        self.metrics['batch_items'] = self.metrics.get('batch_items', 0) + total
+        results = queue.Queue()
+
+        def run_turns(turns):
+            for index, data in turns:
+                try:
+                    session = self.get_or_create_session(data)
+                    response = self.generate_response(session, data)
+                    results.put({
+                        "index": index,
+                        "sessionId": data['session_id'],
+                        "status": "success",
+                        "response": response.text.strip(),
+                        "timestamp": data['timestamp']
+                    })
+                except Exception as e:
+                    results.put({
+                        "index": index,
+                        "sessionId": data['session_id'],
+                        "status": "error",
+                        "error": str(e)
+                    })
+
+        pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='chat-batch')
+        try:
+            for turns in turns_by_session.values():
+                pool.submit(run_turns, turns)
+            for _ in range(total):
+                yield results.get()
+        finally:
+            # Stop queued turns if the client goes away mid-stream
+            pool.shutdown(wait=False, cancel_futures=True)
+
     def get_or_create_session(self, data):
         # Add periodic cleanup check
         if (datetime.now() - self.last_cleanup).seconds > 3600:
@@ -91,14 +304,100 @@ class ChatService:
         # Get existing chat session or create new one
         session_id = data['session_id']
         if session_id not in self.chat_history:
-            self.chat_history[session_id] = {
+            # setdefault keeps the first one when two requests create the session at once
+            self.chat_history.setdefault(session_id, {
                 'messages': [],
-                'chat_instance': self.model.start_chat(history=[])
-            }
-        return self.chat_history[session_id]
+                'chat_instance': self.model.start_chat(history=[]),
+                'model_generation': self.model_generation,
+                # Only this user can read the session back through get_messages_since
+                'owner': data.get('user_id')
+            })
+        session = self.chat_history[session_id]
+        # Restored sessions, and sessions from before a model reload, get a new chat instance
+        self.chat_instance_for(session, None)
+        return session
+
+    def restore_sessions(self, sessions):
+        """Load recovered {session_id: [messages]} back into chat_history."""
+        for session_id, messages in sessions.items():
+            self.restore_session(session_id, messages)
+        return len(sessions)
+
+    def restore_session(self, session_id, messages, meta=None):
+        """Put one session back from its stored messages; its chat is rebuilt on the next turn."""
+        session = {
+            'messages': [],
+            'chat_instance': None,
+            'last_access': datetime.now()
+        }
+        # Older log entries may predate sequence numbers
+        session['next_seq'] = max((m.get('seq', 0) for m in messages), default=0) + 1
+        assign_sequence_numbers(session, [m for m in messages if 'seq' not in m])
+        # Older log entries may also predate token counts
+        for message in messages:
+            message_tokens(message)
+        session['messages'] = messages
+        # Imported sessions bring their counters along
+        for key, value in (meta or {}).items():
+            if key == 'next_seq':
+                value = max(value, session['next_seq'])
+            session[key] = value
+        self.chat_history[session_id] = session
+        return session
+
+    def get_messages_since(self, session_id, since=0, limit=100, user_id=None):
+        """Return (messages, last_seq, has_more) for messages after `since`, or None.
+
+        Sessions created with a user id are None for any other user.
+        """
+        session = self.chat_history.get(session_id)
+        if session is None or session.get('owner') not in (None, user_id):
+            return None
+        messages = session.get('messages', [])
+        limit = max(1, min(limit, MAX_SYNC_PAGE))
+        # Sequence numbers only grow, so a binary search finds the page start
+        start = bisect_right(messages, since, key=lambda m: m.get('seq', 0))
+        page = messages[start:start + limit]
+        return page, session.get('next_seq', 1) - 1, start + limit < len(messages)
+
+    def respond(self, session, data):
+        """Answer one chat request; returns (response, data) for format_chat_response.
+
+        Sessions with a debounce window have messages that arrive within it
+        merged into one turn, and every request of the burst gets its answer.
+        """
+        if data.get('coalesce_ms') is not None:
+            # The window sticks to the session until the client changes it
+            session['coalesce_ms'] = min(data['coalesce_ms'], MAX_WINDOW_MS)
+        window_ms = session.get('coalesce_ms', self.coalesce_window_ms)
+        if not window_ms or data.get('regenerate'):
+            return self.generate_response(session, data), data
+        return self.coalescer.submit(data['session_id'], data, window_ms / 1000,
+                                     lambda merged: self.generate_response(session, merged))
+
+    def session_lock(self, session):
+        """Lock held for a session's turn so concurrent turns can't interleave its history."""
+        if not session or not isinstance(session, dict):
+            return nullcontext()
+        # dict.setdefault is atomic, two first turns still get the same lock
+        return session.setdefault('turn_lock', threading.Lock())
 
     def generate_response(self, session, data):
         """Generate AI response using chat context."""
+        with self.session_lock(session):
+            with self.models_lock:
+                generation = self.model_generation
+                self.turns_by_generation[generation] += 1
+            try:
+                return self._generate_response(session, data)
+            finally:
+                with self.models_lock:
+                    self.turns_by_generation[generation] -= 1
+                    if not self.turns_by_generation[generation]:
+                        del self.turns_by_generation[generation]
+                        self.models_lock.notify_all()
+
+    def _generate_response(self, session, data):
         self.metrics['total_requests'] += 1
         try:
             if not session or not isinstance(session, dict):
@@ -106,17 +405,42 @@ class ChatService:
                 self.metrics['errors'][error_msg] += 1
                 raise ValueError(error_msg)
                 
-            # Get chat history
-            history = session.get('messages', [])[-10:] # Last 10 messages
-            
-            # Compress long messages
-            if len(history) > 5:
-                history = summarize_history(history)
+            # Regenerate replaces the last turn, so leave it out of the context
+            regenerate = bool(data.get('regenerate')) and has_last_turn(session, data['message'])
+            messages = session.get('messages', [])
+            if regenerate:
+                messages = messages[:-2]
+
+            # An explicit profile wins, otherwise classify the message when enabled
+            profile = data.get('profile') or (classify_message(data['message']) if self.adaptive_profiles else None)
+            data['profile'] = profile
+            send_options = {}
+            if profile:
+                send_options['generation_config'] = generation_config_for(profile, self.generation_config)
+
+            if self.history_token_budget:
+                # As many recent messages as fit the token budget, whatever their count
+                history, data['history_tokens'] = history_window(
+                    messages[-MAX_HISTORY_LENGTH:], self.history_token_budget
+                )
+            else:
+                # Get chat history
+                history = messages[-10:] # Last 10 messages
+
+                # Compress long messages
+                if len(history) > 5:
+                    history = summarize_history(history)
                 
-            history_text = chr(10).join([
-                f"{msg['role']}: {msg['content']}" 
-                for msg in history
-            ]) if history else "No previous messages"
+            chat_turns = None
+            if self.compactor:
+                history_text = self.compactor.render(history, data['message'], session)
+                # The SDK chat history goes upstream too, send it compacted as well
+                chat_turns = sdk_history(session, self.compactor, messages, self.history_token_budget)
+            else:
+                history_text = chr(10).join([
+                    f"{msg['role']}: {msg['content']}" 
+                    for msg in history
+                ]) if history else "No previous messages"
                 
             # Enhanced context with formatting guidelines
             context = f"""
@@ -153,15 +477,81 @@ Response Guidelines:
    - 3-dash separators
 """
 
-            # Get response and validate
-            response = session['chat_instance'].send_message(context, stream=False)
+            # Serve a regenerate from a cached spare candidate when we have one
+            response = self.take_spare_candidate(session) if regenerate else None
+            previous_chat = self.chat_instance_for(session, session.get('last_model'))
+            if response:
+                self.metrics['spare_hits'] = self.metrics.get('spare_hits', 0) + 1
+                rewind_chat_instance(previous_chat)
+                record_chat_turn(previous_chat, context, response.text)
+                data['model'] = session.get('last_model')
+            else:
+                if regenerate:
+                    if self.spare_candidates:
+                        self.metrics['spare_misses'] = self.metrics.get('spare_misses', 0) + 1
+                    # Drop the old turn so the SDK history doesn't keep both answers
+                    rewind_chat_instance(previous_chat)
+
+                started = time.perf_counter()
+                model_name = None
+                if self.router:
+                    model_name, _ = self.router.choose(data['message'], profile, regenerate)
+                chat_instance = self.chat_instance_for(session, model_name)
+                # Each model keeps its own chat, it hasn't seen the turns another model answered
+                self.prepare_chat(chat_instance, session, messages, chat_turns,
+                                  stale=session.get('last_model') != model_name)
+                response = self.call_model(chat_instance, context, data, send_options, model_name)
+                if self.router and self.router.can_escalate(model_name):
+                    try:
+                        validate_model_response(response)
+                    except ValueError as e:
+                        # The fast model's answer didn't pass, retry once on the capable one
+                        rewind_chat_instance(chat_instance)
+                        model_name = self.router.escalate(str(e))
+                        # Streaming callers drop the chunks they got so far
+                        self.emit(data, 'retrying', reason=str(e), model=model_name)
+                        chat_instance = self.chat_instance_for(session, model_name)
+                        self.prepare_chat(chat_instance, session, messages, chat_turns,
+                                          stale=session.get('last_model') != model_name)
+                        response = self.call_model(chat_instance, context, data, send_options, model_name)
+                if profile:
+                    self.profile_stats.record(profile, time.perf_counter() - started)
+                data['model'] = model_name
+                session['last_model'] = model_name
             validate_model_response(response)
             
-            # Update history
-            session['messages'].extend([
-                {"role": "user", "content": data['message']},
-                {"role": "assistant", "content": response.text}
-            ])
+            # Real reply sizes keep the local estimator calibrated
+            reply_tokens = reply_token_count(response)
+            if reply_tokens:
+                estimator.calibrate(response.text, reply_tokens)
+
+            # Update history, replacing the last turn on regenerate
+            turn_messages = [
+                {"role": "user", "content": data['message'], "tokens": estimate_tokens(data['message'])},
+                {"role": "assistant", "content": response.text,
+                 "tokens": reply_tokens or estimate_tokens(response.text)}
+            ]
+            if regenerate:
+                # Replacements get new sequence numbers so syncing clients see them
+                for new, old in zip(turn_messages, session['messages'][-2:]):
+                    if 'seq' in old:
+                        new['replaces'] = old['seq']
+                del session['messages'][-2:]
+            else:
+                session['turn'] = session.get('turn', 0) + 1
+                session.pop('spare_candidates', None)
+            assign_sequence_numbers(session, turn_messages)
+            data['seq'] = turn_messages[-1]['seq']
+            session['messages'].extend(turn_messages)
+
+            # Only enqueues, the log is written by a background thread
+            if self.history_log:
+                if regenerate:
+                    self.history_log.truncate(data['session_id'], 2)
+                self.history_log.append(data['session_id'], turn_messages)
+
+            if self.spare_candidates and not isinstance(response, CachedResponse):
+                self.request_spare_candidates(session, data, context)
             
             # Update metrics
             self.metrics['successful_responses'] += 1
@@ -171,6 +561,191 @@ Response Guidelines:
             self.metrics['errors'][str(e)] += 1
             raise
 
+    def emit(self, data, event, **fields):
+        """Tell a streaming caller what its turn is doing (queued, retrying, chunk)."""
+        on_event = data.get('on_event')
+        if on_event:
+            on_event(event, fields)
+
+    def call_model(self, chat_instance, context, data, send_options, model_name=None):
+        """Send one turn upstream, holding token budget and a scheduler slot.
+
+        With `data['stream']` set the reply is streamed and every piece is
+        emitted as a chunk event as it arrives.
+        """
+        started = time.perf_counter()
+        stream = bool(data.get('stream'))
+        # The SDK sends its chat history along with the prompt, budget for both
+        history = getattr(chat_instance, 'history', None) or []
+        prompt = chr(10).join([chat_turn_text(turn) for turn in history] + [context])
+        with self.upstream_call(data, prompt) as ticket:
+            response = chat_instance.send_message(context, stream=stream, **send_options)
+            if stream:
+                # Reading the whole stream completes the response and the chat history
+                for chunk in response:
+                    self.emit(data, 'chunk', text=chunk.text)
+            if ticket:
+                self.admission.reconcile(ticket, getattr(response, 'usage_metadata', None))
+        if self.router and model_name:
+            self.router.record_latency(model_name, time.perf_counter() - started)
+        return response
+
+    def prepare_chat(self, chat_instance, session, messages, chat_turns=None, stale=False):
+        """Set the SDK chat history that goes upstream with this turn.
+
+        Compacted turns replace it every time. Without compaction the chat
+        keeps every full prompt it was sent, so it's rebuilt from the stored
+        messages once it outgrows MAX_HISTORY_LENGTH or the token budget, or
+        when it's `stale`: the last turn was answered on another model's chat.
+        """
+        if chat_turns is None and (stale or self.chat_over_limit(chat_instance)):
+            chat_turns = sdk_history(session, None, messages, self.history_token_budget)
+        if chat_turns is not None:
+            seed_chat_history(chat_instance, chat_turns)
+
+    def chat_over_limit(self, chat_instance):
+        history = getattr(chat_instance, 'history', None) or []
+        if len(history) > MAX_HISTORY_LENGTH:
+            return True
+        if not self.history_token_budget:
+            return False
+        tokens = 0
+        for turn in history:
+            tokens += estimate_tokens(chat_turn_text(turn))
+            if tokens > self.history_token_budget:
+                return True
+        return False
+
+    def active_models(self):
+        """(model, router, model_generation) as one consistent snapshot."""
+        with self.models_lock:
+            return self.model, self.router, self.model_generation
+
+    def model_named(self, name):
+        model, router, _ = self.active_models()
+        if router and name in router.models:
+            return router.models[name]
+        return model
+
+    def chat_instance_for(self, session, name):
+        """The session's SDK chat for a model, started on first use."""
+        model, router, generation = self.active_models()
+        if session.get('model_generation', 0) != generation:
+            # The models were reloaded, chats bound to the old ones are rebuilt below
+            session['model_generation'] = generation
+            session['chat_instance'] = None
+            session.pop('model_chats', None)
+        if not router or name not in router.models or name == router.capable:
+            if session.get('chat_instance') is None:
+                session['chat_instance'] = model.start_chat(history=sdk_history(session, self.compactor, budget=self.history_token_budget))
+            return session['chat_instance']
+        chats = session.setdefault('model_chats', {})
+        if name not in chats:
+            chats[name] = router.models[name].start_chat(
+                history=sdk_history(session, self.compactor, budget=self.history_token_budget)
+            )
+        return chats[name]
+
+    def swap_models(self, model, router=None, generation_config=None):
+        """Start using new models; each session moves over on its next turn.
+
+        Returns the outgoing models, for closing once wait_for_turns says
+        nothing runs on them anymore.
+        """
+        with self.models_lock:
+            outgoing = [self.model] + (list(self.router.models.values()) if self.router else [])
+            self.model, self.router = model, router
+            if generation_config is not None:
+                self.generation_config = generation_config
+            self.model_generation += 1
+        # The capable model is also in the router, close it once
+        return list({id(m): m for m in outgoing}.values())
+
+    def wait_for_turns(self, generation, timeout=None):
+        """Wait until no turn started before `generation` is running; False on timeout."""
+        with self.models_lock:
+            return self.models_lock.wait_for(
+                lambda: not any(count for gen, count in self.turns_by_generation.items() if gen < generation),
+                timeout
+            )
+
+    def take_spare_candidate(self, session):
+        """Pop a cached alternative answer for the session's last turn, if any."""
+        spares = session.get('spare_candidates')
+        if not spares or spares['turn'] != session.get('turn'):
+            return None
+        if not spares['texts']:
+            return None
+        return CachedResponse(spares['texts'].pop(0))
+
+    def request_spare_candidates(self, session, data, context):
+        """Fetch alternative answers for this turn in the background."""
+        if self.background is None:
+            self.background = ThreadPoolExecutor(max_workers=2, thread_name_prefix='chat-spares')
+        turn = session.get('turn')
+        # The turn has answered by the time this runs, its client mustn't get events from it
+        spare_data = {key: value for key, value in data.items() if key not in CONNECTION_KEYS}
+        spare_data.update(priority='batch', regenerate=False)
+        profile = data.get('profile')
+        generation_config = generation_config_for(profile, self.generation_config) if profile else {}
+        generation_config["candidate_count"] = self.spare_candidates
+
+        def fetch():
+            try:
+                with self.upstream_call(spare_data, context) as ticket:
+                    # Chat sessions reject candidate_count > 1, so ask the model directly
+                    model = self.model_named(data.get('model'))
+                    result = model.generate_content(context, generation_config=generation_config)
+                    if ticket:
+                        self.admission.reconcile(ticket, getattr(result, 'usage_metadata', None))
+                texts = []
+                for text in candidate_texts(result):
+                    try:
+                        validate_model_response(CachedResponse(text))
+                        texts.append(text)
+                    except ValueError:
+                        continue
+                # Only keep them if the conversation hasn't moved on
+                if session.get('turn') == turn and texts:
+                    session['spare_candidates'] = {'turn': turn, 'texts': texts}
+            except Exception as e:
+                self.metrics['errors'][f"Spare candidates failed: {e}"] += 1
+
+        # Kept on the session so it isn't moved to disk while the fetch can still write to it
+        session['spare_fetch'] = self.background.submit(fetch)
+
+    @contextmanager
+    def upstream_call(self, data, prompt):
+        """Reserve token budget for `prompt`, then hold a scheduler slot, for one upstream call.
+
+        Budget comes first so a request waiting on it doesn't keep a slot
+        from requests that could run; it's refunded if no slot comes.
+        """
+        ticket = self.admission.admit(prompt) if self.admission else None
+        calling = False
+        try:
+            with self.upstream_slot(data):
+                calling = True
+                yield ticket
+        except BaseException:
+            if ticket and not calling:
+                self.admission.refund(ticket)
+            raise
+
+    def upstream_slot(self, data):
+        """Context manager holding a scheduler slot for one upstream call."""
+        if not self.scheduler:
+            return nullcontext()
+        priority = data.get('priority') or ('regenerate' if data.get('regenerate') else 'interactive')
+        if data.get('user_id'):
+            flow = f"user:{data['user_id']}"
+        else:
+            flow = f"session:{data.get('session_id')}"
+        on_queued = None
+        if data.get('on_event'):
+            on_queued = lambda depth: self.emit(data, 'queued', reason='upstream', position=depth)
+        return self.scheduler.slot(priority, flow, on_queued=on_queued)
+
     def format_chat_response(self, response, data):
         """Format the chat response with metadata."""
         try:
@@ -180,7 +755,12 @@ Response Guidelines:
                 "response": formatted_text,
                 "timestamp": data['timestamp'],
                 "status": "success",
-                "sessionId": data['session_id']
+                "sessionId": data['session_id'],
+                "seq": data.get('seq'),
+                "profile": data.get('profile'),
+                "model": data.get('model'),
+                "historyTokens": data.get('history_tokens'),
+                "coalesced": data.get('coalesced')
             })
         except Exception as e:
             self.metrics['errors'][str(e)] += 1
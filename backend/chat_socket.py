@@ -0,0 +1,330 @@
+import json
+import logging
+import math
+import queue
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime
+from flask import request
+from errors import ServiceBusyError, friendly_error_message
+
+# flask-sock is optional, without it the WebSocket channel is off and /chat works as before
+try:
+    from flask_sock import Sock
+    from simple_websocket import ConnectionClosed
+except ImportError:
+    Sock = None
+    ConnectionClosed = None
+
+logger = logging.getLogger(__name__)
+
+# Add WebSocket constants
+SOCKET_PATH = '/chat/ws'
+MAX_PENDING = 4               # turns a connection may queue behind the running one
+PING_INTERVAL = 25            # seconds between keepalive pings, below common proxy idle timeouts
+RECEIVE_POLL = 1.0            # seconds, how often an idle connection checks for a drain
+MAX_MESSAGE_BYTES = 64 * 1024
+CLOSE_POLICY_VIOLATION = 1008
+CLOSE_SERVICE_RESTART = 1012  # clients should reconnect, possibly to another worker
+
+
+class Outbox:
+    """Events waiting to be sent to one client.
+
+    A slow reader never stalls the model: while a chunk is still waiting to
+    be sent, the next chunk of the same turn is appended to it instead of
+    queued, so the backlog stays a few events however far the client lags.
+    """
+
+    def __init__(self):
+        self.events = deque()
+        self.condition = threading.Condition()
+        self.closed = False
+        self.coalesced = 0
+
+    def put(self, event):
+        with self.condition:
+            if self.closed:
+                return False
+            last = self.events[-1] if self.events else None
+            if event['type'] == 'chunk' and last and last['type'] == 'chunk' and last['id'] == event['id']:
+                last['text'] += event['text']
+                self.coalesced += 1
+            else:
+                self.events.append(event)
+                self.condition.notify()
+            return True
+
+    def get(self):
+        """The next event, or None once closed and empty."""
+        with self.condition:
+            while not self.events and not self.closed:
+                self.condition.wait()
+            return self.events.popleft() if self.events else None
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+class ChatSocket:
+    """Chat turns over one WebSocket per session.
+
+    Clients connect to /chat/ws?sessionId=... and send {"message": ...}
+    frames. Each turn answers with events tagged by the frame's "id":
+    queued and retrying while it waits, chunk as the reply streams, then
+    done or error. A connection runs its turns one at a time, in order;
+    it holds up to `max_pending` turns, the running one included, and
+    further messages are refused.
+    """
+
+    def __init__(self, chat_service, rate_limit=None, drain=None, allowed_origins=None,
+                 max_pending=MAX_PENDING, dumps=json.dumps):
+        self.chat_service = chat_service
+        # Called with the bucket key and client IP per turn, returns (allowed, retry_after)
+        self.rate_limit = rate_limit
+        self.drain = drain
+        self.allowed_origins = allowed_origins
+        self.max_pending = max_pending
+        self.dumps = dumps
+        self.lock = threading.Lock()
+        self.metrics = {
+            'open': 0,
+            'connections': 0,
+            'turns': 0,
+            'rejected': 0,
+            'rate_limited': 0,
+            'events_sent': 0,
+            'coalesced_chunks': 0
+        }
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.metrics[name] += amount
+
+    def draining(self):
+        return bool(self.drain and self.drain.draining.is_set())
+
+    def handle(self, ws):
+        """Serve one connection until either side closes it."""
+        origin = request.headers.get('Origin')
+        if origin and self.allowed_origins is not None and origin not in self.allowed_origins:
+            logger.warning(f"🔒 Rejected WebSocket from origin {origin}")
+            ws.close(CLOSE_POLICY_VIOLATION, 'Origin not allowed')
+            return
+        if self.draining():
+            ws.close(CLOSE_SERVICE_RESTART, 'Server is restarting')
+            return
+        channel = ChatChannel(
+            self, ws,
+            session_id=request.args.get('sessionId') or str(datetime.now().timestamp()),
+            user_id=request.headers.get('X-User-Id'),
+            username=request.args.get('username'),
+            ip=request.remote_addr
+        )
+        self.count('open')
+        self.count('connections')
+        try:
+            channel.run()
+        finally:
+            self.count('open', -1)
+            self.count('coalesced_chunks', channel.outbox.coalesced)
+
+    def wait_closed(self, timeout):
+        """Give connections time to close themselves after a drain; returns how many are left."""
+        deadline = time.monotonic() + timeout
+        while self.open_connections() and time.monotonic() < deadline:
+            time.sleep(0.05)
+        return self.open_connections()
+
+    def open_connections(self):
+        with self.lock:
+            return self.metrics['open']
+
+
+class ChatChannel:
+    """One client connection bound to one chat session."""
+
+    def __init__(self, server, ws, session_id, user_id=None, username=None, ip=None):
+        self.server = server
+        self.ws = ws
+        self.session_id = session_id
+        self.user_id = user_id
+        self.username = username
+        self.ip = ip
+        self.outbox = Outbox()
+        self.turns = queue.Queue()
+        self.lock = threading.Lock()
+        self.pending = 0  # queued plus running turns
+        self.closing = threading.Event()
+
+    def run(self):
+        sender = threading.Thread(target=self._send_loop, name=f"ws-send-{self.session_id}", daemon=True)
+        worker = threading.Thread(target=self._turn_loop, name=f"ws-turns-{self.session_id}", daemon=True)
+        sender.start()
+        worker.start()
+        session = self.server.chat_service.chat_history.get(self.session_id)
+        messages = session.get('messages', []) if session else []
+        # Clients that reconnect can fetch what they missed from /sessions/<id>/messages
+        self.send('ready', sessionId=self.session_id, seq=messages[-1].get('seq') if messages else None)
+        restarting = False
+        try:
+            while not self.closing.is_set():
+                raw = self.ws.receive(timeout=RECEIVE_POLL)
+                if raw is None:
+                    # Close once the running turns are done so the client reconnects elsewhere
+                    if self.server.draining() and not self.pending_turns():
+                        restarting = True
+                        break
+                    continue
+                self.on_message(raw)
+        except ConnectionClosed:
+            pass
+        finally:
+            # Turns still queued are dropped, the running one finishes and is saved
+            self.closing.set()
+            self.turns.put(None)
+            self.outbox.close()
+            sender.join(timeout=5)
+        if restarting:
+            self.ws.close(CLOSE_SERVICE_RESTART, 'Server is restarting')
+
+    def send(self, event, **fields):
+        self.outbox.put(dict(fields, type=event))
+
+    def pending_turns(self):
+        # The turn thread lowers the count as turns finish
+        with self.lock:
+            return self.pending
+
+    def on_message(self, raw):
+        try:
+            payload = json.loads(raw)
+        except ValueError:
+            payload = None
+        if not isinstance(payload, dict):
+            self.send('error', id=None, error="Invalid request format")
+            return
+        turn_id = str(payload.get('id') or uuid.uuid4().hex[:8])
+        if payload.get('type') == 'ping':
+            self.send('pong', id=turn_id)
+            return
+
+        if self.server.draining():
+            self.send('error', id=turn_id, error="🔄 Server is restarting, please reconnect in a moment", retryAfter=1)
+            return
+        if self.pending_turns() >= self.server.max_pending:
+            # Backpressure: don't let one client pile up turns faster than the model answers
+            self.server.count('rejected')
+            self.send('error', id=turn_id, error="⏳ Too many messages waiting, please wait for a reply", retryAfter=1)
+            return
+        if self.server.rate_limit:
+            key = f"user:{self.user_id}" if self.user_id else f"session:{self.session_id}"
+            allowed, retry_after = self.server.rate_limit(key, self.ip)
+            if not allowed:
+                self.server.count('rate_limited')
+                self.send('error', id=turn_id, error="⏳ Too many requests, please slow down",
+                          retryAfter=max(1, math.ceil(retry_after)))
+                return
+        try:
+            if self.username and 'username' not in payload:
+                payload['username'] = self.username
+            data = self.server.chat_service.parse_payload(dict(payload, sessionId=self.session_id))
+        except ValueError as e:
+            self.send('error', id=turn_id, error=str(e))
+            return
+        data['user_id'] = self.user_id
+        data['stream'] = True
+        data['on_event'] = lambda event, fields: self.send(event, id=turn_id, **fields)
+
+        with self.lock:
+            waiting = self.pending
+            self.pending += 1
+        if waiting:
+            self.send('queued', id=turn_id, reason='turn', position=waiting)
+        self.turns.put((turn_id, data))
+
+    def _turn_loop(self):
+        while True:
+            item = self.turns.get()
+            if item is None:
+                return
+            try:
+                if not self.closing.is_set():
+                    self.run_turn(*item)
+            finally:
+                with self.lock:
+                    self.pending -= 1
+
+    def run_turn(self, turn_id, data):
+        chat_service = self.server.chat_service
+        drain = self.server.drain
+        if drain:
+            drain.begin()
+        self.server.count('turns')
+        try:
+            session = chat_service.get_or_create_session(data)
+            response = chat_service.generate_response(session, data)
+            # Same fields as a POST /chat answer, the chunks were only a preview
+            self.send(
+                'done',
+                id=turn_id,
+                response=response.text.strip(),
+                timestamp=data['timestamp'],
+                sessionId=data['session_id'],
+                seq=data.get('seq'),
+                profile=data.get('profile'),
+                model=data.get('model'),
+                historyTokens=data.get('history_tokens')
+            )
+        except ServiceBusyError as e:
+            logger.warning(f"💬 Request shed: {e}", extra={'status': e.status_code})
+            self.send('error', id=turn_id, error=str(e),
+                      retryAfter=max(1, math.ceil(e.retry_after)) if e.retry_after else None)
+        except Exception as e:
+            logger.error(f"💬 Chat error: {e}")
+            self.send('error', id=turn_id, error=friendly_error_message(str(e)))
+        finally:
+            if drain:
+                drain.end()
+
+    def _send_loop(self):
+        try:
+            while True:
+                event = self.outbox.get()
+                if event is None:
+                    return
+                self.ws.send(self.server.dumps(event))
+                self.server.count('events_sent')
+        except Exception:
+            # The client went away, stop reading and drop what's left
+            self.closing.set()
+            self.outbox.close()
+
+
+def init_chat_socket(app, chat_service, rate_limit=None, drain=None, enabled=True,
+                     max_pending=MAX_PENDING, ping_interval=PING_INTERVAL):
+    """Register the WebSocket chat route; returns the ChatSocket, or None when it's off."""
+    if not enabled:
+        return None
+    if Sock is None:
+        logger.info("flask-sock is not installed, the WebSocket chat channel is off")
+        return None
+    app.config.setdefault('SOCK_SERVER_OPTIONS', {
+        'ping_interval': ping_interval or None,
+        'max_message_size': MAX_MESSAGE_BYTES
+    })
+    chat_socket = ChatSocket(chat_service, rate_limit, drain, app.config.get('CORS_ORIGINS'),
+                             max_pending, dumps=app.json.dumps)
+    sock = Sock(app)
+
+    @sock.route(SOCKET_PATH)
+    def chat_socket_endpoint(ws):
+        chat_socket.handle(ws)
+
+    if drain:
+        drain.add_hook('websockets', lambda: chat_socket.wait_closed(RECEIVE_POLL * 2))
+    return chat_socket
@@ -0,0 +1,95 @@
+import threading
+import time
+
+# Add coalescing constants
+MAX_WINDOW_MS = 2000      # longest debounce window a session may ask for
+MAX_MESSAGES = 8          # a burst stops growing after this many messages
+MAX_WAIT_WINDOWS = 2      # a steady stream of messages still gets an answer after this many windows
+MESSAGE_SEPARATOR = "\n\n"
+
+
+def merge_turns(items):
+    """One chat data dict for a burst of messages, newest metadata wins."""
+    if len(items) == 1:
+        return items[0]
+    merged = dict(items[-1])
+    merged['message'] = MESSAGE_SEPARATOR.join(item['message'] for item in items)
+    # An explicit profile on any of the messages still applies
+    merged['profile'] = next((item['profile'] for item in items if item.get('profile')), None)
+    merged['coalesced'] = len(items)
+    return merged
+
+
+class _Burst:
+    def __init__(self, data):
+        self.items = [data]
+        self.first_arrival = self.last_arrival = time.monotonic()
+        self.closed = False
+        self.done = threading.Event()
+        self.data = None
+        self.response = None
+        self.error = None
+
+
+class TurnCoalescer:
+    """Merges messages a session sends in quick succession into one model turn.
+
+    The first request of a burst waits until `window` seconds pass without
+    another message (never more than MAX_WAIT_WINDOWS windows in total),
+    then runs a single turn with the messages joined. Requests that joined
+    the burst wait for that turn and get the same response.
+    """
+
+    def __init__(self, max_messages=MAX_MESSAGES):
+        self.max_messages = max_messages
+        self.condition = threading.Condition()
+        self.bursts = {}
+        self.metrics = {'turns': 0, 'merged_turns': 0, 'merged_messages': 0}
+
+    def submit(self, session_id, data, window, run):
+        """Answer `data` from its burst's turn, `run(merged_data)`; returns (response, merged_data)."""
+        with self.condition:
+            burst = self.bursts.get(session_id)
+            leader = burst is None or burst.closed
+            if leader:
+                burst = self.bursts[session_id] = _Burst(data)
+                self._wait_quiet(session_id, burst, window)
+            else:
+                burst.items.append(data)
+                burst.last_arrival = time.monotonic()
+                if len(burst.items) >= self.max_messages:
+                    burst.closed = True
+                self.condition.notify_all()
+
+        if not leader:
+            burst.done.wait()
+            if burst.error:
+                raise burst.error
+            return burst.response, burst.data
+
+        try:
+            burst.data = merge_turns(burst.items)
+            burst.response = run(burst.data)
+            return burst.response, burst.data
+        except Exception as e:
+            burst.error = e
+            raise
+        finally:
+            with self.condition:
+                self.metrics['turns'] += 1
+                if len(burst.items) > 1:
+                    self.metrics['merged_turns'] += 1
+                    self.metrics['merged_messages'] += len(burst.items)
+            burst.done.set()
+
+    def _wait_quiet(self, session_id, burst, window):
+        # Holding the condition: wait until no message arrived for a window, then close the burst
+        deadline = burst.first_arrival + MAX_WAIT_WINDOWS * window
+        while not burst.closed:
+            remaining = min(burst.last_arrival + window, deadline) - time.monotonic()
+            if remaining <= 0:
+                break
+            self.condition.wait(remaining)
+        burst.closed = True
+        if self.bursts.get(session_id) is burst:
+            del self.bursts[session_id]
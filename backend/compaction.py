@@ -0,0 +1,164 @@
+import hashlib
+import re
+from collections import OrderedDict
+
+# Add compaction constants
+MIN_ELIDE_LINES = 8     # shorter blocks stay inline, their stub would save next to nothing
+KEEP_RECENT = 1         # newest history messages that are always sent verbatim
+MAX_ARTIFACTS = 64      # elided blocks kept per session for re-inflation
+
+# Add block and reference patterns
+FENCE = re.compile(r"^[ \t]*```[ \t]*([\w+#.-]*)[^\n]*\n.*?^[ \t]*```[ \t]*$", re.MULTILINE | re.DOTALL)
+TABLE_ROW = re.compile(r"^[ \t]*\|.*\|[ \t]*$")
+TABLE_SEPARATOR = re.compile(r"^[ \t]*\|?[ \t]*:?-{3,}:?[ \t]*(\|[ \t]*:?-{3,}:?[ \t]*)*\|?[ \t]*$")
+STUB = re.compile(r"\[elided (?:code|table): [^\]]*ref ([0-9a-f]{8})\]")
+REF = re.compile(r"\b[0-9a-f]{8}\b")
+IDENTIFIER = re.compile(r"`([^`\n]+)`|\b([A-Za-z_][A-Za-z0-9_]*(?:_[A-Za-z0-9_]+|[a-z][A-Z][A-Za-z0-9]*))\b|\b(\w+)\(")
+DEFINITION = (r"(?:\b(?:def|class|function|const|let|var|fn|func|type|interface|struct|table|index)\s+"
+              r"|\bCREATE\s+\w+\s+(?:\w+\s+)*?)(?:{names})\b|(?<![\w.])(?:{names})\s*(?:=(?!=)|:)")
+BACK_REFERENCE = re.compile(
+    r"\b(?:that|this|those|these|your|previous|earlier|last|same|above)\s+(?:\w+\s+)?"
+    r"(code|snippet|script|function|class|example|query|program|implementation|table)s?\b"
+    r"|\b(code|snippet|script|function|example|query|table)s?\s+(?:\w+\s+)?(?:above|earlier|before)\b",
+    re.IGNORECASE)
+
+
+def block_ref(content):
+    # Short content hash, stable across turns so stubs and references line up
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()[:8]
+
+
+class HistoryCompactor:
+    """Replaces old code blocks and tables in prompt history with short stubs.
+
+    Elided blocks are kept per session under their hash and put back into the
+    prompt when the new message refers to them: by hash, by an identifier the
+    block defines, or by a phrase like "that python script".
+    """
+
+    def __init__(self, min_lines=MIN_ELIDE_LINES, keep_recent=KEEP_RECENT, max_artifacts=MAX_ARTIFACTS):
+        self.min_lines = min_lines
+        self.keep_recent = keep_recent
+        self.max_artifacts = max_artifacts
+        self.metrics = {'elided': 0, 'inflated': 0, 'chars_saved': 0}
+
+    def render(self, history, message, session):
+        """Return the chat history text for a prompt, with old blocks stubbed out."""
+        if not history:
+            return "No previous messages"
+        artifacts = session.setdefault('artifacts', OrderedDict())
+        recent_from = len(history) - self.keep_recent
+        in_window = set()
+        contents = []
+        for index, msg in enumerate(history):
+            compacted = self.compact(msg['content'], artifacts, in_window)
+            contents.append(msg['content'] if index >= recent_from else compacted)
+        wanted = self.referenced(message, artifacts)
+        if wanted:
+            def inflate(match):
+                if match.group(1) not in wanted:
+                    return match.group(0)
+                self.metrics['inflated'] += 1
+                return artifacts[match.group(1)]['content']
+            contents = [STUB.sub(inflate, content) for content in contents]
+        saved = sum(len(msg['content']) for msg in history) - sum(len(content) for content in contents)
+        text = chr(10).join(f"{msg['role']}: {content}" for msg, content in zip(history, contents))
+
+        # Blocks referred to that have already left the history window
+        missing = [ref for ref in wanted if ref not in in_window]
+        if missing:
+            text += chr(10) * 2 + "Referenced earlier content:" + chr(10)
+            text += (chr(10) * 2).join(artifacts[ref]['content'] for ref in missing)
+            self.metrics['inflated'] += len(missing)
+
+        self.metrics['chars_saved'] += max(0, saved)
+        return text
+
+    def compact_messages(self, messages, session):
+        """Return the messages' contents for the SDK chat history, old blocks stubbed out.
+
+        The chat history is resent upstream with every turn, so it gets the
+        same stubs as the prompt text. The newest `keep_recent` stay verbatim.
+        """
+        artifacts = session.setdefault('artifacts', OrderedDict())
+        recent_from = len(messages) - self.keep_recent
+        contents = [msg['content'] if index >= recent_from else self.compact(msg['content'], artifacts)
+                    for index, msg in enumerate(messages)]
+        saved = sum(len(msg['content']) for msg in messages) - sum(len(content) for content in contents)
+        self.metrics['chars_saved'] += max(0, saved)
+        return contents
+
+    def compact(self, text, artifacts, refs=None):
+        """Return `text` with long code blocks and tables replaced by stubs.
+
+        Refs of the elided blocks are added to `refs` when given.
+        """
+        def elide_fence(match):
+            block = match.group(0)
+            lines = block.count(chr(10)) - 1
+            if lines < self.min_lines:
+                return block
+            language = match.group(1).lower() or 'text'
+            return self._stub(artifacts, 'code', block, language, f"{language}, {lines} lines", refs)
+
+        text = FENCE.sub(elide_fence, text)
+        if '|' not in text:
+            return text
+        return chr(10).join(self._elide_tables(text.split(chr(10)), artifacts, refs))
+
+    def referenced(self, message, artifacts):
+        """Return refs of the stored blocks the new message refers back to, oldest first."""
+        if not artifacts or not message:
+            return []
+        wanted = {ref for ref in REF.findall(message) if ref in artifacts}
+
+        names = set()
+        for quoted, identifier, called in IDENTIFIER.findall(message):
+            name = (quoted or identifier or called).strip()
+            if len(name) >= 3:
+                names.add(name)
+        if names:
+            # Only blocks that define the name, not every block that happens to call it
+            names = '|'.join(re.escape(name) for name in names)
+            defines = re.compile(DEFINITION.format(names=names), re.MULTILINE)
+            wanted.update(ref for ref, artifact in artifacts.items() if defines.search(artifact['content']))
+
+        lowered = message.lower()
+        for match in BACK_REFERENCE.finditer(message):
+            kind = 'table' if (match.group(1) or match.group(2)).lower() == 'table' else 'code'
+            candidates = [ref for ref, artifact in artifacts.items() if artifact['kind'] == kind]
+            # "that sql query" picks the newest sql block, "that code" just the newest one
+            named = [ref for ref in candidates
+                     if re.search(rf"(?<!\w){re.escape(artifacts[ref]['language'])}(?!\w)", lowered)]
+            if named or candidates:
+                wanted.add((named or candidates)[-1])
+        return [ref for ref in artifacts if ref in wanted]
+
+    def _stub(self, artifacts, kind, content, language, summary, refs=None):
+        ref = block_ref(content)
+        if refs is not None:
+            refs.add(ref)
+        if ref not in artifacts:
+            self.metrics['elided'] += 1
+        artifacts[ref] = {'kind': kind, 'language': language, 'content': content}
+        artifacts.move_to_end(ref)
+        while len(artifacts) > self.max_artifacts:
+            artifacts.popitem(last=False)
+        return f"[elided {kind}: {summary}, ref {ref}]"
+
+    def _elide_tables(self, lines, artifacts, refs):
+        out = []
+        index = 0
+        while index < len(lines):
+            end = index
+            while end < len(lines) and TABLE_ROW.match(lines[end]):
+                end += 1
+            rows = lines[index:end]
+            if len(rows) >= self.min_lines and TABLE_SEPARATOR.match(rows[1]):
+                columns = rows[0].strip().strip('|').count('|') + 1
+                out.append(self._stub(artifacts, 'table', chr(10).join(rows), 'table',
+                                      f"{columns} columns, {len(rows) - 2} rows", refs))
+            else:
+                out.extend(rows or lines[index:index + 1])
+            index = max(end, index + 1)
+        return out
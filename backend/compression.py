@@ -0,0 +1,182 @@
+import gzip
+import io
+import zlib
+from flask import request
+from errors import ServiceBusyError, busy_response
+
+# Optional codecs, used when installed
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def _brotli_output_limit():
+    # brotli before 1.2.0 can't cap output, a few bytes may decode to gigabytes
+    try:
+        brotli.Decompressor().process(b"", output_buffer_limit=1)
+        return True
+    except TypeError:
+        return False
+
+
+BROTLI_BOUNDED = bool(brotli) and _brotli_output_limit()
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Add compression constants
+MIN_COMPRESS_SIZE = 1024              # bytes, smaller bodies aren't worth the CPU
+MAX_DECOMPRESSED_SIZE = 1024 * 1024   # guard against compressed request bombs
+COMPRESSIBLE_TYPES = {'application/json', 'application/x-ndjson', 'text/plain', 'text/html'}
+
+
+def available_encodings():
+    """Supported content codings, best first."""
+    encodings = []
+    if zstandard:
+        encodings.append('zstd')
+    if brotli:
+        encodings.append('br')
+    encodings.append('gzip')
+    return encodings
+
+
+def negotiate_encoding(accept_encoding):
+    """Pick the best supported coding from an Accept-Encoding header, or None."""
+    if not accept_encoding:
+        return None
+    weights = {}
+    for item in accept_encoding.split(','):
+        name, _, params = item.strip().partition(';')
+        name = name.strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        weights[name] = quality
+    best, best_quality = None, 0.0
+    for encoding in available_encodings():
+        quality = weights.get(encoding, weights.get('*', 0.0))
+        # Ties keep our own preference order
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress(data, encoding):
+    if encoding == 'gzip':
+        return gzip.compress(data, compresslevel=6)
+    if encoding == 'br':
+        return brotli.compress(data, quality=5)
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    raise ValueError(f"Unsupported encoding: {encoding}")
+
+
+def decompress(data, encoding, max_size=MAX_DECOMPRESSED_SIZE):
+    """Decode a compressed request body, refusing anything larger than max_size."""
+    if encoding == 'gzip':
+        decoder = zlib.decompressobj(wbits=47)  # gzip or zlib headers
+        result = decoder.decompress(data, max_size + 1)
+    elif encoding == 'br' and BROTLI_BOUNDED:
+        decoder = brotli.Decompressor()
+        result = decoder.process(data, output_buffer_limit=max_size + 1)
+    elif encoding == 'zstd' and zstandard:
+        reader = zstandard.ZstdDecompressor().stream_reader(io.BytesIO(data))
+        result = reader.read(max_size + 1)
+    else:
+        raise ServiceBusyError(f"Unsupported Content-Encoding: {encoding}", retry_after=0, status_code=415)
+    if len(result) > max_size:
+        raise ServiceBusyError("📦 Request body is too large", retry_after=0, status_code=413)
+    return result
+
+
+class StreamCompressor:
+    """Compress a stream chunk by chunk, flushing so each chunk reaches the client."""
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        if encoding == 'gzip':
+            self.compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        elif encoding == 'br':
+            self.compressor = brotli.Compressor(quality=5)
+        elif encoding == 'zstd':
+            self.compressor = zstandard.ZstdCompressor(level=3).compressobj()
+        else:
+            raise ValueError(f"Unsupported encoding: {encoding}")
+
+    def compress(self, chunk):
+        if self.encoding == 'gzip':
+            return self.compressor.compress(chunk) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        if self.encoding == 'br':
+            return self.compressor.process(chunk) + self.compressor.flush()
+        return self.compressor.compress(chunk) + self.compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self):
+        if self.encoding == 'br':
+            return self.compressor.finish()
+        return self.compressor.flush()
+
+    def wrap(self, chunks):
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            data = self.compress(chunk)
+            if data:
+                yield data
+        yield self.finish()
+
+
+def init_compression(app, min_size=MIN_COMPRESS_SIZE):
+    """Register hooks that decode compressed requests and compress responses."""
+
+    @app.before_request
+    def decompress_request():
+        encoding = request.headers.get('Content-Encoding', '').strip().lower()
+        if not encoding or encoding == 'identity':
+            return None
+        try:
+            body = decompress(request.get_data(cache=False), encoding)
+        except ServiceBusyError as e:
+            return busy_response(e)
+        except Exception:
+            # Covers zlib, brotli and zstd decoder errors alike
+            return busy_response(ServiceBusyError("Invalid compressed request body", retry_after=0, status_code=400))
+        # Hand the decoded body to the view as if it had been sent plain
+        request.environ['wsgi.input'] = io.BytesIO(body)
+        request.environ['CONTENT_LENGTH'] = str(len(body))
+        request.environ.pop('HTTP_CONTENT_ENCODING', None)
+        request.__dict__.pop('stream', None)
+        return None
+
+    @app.after_request
+    def compress_response(response):
+        if response.mimetype not in COMPRESSIBLE_TYPES:
+            return response
+        response.vary.add('Accept-Encoding')
+        if (response.status_code < 200 or response.status_code in (204, 304)
+                or 'Content-Encoding' in response.headers):
+            return response
+        encoding = negotiate_encoding(request.headers.get('Accept-Encoding'))
+        if not encoding:
+            return response
+
+        if response.is_streamed:
+            # Flush per chunk so NDJSON results still arrive as they finish
+            response.response = StreamCompressor(encoding).wrap(response.response)
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            if len(data) < min_size:
+                return response
+            response.set_data(compress(data, encoding))
+        response.headers['Content-Encoding'] = encoding
+        return response
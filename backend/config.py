@@ -1,12 +1,19 @@
+import copy
+import json
 import os
 from typing import Dict, Any
-from dotenv import load_dotenv
+from dotenv import load_dotenv, dotenv_values
 import google.generativeai as genai
 import logging
+import validation
+from upstream import create_model_pool
 
 # Add logging configuration
 logger = logging.getLogger(__name__)
 
+# Load .env early so module-level settings below can read it
+load_dotenv()
+
 # Add default configurations
 DEFAULT_CONFIG = {
     "temperature": 0.7,
@@ -39,27 +46,307 @@ def get_env_or_default(key: str, default: Any) -> Any:
     """Get environment variable with fallback to default."""
     return os.getenv(key) or default
 
+# Add proxy configurations (behind router.py or another reverse proxy every request comes from its address)
+PROXY_CONFIG = {
+    # Proxies in front of this server whose X-Forwarded-For is trusted for the client address, 1 behind router.py
+    "trusted_hops": int(get_env_or_default("PROXY_TRUSTED_HOPS", 0))
+}
+
+# Add rate limit configurations (storage is shared between workers)
+RATE_LIMIT_CONFIG = {
+    "storage_uri": get_env_or_default("RATE_LIMIT_STORAGE_URI", "sqlite:///ratelimit.db"),
+    "chat_capacity": int(get_env_or_default("RATE_LIMIT_CHAT_CAPACITY", 5)),
+    "chat_period": int(get_env_or_default("RATE_LIMIT_CHAT_PERIOD", 60)),
+    "batch_capacity": int(get_env_or_default("RATE_LIMIT_BATCH_CAPACITY", 1000)),  # items, not requests
+    "batch_period": int(get_env_or_default("RATE_LIMIT_BATCH_PERIOD", 60)),
+    # Ids come from the client, so each IP also shares one bucket this many times a user's size (0 disables)
+    "ip_bucket_factor": int(get_env_or_default("RATE_LIMIT_IP_BUCKET_FACTOR", 10)),
+    # Per-IP limits on every route, on top of the chat buckets
+    "ip_limits": get_env_or_default("RATE_LIMIT_IP_LIMITS", "1000 per day;200 per hour")
+}
+
+# Add admission control configurations (Gemini quotas are tokens per minute)
+ADMISSION_CONFIG = {
+    "tokens_per_minute": int(get_env_or_default("GEMINI_TOKENS_PER_MINUTE", 1000000)),
+    "max_wait": float(get_env_or_default("ADMISSION_MAX_WAIT", 10.0)),
+    "max_queue": int(get_env_or_default("ADMISSION_MAX_QUEUE", 32))
+}
+
+# Add chat service configurations
+CHAT_CONFIG = {
+    # Spare answers fetched in the background per turn for instant regenerate (0 disables)
+    "spare_candidates": int(get_env_or_default("SPARE_CANDIDATES", 0)),
+    # Choose a generation profile (max tokens, temperature, stop sequences) per message
+    "adaptive_profiles": str(get_env_or_default("ADAPTIVE_PROFILES", "true")).lower() == "true",
+    # Replace old code blocks and tables in prompt history with stubs until referred to again
+    "compact_history": str(get_env_or_default("COMPACT_HISTORY", "true")).lower() == "true",
+    # Most estimated tokens of chat history per prompt, replaces the 5 message cut (0 keeps that cut)
+    "history_token_budget": int(get_env_or_default("HISTORY_TOKEN_BUDGET", 8000)) or None,
+    # Merge messages a session sends within this many ms into one turn (0: only sessions sending coalesceMs)
+    "coalesce_window_ms": int(get_env_or_default("COALESCE_WINDOW_MS", 0))
+}
+
+# Add scheduler configurations (concurrent upstream calls per worker)
+SCHEDULER_CONFIG = {
+    "slots": int(get_env_or_default("SCHEDULER_SLOTS", 8)),
+    "max_wait": float(get_env_or_default("SCHEDULER_MAX_WAIT", 30.0))
+}
+
+# Add response compression configurations
+COMPRESSION_CONFIG = {
+    "min_size": int(get_env_or_default("COMPRESSION_MIN_SIZE", 1024))  # bytes
+}
+
+# Add admin configurations (admin routes are disabled while no token is set)
+ADMIN_CONFIG = {
+    "token": get_env_or_default("ADMIN_TOKEN", "")
+}
+
+# Add conversation log configurations (write-ahead log for chat history)
+HISTORY_LOG_CONFIG = {
+    "enabled": str(get_env_or_default("HISTORY_LOG_ENABLED", "true")).lower() == "true",
+    "directory": get_env_or_default("HISTORY_LOG_DIR", "chat_log"),
+    "fsync_interval": float(get_env_or_default("HISTORY_LOG_FSYNC_INTERVAL", 1.0))
+}
+
+# Add drain configurations (SIGTERM finishes in-flight work before exiting)
+DRAIN_CONFIG = {
+    "timeout": float(get_env_or_default("DRAIN_TIMEOUT", 25.0)),  # keep below the orchestrator's kill grace period
+    "export_path": get_env_or_default("DRAIN_EXPORT_PATH", "")  # sessions file when the conversation log is off
+}
+
+# Add WebSocket chat configurations (/chat/ws, needs the optional flask-sock package)
+WEBSOCKET_CONFIG = {
+    "enabled": str(get_env_or_default("WEBSOCKET_ENABLED", "true")).lower() == "true",
+    "max_pending": int(get_env_or_default("WEBSOCKET_MAX_PENDING", 4)),  # turns per connection, running one included
+    "ping_interval": float(get_env_or_default("WEBSOCKET_PING_INTERVAL", 25))  # seconds, 0 disables
+}
+
+# Add idempotency configurations (responses kept per Idempotency-Key so retries don't call the model again)
+IDEMPOTENCY_CONFIG = {
+    "ttl": float(get_env_or_default("IDEMPOTENCY_TTL", 600)),  # seconds
+    "max_entries": int(get_env_or_default("IDEMPOTENCY_MAX_ENTRIES", 5000)),
+    "wait_timeout": float(get_env_or_default("IDEMPOTENCY_WAIT_TIMEOUT", 60))  # duplicates wait this long for the original
+}
+
+# Add session store configurations (idle sessions move from memory to a SQLite file)
+SESSION_STORE_CONFIG = {
+    "enabled": str(get_env_or_default("SESSION_STORE_ENABLED", "true")).lower() == "true",
+    "path": get_env_or_default("SESSION_STORE_PATH", "") or None,  # a temporary file by default, each process adds its pid
+    "idle_seconds": float(get_env_or_default("SESSION_IDLE_SECONDS", 300)),
+    "spill_interval": float(get_env_or_default("SESSION_SPILL_INTERVAL", 30))  # seconds between idle sweeps
+}
+
+# Add logging configurations (records are written by a background listener)
+LOGGING_CONFIG = {
+    "filename": get_env_or_default("LOG_FILE", "chatgenie.log"),
+    "level": get_env_or_default("LOG_LEVEL", "INFO").upper(),
+    "max_bytes": int(get_env_or_default("LOG_MAX_BYTES", 10 * 1024 * 1024)),
+    "backup_count": int(get_env_or_default("LOG_BACKUP_COUNT", 5)),
+    "sample_rate": float(get_env_or_default("LOG_SUCCESS_SAMPLE_RATE", 0.1)),  # share of success logs kept
+    "queue_size": int(get_env_or_default("LOG_QUEUE_SIZE", 10000))
+}
+
+# Add upstream connection configurations (0 channels keeps the SDK's single default client)
+UPSTREAM_CONFIG = {
+    "pool_size": int(get_env_or_default("UPSTREAM_POOL_SIZE", 2)),
+    "warmup": str(get_env_or_default("UPSTREAM_WARMUP", "true")).lower() == "true",
+    "warmup_timeout": float(get_env_or_default("UPSTREAM_WARMUP_TIMEOUT", 5.0)),
+    "keepalive_time": float(get_env_or_default("UPSTREAM_KEEPALIVE_TIME", 30.0))  # seconds between pings
+}
+
+# Add fake model configurations (local canned answers for load tests, no API key needed)
+FAKE_MODEL_CONFIG = {
+    "enabled": str(get_env_or_default("FAKE_MODEL", "false")).lower() == "true",
+    "latency": float(get_env_or_default("FAKE_MODEL_LATENCY", 0.2)),
+    "tokens_per_second": float(get_env_or_default("FAKE_MODEL_TOKENS_PER_SECOND", 250)),
+    "jitter": float(get_env_or_default("FAKE_MODEL_JITTER", 0.05)),
+    "error_rate": float(get_env_or_default("FAKE_MODEL_ERROR_RATE", 0.0))
+}
+
+# Add model cascade configurations (simple turns go to the fast model, the rest to capable)
+MODEL_ROUTING_CONFIG = {
+    "enabled": str(get_env_or_default("MODEL_ROUTING", "true")).lower() == "true",
+    "models": {
+        "fast": get_env_or_default("FAST_MODEL_NAME", "models/gemini-2.0-flash-lite"),
+        "capable": get_env_or_default("CAPABLE_MODEL_NAME", MODEL_CONFIG["model_name"])
+    }
+}
+
+# Add hot-reload configurations (.env and an optional JSON file are watched while running)
+RELOAD_CONFIG = {
+    "enabled": str(get_env_or_default("CONFIG_RELOAD", "true")).lower() == "true",
+    "env_file": get_env_or_default("ENV_FILE", ".env"),
+    "config_file": get_env_or_default("CONFIG_FILE", "chatgenie.json"),
+    "interval": float(get_env_or_default("CONFIG_RELOAD_INTERVAL", 2.0))  # seconds between checks
+}
+
+def parse_bool(value):
+    return str(value).lower() == "true"
+
+# Env keys that can change while running, mapped to the setting (and sub-key) they feed
+RELOADABLE_ENV = {
+    "CAPABLE_MODEL_NAME": ("capable_model", None, str),
+    "FAST_MODEL_NAME": ("fast_model", None, str),
+    "MODEL_ROUTING": ("model_routing", None, parse_bool),
+    "MODEL_TEMPERATURE": ("generation_config", "temperature", float),
+    "MODEL_TOP_P": ("generation_config", "top_p", float),
+    "MODEL_TOP_K": ("generation_config", "top_k", int),
+    "MODEL_MAX_OUTPUT_TOKENS": ("generation_config", "max_output_tokens", int),
+    "MIN_RESPONSE_LENGTH": ("min_response_length", None, int),
+    "MAX_RESPONSE_LENGTH": ("max_response_length", None, int),
+    "RATE_LIMIT_CHAT_CAPACITY": ("chat_capacity", None, int),
+    "RATE_LIMIT_CHAT_PERIOD": ("chat_period", None, int),
+    "RATE_LIMIT_BATCH_CAPACITY": ("batch_capacity", None, int),
+    "RATE_LIMIT_BATCH_PERIOD": ("batch_period", None, int),
+    "GEMINI_TOKENS_PER_MINUTE": ("tokens_per_minute", None, int)
+}
+SAFETY_THRESHOLDS = {
+    "BLOCK_NONE", "BLOCK_ONLY_HIGH", "BLOCK_MEDIUM_AND_ABOVE", "BLOCK_LOW_AND_ABOVE",
+    "HARM_BLOCK_THRESHOLD_UNSPECIFIED", "OFF"
+}
+
+def current_settings():
+    """The reloadable settings the process is running with now."""
+    return copy.deepcopy({
+        "capable_model": MODEL_ROUTING_CONFIG["models"]["capable"],
+        "fast_model": MODEL_ROUTING_CONFIG["models"]["fast"],
+        "model_routing": MODEL_ROUTING_CONFIG["enabled"],
+        "generation_config": MODEL_CONFIG["generation_config"],
+        "safety_settings": MODEL_CONFIG["safety_settings"],
+        "min_response_length": validation.MIN_RESPONSE_LENGTH,
+        "max_response_length": validation.MAX_RESPONSE_LENGTH,
+        "chat_capacity": RATE_LIMIT_CONFIG["chat_capacity"],
+        "chat_period": RATE_LIMIT_CONFIG["chat_period"],
+        "batch_capacity": RATE_LIMIT_CONFIG["batch_capacity"],
+        "batch_period": RATE_LIMIT_CONFIG["batch_period"],
+        "tokens_per_minute": ADMISSION_CONFIG["tokens_per_minute"]
+    })
+
+def load_settings(env_file, config_file=None):
+    """Current settings overlaid with .env, then the JSON file. Removed keys keep their value."""
+    settings = current_settings()
+    if env_file and os.path.exists(env_file):
+        for key, value in dotenv_values(env_file).items():
+            if key not in RELOADABLE_ENV or value in (None, ""):
+                continue
+            name, sub_key, parse = RELOADABLE_ENV[key]
+            try:
+                parsed = parse(value)
+            except ValueError:
+                raise ValueError(f"{key} has an invalid value: {value!r}")
+            if sub_key:
+                settings[name][sub_key] = parsed
+            else:
+                settings[name] = parsed
+    if config_file and os.path.exists(config_file):
+        with open(config_file, encoding='utf-8') as f:
+            overrides = json.load(f)
+        if not isinstance(overrides, dict):
+            raise ValueError(f"{config_file} must contain a JSON object")
+        for name, value in overrides.items():
+            if name not in settings:
+                raise ValueError(f"Unknown setting in {config_file}: {name}")
+            if name == "generation_config" and isinstance(value, dict):
+                settings[name].update(value)
+            else:
+                settings[name] = value
+    return settings
+
+def validate_settings(settings):
+    """Raise ValueError listing every problem, so a bad edit is rejected as a whole."""
+    problems = []
+    for name in ("capable_model", "fast_model"):
+        if not isinstance(settings[name], str) or not settings[name].strip():
+            problems.append(f"{name} must be a model name")
+    generation = settings["generation_config"]
+    ranges = {"temperature": (0.0, 2.0), "top_p": (0.0, 1.0), "top_k": (1, 1000), "max_output_tokens": (1, 8192)}
+    for key, (low, high) in ranges.items():
+        value = generation.get(key)
+        if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float))
+                                  or not low <= value <= high):
+            problems.append(f"generation_config.{key} must be between {low} and {high}")
+    for rule in settings["safety_settings"] if isinstance(settings["safety_settings"], list) else [None]:
+        if (not isinstance(rule, dict) or not str(rule.get("category", "")).startswith("HARM_CATEGORY_")
+                or rule.get("threshold") not in SAFETY_THRESHOLDS):
+            problems.append(f"Invalid safety setting: {rule}")
+    for name in ("min_response_length", "max_response_length", "chat_capacity", "chat_period",
+                 "batch_capacity", "batch_period", "tokens_per_minute"):
+        if isinstance(settings[name], bool) or not isinstance(settings[name], int) or settings[name] <= 0:
+            problems.append(f"{name} must be a positive integer")
+    if not problems and settings["min_response_length"] >= settings["max_response_length"]:
+        problems.append("min_response_length must be below max_response_length")
+    if problems:
+        raise ValueError("; ".join(problems))
+
+def apply_settings(settings):
+    """Write validated settings back to the module-level configs and validation thresholds."""
+    MODEL_ROUTING_CONFIG["enabled"] = settings["model_routing"]
+    MODEL_ROUTING_CONFIG["models"] = {"fast": settings["fast_model"], "capable": settings["capable_model"]}
+    MODEL_CONFIG["generation_config"] = copy.deepcopy(settings["generation_config"])
+    MODEL_CONFIG["safety_settings"] = copy.deepcopy(settings["safety_settings"])
+    # Plain module globals, checks read them per call so the swap is atomic
+    validation.MIN_RESPONSE_LENGTH = settings["min_response_length"]
+    validation.MAX_RESPONSE_LENGTH = settings["max_response_length"]
+    for name in ("chat_capacity", "chat_period", "batch_capacity", "batch_period"):
+        RATE_LIMIT_CONFIG[name] = settings[name]
+    ADMISSION_CONFIG["tokens_per_minute"] = settings["tokens_per_minute"]
+
+def build_model(api_key, model_name, generation_config=None, safety_settings=None):
+    """Create one model, pooled and pre-warmed unless the pool is disabled."""
+    model_kwargs = {
+        "model_name": model_name,
+        "generation_config": generation_config or MODEL_CONFIG["generation_config"],
+        "safety_settings": safety_settings or MODEL_CONFIG["safety_settings"]
+    }
+    if UPSTREAM_CONFIG["pool_size"] > 0:
+        # Pooled keepalive channels, connected now so the first chat skips the TLS handshake
+        model = create_model_pool(
+            api_key,
+            model_kwargs,
+            size=UPSTREAM_CONFIG["pool_size"],
+            keepalive_time=UPSTREAM_CONFIG["keepalive_time"]
+        )
+        if UPSTREAM_CONFIG["warmup"]:
+            model.warm_up(timeout=UPSTREAM_CONFIG["warmup_timeout"])
+        return model
+    # Initialize model with configurations
+    return genai.GenerativeModel(**model_kwargs)
+
+def build_models(settings):
+    """Build the named models; "capable" always exists and answers anything not routed elsewhere."""
+    api_key = os.getenv('GEMINI_API_KEY')
+    model_names = {"capable": settings["capable_model"]}
+    if settings["model_routing"]:
+        model_names["fast"] = settings["fast_model"]
+    if FAKE_MODEL_CONFIG["enabled"]:
+        # Only load tests and offline runs need it
+        from fake_model import FakeModel
+        fake = {key: value for key, value in FAKE_MODEL_CONFIG.items() if key != "enabled"}
+        logger.warning("🧪 Using the local fake model, answers are canned")
+        return {name: FakeModel(name, **fake) for name in model_names}
+    models = {
+        name: build_model(api_key, model_name, settings["generation_config"], settings["safety_settings"])
+        for name, model_name in model_names.items()
+    }
+    logger.info(f"✨ Initialized {', '.join(model_names.values())} successfully")
+    return models
+
 def setup_config():
-    """Set up environment variables and initialize the Gemini model."""
+    """Set up environment variables and initialize the named Gemini models."""
     try:
         # Load environment variables
         load_dotenv()
         API_KEY = os.getenv('GEMINI_API_KEY')
+        if FAKE_MODEL_CONFIG["enabled"]:
+            return build_models(current_settings())
         if not API_KEY:
             raise ValueError("GEMINI_API_KEY environment variable is not set")
         
         # Configure Gemini
         genai.configure(api_key=API_KEY)
         
-        # Initialize model with configurations
-        model = genai.GenerativeModel(
-            model_name=MODEL_CONFIG["model_name"],
-            generation_config=MODEL_CONFIG["generation_config"],
-            safety_settings=MODEL_CONFIG["safety_settings"]
-        )
-        
-        logger.info(f"✨ Initialized {MODEL_CONFIG['model_name']} successfully")
-        return model
+        return build_models(current_settings())
         
     except Exception as e:
         logger.error(f"❌ Failed to initialize Gemini model: {str(e)}")
@@ -0,0 +1,123 @@
+import logging
+import os
+import threading
+import time
+from config import apply_settings, build_models, current_settings, load_settings, validate_settings
+from routing import ModelRouter
+
+logger = logging.getLogger(__name__)
+
+# Settings that need new model objects when they change
+MODEL_SETTINGS = {'capable_model', 'fast_model', 'model_routing', 'generation_config', 'safety_settings'}
+RETIRE_TIMEOUT = 120.0  # most seconds replaced models stay open for turns still running on them
+
+
+class ConfigReloader:
+    """Watches .env and the JSON config file and applies valid changes while running.
+
+    A change is loaded, validated and, when it touches the models, the new
+    models are built before anything is swapped. Requests already running
+    finish on the old models; sessions keep their messages and rebuild their
+    chats on the next turn. An invalid edit is rejected as a whole.
+    """
+
+    def __init__(self, chat_service, admission=None, env_file='.env', config_file=None,
+                 interval=2.0, build_models=build_models, retire_timeout=RETIRE_TIMEOUT):
+        self.chat_service = chat_service
+        self.admission = admission
+        self.env_file = env_file
+        self.config_file = config_file
+        self.interval = interval
+        self.build_models = build_models
+        self.retire_timeout = retire_timeout
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+        self.signature = self._signature()
+        self.metrics = {'reloads': 0, 'rejected': 0, 'retired_models': 0, 'last_changed': [], 'last_error': None}
+
+    def start(self):
+        self.thread = threading.Thread(target=self._watch, name='config-reload', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+
+    def _watch(self):
+        while not self.stopped.wait(self.interval):
+            self.check()
+
+    def _signature(self):
+        signature = []
+        for path in (self.env_file, self.config_file):
+            try:
+                stat = os.stat(path) if path else None
+                signature.append((stat.st_mtime_ns, stat.st_size) if stat else None)
+            except OSError:
+                signature.append(None)
+        return signature
+
+    def check(self):
+        """Reload if either file changed since the last check."""
+        signature = self._signature()
+        if signature == self.signature:
+            return None
+        self.signature = signature
+        try:
+            return self.reload()
+        except Exception as e:
+            self.metrics['rejected'] += 1
+            self.metrics['last_error'] = str(e)
+            logger.error(f"Config change rejected, keeping the running config: {e}")
+            return None
+
+    def reload(self):
+        """Load, validate and apply the files; returns the names of changed settings."""
+        with self.lock:
+            settings = load_settings(self.env_file, self.config_file)
+            validate_settings(settings)
+            running = current_settings()
+            changed = sorted(name for name in settings if settings[name] != running[name])
+            if not changed:
+                return changed
+
+            router = model = None
+            if MODEL_SETTINGS.intersection(changed):
+                # Slow part (connect, warm up) happens while requests still use the old models
+                models = self.build_models(settings)
+                model = models['capable']
+                router = ModelRouter(models) if len(models) > 1 else None
+
+            apply_settings(settings)
+            if self.admission:
+                self.admission.set_rate(settings['tokens_per_minute'])
+            if model is not None:
+                outgoing = self.chat_service.swap_models(model, router, settings['generation_config'])
+                self._retire(outgoing, self.chat_service.model_generation)
+
+            self.metrics['reloads'] += 1
+            self.metrics['last_changed'] = changed
+            self.metrics['last_error'] = None
+            self.metrics['last_reload'] = time.time()
+            logger.info(f"Config reloaded, changed: {', '.join(changed)}")
+            return changed
+
+    def _retire(self, models, generation):
+        # Close the replaced models' channels once turns started on them have finished
+        def close_when_idle():
+            if not self.chat_service.wait_for_turns(generation, self.retire_timeout):
+                logger.warning(f"Closing replaced models with turns still running after {self.retire_timeout:.0f}s")
+            for model in models:
+                close = getattr(model, 'close', None)
+                if not callable(close):
+                    continue
+                try:
+                    close()
+                    self.metrics['retired_models'] += 1
+                except Exception as e:
+                    logger.error(f"Closing a replaced model failed: {e}")
+
+        thread = threading.Thread(target=close_when_idle, name='config-retire', daemon=True)
+        thread.start()
+        return thread
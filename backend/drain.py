@@ -0,0 +1,155 @@
+import _thread
+import logging
+import signal
+import threading
+import time
+from functools import wraps
+from errors import ServiceBusyError, busy_response
+
+logger = logging.getLogger(__name__)
+
+# Add drain constants
+DRAIN_TIMEOUT = 25.0  # seconds in-flight work gets, below the usual 30s kill grace period
+DRAIN_SIGNALS = ('SIGTERM',)
+DRAINING_HEADER = 'X-Draining'
+
+
+class DrainController:
+    """Lets a process finish its work before it exits.
+
+    Once draining starts, guarded views answer 503 with Retry-After and
+    /health reports not ready, so load balancers and router.py move traffic
+    away. Requests already running get up to `timeout` seconds to finish,
+    then the shutdown hooks run (flush the conversation log, ...) and the
+    process exits.
+    """
+
+    def __init__(self, timeout=DRAIN_TIMEOUT):
+        self.timeout = timeout
+        self.draining = threading.Event()
+        self.drained = threading.Event()
+        self.condition = threading.Condition()
+        self.inflight = 0
+        self.hooks = []
+        self.previous_handlers = {}
+        self.exit_signal = None
+        self.metrics = {'rejected': 0, 'finished_while_draining': 0, 'abandoned': 0, 'drain_seconds': None}
+
+    def add_hook(self, name, hook):
+        """Run `hook()` once in-flight work is done, in the order added."""
+        self.hooks.append((name, hook))
+
+    # Request tracking
+
+    def begin(self):
+        with self.condition:
+            self.inflight += 1
+
+    def end(self):
+        with self.condition:
+            self.inflight -= 1
+            if self.draining.is_set():
+                self.metrics['finished_while_draining'] += 1
+            self.condition.notify_all()
+
+    def guard(self, view):
+        """Decorate a view: refuse it while draining, otherwise count it as in flight.
+
+        Streamed responses count until the client has read the last chunk.
+        """
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if self.draining.is_set():
+                self.metrics['rejected'] += 1
+                response = busy_response(ServiceBusyError(
+                    "🔄 Server is restarting, please retry in a moment", retry_after=1, status_code=503
+                ))
+                response.headers[DRAINING_HEADER] = 'true'
+                return response
+            self.begin()
+            try:
+                response = view(*args, **kwargs)
+            except BaseException:
+                self.end()
+                raise
+            if getattr(response, 'is_streamed', False):
+                response.response = self._tracked(response.response)
+            else:
+                self.end()
+            return response
+        return wrapper
+
+    def _tracked(self, chunks):
+        try:
+            yield from chunks
+        finally:
+            self.end()
+
+    # Draining
+
+    def start(self, reason='requested'):
+        """Begin draining in the background; safe to call more than once."""
+        if self.draining.is_set():
+            return False
+        self.draining.set()
+        logger.warning(f"🔄 Draining ({reason}): {self.inflight} requests in flight, up to {self.timeout:.0f}s")
+        threading.Thread(target=self._drain, name='drain', daemon=True).start()
+        return True
+
+    def wait_idle(self, timeout):
+        """Wait until nothing is in flight; returns how many requests are left."""
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            while self.inflight > 0:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            return self.inflight
+
+    def _drain(self):
+        started = time.monotonic()
+        left = self.wait_idle(self.timeout)
+        if left:
+            self.metrics['abandoned'] = left
+            logger.error(f"Drain deadline passed with {left} requests still running")
+        for name, hook in self.hooks:
+            try:
+                hook()
+            except Exception as e:
+                logger.error(f"Shutdown step '{name}' failed: {e}")
+        self.metrics['drain_seconds'] = round(time.monotonic() - started, 3)
+        logger.warning(f"🔄 Drained in {self.metrics['drain_seconds']}s, exiting")
+        self.drained.set()
+        self._exit()
+
+    # Signals
+
+    def install(self, signals=DRAIN_SIGNALS):
+        """Drain on these signals instead of dying mid-request."""
+        if threading.current_thread() is not threading.main_thread():
+            # Python only lets the main thread set handlers, e.g. an app imported by a test thread
+            logger.warning("Not installing drain signal handlers outside the main thread")
+            return self
+        for name in signals:
+            signum = getattr(signal, name, None)
+            if signum is None:
+                continue
+            self.previous_handlers[signum] = signal.signal(signum, self._on_signal)
+        return self
+
+    def _on_signal(self, signum, frame):
+        # Keep the handler short, the drain itself runs on its own thread
+        if self.exit_signal is None:
+            self.exit_signal = signum
+        self.start(signal.Signals(signum).name)
+
+    def _exit(self):
+        signum = self.exit_signal
+        previous = self.previous_handlers.get(signum)
+        if callable(previous):
+            # A server that handles the signal itself (gunicorn) now does its own graceful stop
+            previous(signum, None)
+        elif signum is not None:
+            # Plain servers: stop serve_forever in the main thread so atexit handlers run
+            _thread.interrupt_main()
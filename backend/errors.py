@@ -1,5 +1,9 @@
+import logging
+import math
 from flask import jsonify
 
+logger = logging.getLogger(__name__)
+
 # Add error categories
 ERROR_CATEGORIES = {
     'auth': ['api key', 'unauthorized', 'authentication'],
@@ -13,6 +17,28 @@ ERROR_CATEGORIES = {
     'server': ['internal error', 'server error'],
 }
 
+# Raised when a request is turned away before it reaches the model
+class ServiceBusyError(Exception):
+    def __init__(self, message, retry_after=1, status_code=429):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.status_code = status_code
+
+# Build the response for a shed request, with Retry-After when it's worth retrying
+def busy_response(error):
+    body = {
+        "error": str(error),
+        "status": "error"
+    }
+    retry_seconds = max(1, math.ceil(error.retry_after)) if error.retry_after else None
+    if retry_seconds:
+        body["retryAfter"] = retry_seconds
+    response = jsonify(body)
+    response.status_code = error.status_code
+    if retry_seconds:
+        response.headers['Retry-After'] = str(retry_seconds)
+    return response
+
 def categorize_error(error_message: str) -> str:
     """Categorize error messages for better handling."""
     lower_message = error_message.lower()
@@ -24,13 +50,32 @@ def categorize_error(error_message: str) -> str:
 # Placeholder for retry_request function.
 def retry_request(error):
     # Implement retry logic here or integrate with your retry mechanism.
-    print("Retrying request due to error:", error)
+    logger.warning(f"Retrying request due to error: {error}")
+
+# Map common upstream errors to friendly messages
+def friendly_error_message(error_message):
+    lower_message = error_message.lower()
+    if "invalid" in lower_message:
+        return "🔑 There's an issue with the API key"
+    elif "timeout" in lower_message:
+        return "⏳ Request took too long, please try again"
+    elif "connection" in lower_message:
+        return "🔌 Having trouble connecting to the AI service"
+    elif "memory" in lower_message:
+        return "💾 System is busy, please try a shorter message"
+    return error_message
 
 # Handle chat-specific errors with user-friendly messages
 def handle_chat_error(error):
-    # Log the chat error for debugging
-    print(f"💬 Chat error: {str(error)}")
     error_message = str(error)
+
+    # Requests shed by rate or admission control tell the client when to retry
+    if isinstance(error, ServiceBusyError):
+        logger.warning(f"💬 Request shed: {error_message}", extra={'status': error.status_code})
+        return busy_response(error)
+
+    # Log the chat error for debugging
+    logger.error(f"💬 Chat error: {error_message}", extra={'category': categorize_error(error_message)})
     
     # Map common errors to friendly messages
     if "quota" in error_message.lower():
@@ -40,25 +85,17 @@ def handle_chat_error(error):
             "status": "delayed",
             "message": "Request queued for processing"
         })
-    elif "invalid" in error_message.lower():
-        error_message = "🔑 There's an issue with the API key"
-    elif "timeout" in error_message.lower():
-        error_message = "⏳ Request took too long, please try again"
-    elif "connection" in error_message.lower():
-        error_message = "🔌 Having trouble connecting to the AI service"
-    elif "memory" in error_message.lower():
-        error_message = "💾 System is busy, please try a shorter message"
     
     # Return formatted error response with 500 status
     return jsonify({
-        "error": error_message,
+        "error": friendly_error_message(error_message),
         "status": "error"
     }), 500
 
 # Handle general server exceptions with generic messages
 def handle_error(error):
     # Log unexpected errors for investigation
-    print(f"❌ Unexpected error: {str(error)}")
+    logger.error(f"❌ Unexpected error: {str(error)}", exc_info=error)
     
     # Return user-friendly message with error details
     return jsonify({
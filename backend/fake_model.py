@@ -0,0 +1,168 @@
+import random
+import threading
+import time
+from profiles import classify_message
+
+# Add fake model defaults
+DEFAULT_LATENCY = 0.2             # seconds before the first token
+DEFAULT_TOKENS_PER_SECOND = 250   # generation speed once started, 0 for instant
+CHARS_PER_TOKEN = 4
+STREAM_PIECE_CHARS = 40           # characters per streamed piece, roughly what the API sends
+
+# Canned answers per profile, long enough to pass validation and to look like real markdown
+REPLIES = {
+    'quick': "## Answer\nThe short answer is **yes**, that works as long as the input is valid.",
+    'chat': (
+        "## Overview\nHere's how I'd approach it.\n\n"
+        "1. Start with the **simplest version** that works\n"
+        "2. Measure before you optimize\n"
+        "3. Keep the interface small\n\n"
+        "> Revisit the design once real usage shows where it hurts."
+    ),
+    'code': (
+        "## Solution\nThis keeps the loop simple and handles the empty case.\n\n"
+        "```python\n"
+        "def chunked(items, size):\n"
+        "    # Yield lists of at most `size` items\n"
+        "    for start in range(0, len(items), size):\n"
+        "        yield items[start:start + size]\n"
+        "```\n\n"
+        "Call it as `list(chunked(rows, 100))` to get every page at once."
+    ),
+    'long_form': (
+        "## Introduction\n" + "Rivers shape the land they cross and the people who live along them. " * 6 +
+        "\n\n### Sources\n" + "Most rivers start as rain and snowmelt gathered from high ground. " * 6 +
+        "\n\n### Mouths\n" + "Where a river meets the sea it slows down and drops its sediment. " * 6
+    )
+}
+
+
+class FakeUsage:
+    def __init__(self, prompt_token_count, candidates_token_count):
+        self.prompt_token_count = prompt_token_count
+        self.candidates_token_count = candidates_token_count
+        self.total_token_count = prompt_token_count + candidates_token_count
+
+
+class FakePart:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeContent:
+    def __init__(self, text):
+        self.parts = [FakePart(text)]
+
+
+class FakeCandidate:
+    def __init__(self, text):
+        self.content = FakeContent(text)
+
+
+class FakeResponse:
+    def __init__(self, text, prompt_chars, candidates=1):
+        self.text = text
+        self.candidates = [FakeCandidate(text) for _ in range(candidates)]
+        self.usage_metadata = FakeUsage(max(1, prompt_chars // CHARS_PER_TOKEN), max(1, len(text) // CHARS_PER_TOKEN))
+
+
+class FakeStreamResponse(FakeResponse):
+    """Streamed reply: iterating yields the text in pieces at the model's pace."""
+
+    def __init__(self, text, prompt_chars, pieces):
+        super().__init__(text, prompt_chars)
+        self.pieces = pieces
+
+    def __iter__(self):
+        for piece, delay in self.pieces:
+            time.sleep(delay)
+            yield FakeResponse(piece, 0)
+
+
+class FakeChatSession:
+    """Chat session with the same calls ChatService makes on the SDK's ChatSession."""
+
+    def __init__(self, model, history=None):
+        self.model = model
+        self.history = list(history or [])
+
+    def send_message(self, content, stream=False, **kwargs):
+        if stream:
+            text, pieces = self.model.stream_reply(content)
+        else:
+            text = self.model.reply(content)
+        self.history += [{"role": "user", "parts": [content]}, {"role": "model", "parts": [text]}]
+        prompt_chars = len(content) + sum(len(str(turn["parts"][0])) for turn in self.history)
+        if stream:
+            return FakeStreamResponse(text, prompt_chars, pieces)
+        return FakeResponse(text, prompt_chars)
+
+    def rewind(self):
+        if len(self.history) < 2:
+            raise IndexError("Can't rewind an empty chat")
+        del self.history[-2:]
+
+
+class FakeModel:
+    """Local stand-in for a Gemini model, for load tests and offline runs.
+
+    Answers are canned per generation profile and arrive after a simulated
+    delay: `latency` plus the reply length at `tokens_per_second`, with up
+    to `jitter` seconds of noise. `error_rate` makes that share of calls
+    fail like a dropped upstream connection.
+    """
+
+    def __init__(self, name='fake', latency=DEFAULT_LATENCY, tokens_per_second=DEFAULT_TOKENS_PER_SECOND,
+                 jitter=0.0, error_rate=0.0, seed=None):
+        self.model_name = f"models/{name}"
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = 0
+
+    def start_chat(self, history=None):
+        return FakeChatSession(self, history)
+
+    def generate_content(self, contents, generation_config=None, **kwargs):
+        count = (generation_config or {}).get('candidate_count', 1) if isinstance(generation_config, dict) else 1
+        text = self.reply(contents if isinstance(contents, str) else str(contents))
+        return FakeResponse(text, len(str(contents)), candidates=count)
+
+    def count_tokens(self, contents):
+        return FakeUsage(max(1, len(str(contents)) // CHARS_PER_TOKEN), 0)
+
+    def reply(self, prompt):
+        """Wait as long as a real model might, then return a canned answer."""
+        text, first_token, generation = self._plan(prompt)
+        time.sleep(first_token + generation)
+        return text
+
+    def stream_reply(self, prompt):
+        """Wait for the first token, then return the answer and its (piece, delay) stream."""
+        text, first_token, generation = self._plan(prompt)
+        time.sleep(first_token)
+        pieces = [text[start:start + STREAM_PIECE_CHARS] for start in range(0, len(text), STREAM_PIECE_CHARS)]
+        return text, [(piece, generation / len(pieces)) for piece in pieces]
+
+    def _plan(self, prompt):
+        with self.lock:
+            self.calls += 1
+            noise = self.random.uniform(0, self.jitter) if self.jitter else 0.0
+            failed = self.error_rate and self.random.random() < self.error_rate
+        text = REPLIES[classify_message(question_of(prompt))]
+        generation = len(text) / CHARS_PER_TOKEN / self.tokens_per_second if self.tokens_per_second else 0.0
+        if failed:
+            time.sleep(self.latency + noise + generation)
+            raise ConnectionError("Fake model dropped the connection")
+        return text, self.latency + noise, generation
+
+
+def question_of(prompt):
+    # ChatService wraps the user's message in a prompt, classify only the question
+    for line in prompt.splitlines():
+        if line.startswith("Question: "):
+            return line[len("Question: "):]
+    return prompt
@@ -0,0 +1,252 @@
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+
+# orjson makes recovery several times faster when it's installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+# Add log constants
+FSYNC_INTERVAL = 1.0                  # seconds between fsyncs of the active segment
+SEGMENT_BYTES = 64 * 1024 * 1024      # rotate segments at this size
+COMPACT_AFTER = 4                     # closed segments before a new snapshot
+SEGMENT_PATTERN = re.compile(r'^segment-(\d{8})\.jsonl$')
+SNAPSHOT_PATTERN = re.compile(r'^snapshot-(\d{8})\.jsonl$')
+
+
+def _dumps(record):
+    if orjson is not None:
+        return orjson.dumps(record) + b"\n"
+    return (json.dumps(record, ensure_ascii=False, separators=(',', ':')) + "\n").encode('utf-8')
+
+
+def _loads(line):
+    if orjson is not None:
+        return orjson.loads(line)
+    return json.loads(line)
+
+
+def apply_record(sessions, record):
+    """Apply one log record to a {session_id: [messages]} mapping."""
+    session_id, op = record['s'], record['op']
+    if op == 'add':
+        sessions.setdefault(session_id, []).extend(record['m'])
+    elif op == 'pop':
+        messages = sessions.get(session_id)
+        if messages:
+            del messages[-record['n']:]
+    elif op == 'drop':
+        sessions.pop(session_id, None)
+
+
+class ConversationLog:
+    """Append-only log of session messages, with periodic compacted snapshots.
+
+    Callers only enqueue records; a background thread writes them to JSONL
+    segments and fsyncs in batches. Once enough segments are closed they are
+    folded into a snapshot with one line per session, and recovery loads the
+    newest snapshot and replays the segments written after it.
+    """
+
+    def __init__(self, directory, fsync_interval=FSYNC_INTERVAL,
+                 segment_bytes=SEGMENT_BYTES, compact_after=COMPACT_AFTER):
+        self.directory = directory
+        self.fsync_interval = fsync_interval
+        self.segment_bytes = segment_bytes
+        self.compact_after = compact_after
+        self.queue = queue.Queue()
+        self.segment_lock = threading.Lock()
+        self.compact_event = threading.Event()
+        self.stopped = threading.Event()
+        self.writer = None
+        self.compactor = None
+        self.active = None
+        self.active_number = 0
+        self.metrics = {'records': 0, 'fsyncs': 0, 'segments': 0, 'snapshots': 0, 'write_errors': 0}
+        os.makedirs(directory, exist_ok=True)
+
+    # Producers (request threads)
+
+    def append(self, session_id, messages):
+        self.queue.put({'s': session_id, 'op': 'add', 'm': messages})
+
+    def truncate(self, session_id, count):
+        self.queue.put({'s': session_id, 'op': 'pop', 'n': count})
+
+    def drop(self, session_id):
+        self.queue.put({'s': session_id, 'op': 'drop'})
+
+    # Lifecycle
+
+    def start(self):
+        numbers = self._segment_numbers()
+        self.active_number = (numbers[-1] if numbers else self._snapshot_number()) + 1
+        self._open_segment()
+        if len(numbers) >= self.compact_after:
+            self.compact_event.set()
+        self.writer = threading.Thread(target=self._write_loop, name='history-log-writer', daemon=True)
+        self.compactor = threading.Thread(target=self._compact_loop, name='history-log-compactor', daemon=True)
+        self.writer.start()
+        self.compactor.start()
+        return self
+
+    def flush(self, timeout=None):
+        """Block until everything enqueued so far is written and fsynced."""
+        done = threading.Event()
+        self.queue.put(done)
+        return done.wait(timeout)
+
+    def close(self, timeout=10):
+        if self.writer is None:
+            return
+        self.flush(timeout)
+        self.stopped.set()
+        self.queue.put(None)
+        self.compact_event.set()
+        self.writer.join(timeout)
+        self.compactor.join(timeout)
+        self.writer = None
+
+    # Writer thread
+
+    def _write_loop(self):
+        last_sync = time.monotonic()
+        dirty = False
+        while True:
+            try:
+                item = self.queue.get(timeout=self.fsync_interval)
+            except queue.Empty:
+                item = False
+            batch, waiters, stop = [], [], item is None
+            while item not in (None, False):
+                if isinstance(item, threading.Event):
+                    waiters.append(item)
+                else:
+                    batch.append(_dumps(item))
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                stop = stop or item is None
+            try:
+                if batch:
+                    self.active.write(b"".join(batch))
+                    self.metrics['records'] += len(batch)
+                    dirty = True
+                now = time.monotonic()
+                if dirty and (waiters or stop or now - last_sync >= self.fsync_interval):
+                    self._sync()
+                    dirty, last_sync = False, now
+                if self.active.tell() >= self.segment_bytes:
+                    self._rotate()
+            except OSError as e:
+                self.metrics['write_errors'] += 1
+                logger.error(f"Conversation log write failed: {e}")
+            for waiter in waiters:
+                waiter.set()
+            if stop:
+                self._sync()
+                self.active.close()
+                return
+
+    def _sync(self):
+        self.active.flush()
+        os.fsync(self.active.fileno())
+        self.metrics['fsyncs'] += 1
+
+    def _open_segment(self):
+        path = os.path.join(self.directory, f"segment-{self.active_number:08d}.jsonl")
+        self.active = open(path, 'ab')
+
+    def _rotate(self):
+        self._sync()
+        self.active.close()
+        with self.segment_lock:
+            self.active_number += 1
+            self._open_segment()
+        self.metrics['segments'] += 1
+        if len(self._segment_numbers()) - 1 >= self.compact_after:
+            self.compact_event.set()
+
+    # Compaction thread
+
+    def _compact_loop(self):
+        while not self.stopped.is_set():
+            self.compact_event.wait()
+            self.compact_event.clear()
+            if self.stopped.is_set():
+                return
+            try:
+                self.compact()
+            except Exception as e:
+                logger.error(f"Conversation log compaction failed: {e}")
+
+    def compact(self):
+        """Fold every closed segment into a new snapshot and delete them."""
+        with self.segment_lock:
+            closed = [n for n in self._segment_numbers() if n < self.active_number]
+        if not closed:
+            return
+        sessions = self._load(upto=closed[-1])
+        number = closed[-1]
+        path = os.path.join(self.directory, f"snapshot-{number:08d}.jsonl")
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'wb') as snapshot:
+            for session_id, messages in sessions.items():
+                snapshot.write(_dumps({'s': session_id, 'op': 'add', 'm': messages}))
+            snapshot.flush()
+            os.fsync(snapshot.fileno())
+        os.replace(tmp_path, path)
+        self.metrics['snapshots'] += 1
+        # Older snapshots and the folded segments are no longer needed
+        for name in os.listdir(self.directory):
+            match = SEGMENT_PATTERN.match(name) or SNAPSHOT_PATTERN.match(name)
+            if match and int(match.group(1)) <= number and name != os.path.basename(path):
+                os.remove(os.path.join(self.directory, name))
+
+    # Recovery
+
+    def recover(self):
+        """Rebuild {session_id: [messages]} from the newest snapshot and later segments."""
+        started = time.monotonic()
+        sessions = self._load()
+        count = sum(len(messages) for messages in sessions.values())
+        logger.info(f"Recovered {len(sessions)} sessions ({count} messages) "
+                    f"in {time.monotonic() - started:.2f}s")
+        return sessions
+
+    def _load(self, upto=None):
+        sessions = {}
+        snapshot_number = self._snapshot_number()
+        if snapshot_number:
+            self._replay(os.path.join(self.directory, f"snapshot-{snapshot_number:08d}.jsonl"), sessions)
+        for number in self._segment_numbers():
+            if number <= snapshot_number or (upto is not None and number > upto):
+                continue
+            self._replay(os.path.join(self.directory, f"segment-{number:08d}.jsonl"), sessions)
+        return sessions
+
+    def _replay(self, path, sessions):
+        with open(path, 'rb') as f:
+            for line in f:
+                try:
+                    record = _loads(line)
+                except ValueError:
+                    # A crash can leave a torn final line, skip it
+                    continue
+                apply_record(sessions, record)
+
+    def _segment_numbers(self):
+        return sorted(int(m.group(1)) for m in map(SEGMENT_PATTERN.match, os.listdir(self.directory)) if m)
+
+    def _snapshot_number(self):
+        numbers = [int(m.group(1)) for m in map(SNAPSHOT_PATTERN.match, os.listdir(self.directory)) if m]
+        return max(numbers) if numbers else 0
@@ -0,0 +1,184 @@
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import Response, jsonify, make_response, request
+from flask_limiter.util import get_remote_address
+
+logger = logging.getLogger(__name__)
+
+# Add idempotency constants
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+DEFAULT_TTL = 600.0              # seconds a response is kept, client retries come well within this
+DEFAULT_MAX_ENTRIES = 5000       # least recently used keys go first once full
+DEFAULT_WAIT_TIMEOUT = 60.0      # how long a duplicate waits for the original request
+MAX_KEY_LENGTH = 255
+MAX_CACHED_BODY = 256 * 1024     # bigger responses aren't kept, the retry runs again
+REPLAYED_HEADERS = ('Content-Type', 'Retry-After')
+
+
+def succeeded(response):
+    # A 2xx can still carry a failure, e.g. the 200 "delayed" answer for a quota error
+    if not 200 <= response.status_code < 300:
+        return False
+    payload = response.get_json(silent=True) if response.is_json else None
+    return not isinstance(payload, dict) or payload.get('status', 'success') == 'success'
+
+
+class _Entry:
+    def __init__(self, fingerprint, expires):
+        self.fingerprint = fingerprint
+        self.expires = expires
+        self.done = threading.Event()
+        self.response = None  # (status, headers, body) once the original finishes
+
+
+class IdempotencyCache:
+    """Remembers responses by Idempotency-Key so a retried request isn't run twice.
+
+    The first request with a key runs and its response is kept for `ttl`
+    seconds, at most `max_entries` keys. A duplicate that arrives while
+    the original is still running waits for it, one that arrives later
+    gets the stored response back. Reusing a key for a different body is
+    an error (422). Only successful responses are kept, so a retry after
+    an error, a shed request or a 200 "delayed" answer runs again.
+
+    Keys are scoped by client address, X-User-Id and the body's sessionId.
+    The address is the one the rate limiter uses, so behind a proxy it's
+    only the client's when PROXY_TRUSTED_HOPS is set. The user id is
+    whatever the client sends, so for clients sharing an address it's the
+    session id that keeps one from replaying another's keys.
+    """
+
+    def __init__(self, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES, wait_timeout=DEFAULT_WAIT_TIMEOUT):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.wait_timeout = wait_timeout
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.metrics = {'stored': 0, 'replayed': 0, 'waited': 0, 'mismatched': 0, 'evicted': 0}
+
+    def begin(self, key, fingerprint):
+        """Returns (entry, is_new). A new entry must be finished with store() or discard()."""
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry.done.is_set() and entry.expires <= now:
+                del self.entries[key]
+                entry = None
+            if entry:
+                self.entries.move_to_end(key)
+                return entry, False
+            entry = self.entries[key] = _Entry(fingerprint, now + self.ttl)
+            self._evict(now)
+            return entry, True
+
+    def store(self, key, entry, response):
+        with self.lock:
+            entry.response = response
+            entry.expires = time.monotonic() + self.ttl
+            self.metrics['stored'] += 1
+        entry.done.set()
+
+    def discard(self, key, entry, response=None):
+        """Forget a key whose request failed; duplicates already waiting get `response`."""
+        with self.lock:
+            if self.entries.get(key) is entry:
+                del self.entries[key]
+            entry.response = response
+        entry.done.set()
+
+    def _evict(self, now):
+        # Least recently used keys sit at the front: drop expired ones, then more while over the limit
+        for _ in range(len(self.entries)):
+            key, entry = next(iter(self.entries.items()))
+            expired = entry.done.is_set() and entry.expires <= now
+            if not expired and len(self.entries) <= self.max_entries:
+                break
+            if not entry.done.is_set():
+                # Still running, its request will store or discard it
+                self.entries.move_to_end(key)
+                continue
+            del self.entries[key]
+            if not expired:
+                self.metrics['evicted'] += 1
+
+    def stats(self):
+        with self.lock:
+            return dict(self.metrics, entries=len(self.entries))
+
+    def idempotent(self, view):
+        """Decorate a view so requests with an Idempotency-Key run at most once per key."""
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            key = request.headers.get(IDEMPOTENCY_HEADER)
+            if not key:
+                return view(*args, **kwargs)
+            if len(key) > MAX_KEY_LENGTH:
+                return jsonify({"error": f"{IDEMPOTENCY_HEADER} is too long", "status": "error"}), 400
+            # Keys and X-User-Id are both client controlled, the address and session id much less so
+            data = request.get_json(silent=True)
+            session_id = data.get('sessionId') if isinstance(data, dict) else None
+            scoped_key = f"{get_remote_address()}:{request.headers.get('X-User-Id', '')}:{session_id or ''}:{key}"
+            fingerprint = hashlib.sha256(
+                request.method.encode() + b" " + request.path.encode() + b"\n" + request.get_data()
+            ).hexdigest()
+
+            entry, is_new = self.begin(scoped_key, fingerprint)
+            if not is_new:
+                return self._duplicate(entry, fingerprint)
+            try:
+                response = view(*args, **kwargs)
+            except BaseException:
+                self.discard(scoped_key, entry)
+                raise
+            return self._finish(scoped_key, entry, response)
+        return wrapper
+
+    def _duplicate(self, entry, fingerprint):
+        if entry.fingerprint != fingerprint:
+            self._count('mismatched')
+            logger.warning(f"Idempotency key reused for a different {request.method} {request.path}")
+            return jsonify({
+                "error": f"{IDEMPOTENCY_HEADER} was already used for a different request",
+                "status": "error"
+            }), 422
+        if not entry.done.is_set():
+            self._count('waited')
+            if not entry.done.wait(self.wait_timeout):
+                response = jsonify({"error": "⏳ The original request is still running", "status": "error"})
+                response.status_code = 409
+                response.headers['Retry-After'] = '1'
+                return response
+        if entry.response is None:
+            return jsonify({"error": "The original request failed, please retry", "status": "error"}), 409
+        self._count('replayed')
+        status, headers, body = entry.response
+        response = Response(body, status=status, headers=headers)
+        response.headers[REPLAYED_HEADER] = 'true'
+        return response
+
+    def _count(self, name):
+        # Duplicates of one key run on several threads at once
+        with self.lock:
+            self.metrics[name] += 1
+
+    def _finish(self, key, entry, result):
+        response = make_response(result)
+        if response.is_streamed:
+            # Nothing to keep, a retry runs the request again
+            self.discard(key, entry)
+            return response
+        body = response.get_data()
+        snapshot = (response.status_code, [(name, response.headers[name]) for name in REPLAYED_HEADERS
+                                            if name in response.headers], body)
+        if succeeded(response) and len(body) <= MAX_CACHED_BODY:
+            self.store(key, entry, snapshot)
+        else:
+            # Duplicates waiting right now share the outcome, later retries run again
+            self.discard(key, entry, snapshot)
+        return response
+
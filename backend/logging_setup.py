@@ -0,0 +1,138 @@
+import copy
+import json
+import logging
+import queue
+import random
+import time
+import uuid
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from flask import g, has_request_context, request
+
+# Add logging constants
+LOG_FILE = 'chatgenie.log'
+MAX_BYTES = 10 * 1024 * 1024   # rotate the log file at this size
+BACKUP_COUNT = 5
+QUEUE_SIZE = 10000             # records buffered before new ones are dropped
+SUCCESS_SAMPLE_RATE = 0.1      # share of routine success records that are kept
+CONSOLE_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+# Attributes every LogRecord has, anything else came in through `extra`
+RESERVED_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line, with request context and any `extra` fields."""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        for key, value in vars(record).items():
+            if key not in RESERVED_ATTRS and key != 'sampled' and value is not None:
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class RequestContextFilter(logging.Filter):
+    """Tag records with the current request and session IDs.
+
+    Runs in the request thread before the record is queued, so Flask's `g`
+    is still available.
+    """
+
+    def filter(self, record):
+        if has_request_context():
+            record.request_id = getattr(record, 'request_id', None) or g.get('request_id')
+            record.session_id = getattr(record, 'session_id', None) or g.get('session_id')
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Keep only a share of records logged with extra={'sampled': True}."""
+
+    def __init__(self, rate=SUCCESS_SAMPLE_RATE):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if getattr(record, 'sampled', False) and record.levelno < logging.WARNING:
+            return random.random() < self.rate
+        return True
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """Queue handler that drops records instead of blocking when the queue is full."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record):
+        # Resolve the message and traceback now, but keep `extra` fields for the JSON formatter
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def setup_logging(filename=LOG_FILE, level='INFO', max_bytes=MAX_BYTES, backup_count=BACKUP_COUNT,
+                  sample_rate=SUCCESS_SAMPLE_RATE, queue_size=QUEUE_SIZE):
+    """Route the root logger through a queue; file and console writes happen on a listener thread."""
+    file_handler = RotatingFileHandler(filename, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+    file_handler.setFormatter(JSONFormatter())
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(logging.Formatter(CONSOLE_FORMAT))
+
+    queue_handler = NonBlockingQueueHandler(queue.Queue(queue_size))
+    queue_handler.addFilter(SamplingFilter(sample_rate))
+    queue_handler.addFilter(RequestContextFilter())
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    listener = QueueListener(queue_handler.queue, file_handler, console_handler, respect_handler_level=True)
+    listener.start()
+    return listener
+
+
+def init_request_context(app):
+    """Give every request an ID for the logs and record how each one went."""
+    logger = logging.getLogger('chatgenie.access')
+
+    @app.before_request
+    def start_request():
+        g.request_id = request.headers.get('X-Request-Id') or uuid.uuid4().hex
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def log_request(response):
+        duration_ms = round((time.perf_counter() - g.get('request_started', time.perf_counter())) * 1000, 1)
+        response.headers['X-Request-Id'] = g.get('request_id', '')
+        level = logging.WARNING if response.status_code >= 400 else logging.INFO
+        logger.log(level, f"{request.method} {request.path} {response.status_code}", extra={
+            'status': response.status_code,
+            'duration_ms': duration_ms,
+            # Routine successes are sampled, errors are always kept
+            'sampled': response.status_code < 400
+        })
+        return response
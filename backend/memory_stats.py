@@ -0,0 +1,176 @@
+import linecache
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import types
+
+# Add introspection constants
+TOP_SESSIONS = 10
+TOP_ALLOCATIONS = 25
+TRACE_FRAMES = 1  # frames per allocation site, more frames cost more memory while tracing
+# Objects that aren't per-session data: code, modules, threads and locks
+SKIP_TYPES = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType, types.MethodType,
+              types.CodeType, types.FrameType, threading.Thread, type(threading.Lock()), type(threading.RLock()))
+
+
+def deep_sizeof(obj, exclude=()):
+    """Estimate the bytes reachable from `obj`, not following objects in `exclude`.
+
+    Objects reached more than once are counted once. Protobuf messages, as the
+    SDK's chat history holds, count their serialized size since their fields
+    live in C memory that getsizeof can't see.
+    """
+    seen = set(map(id, exclude))
+    stack = [obj]
+    total = 0
+    while stack:
+        item = stack.pop()
+        if id(item) in seen or isinstance(item, SKIP_TYPES):
+            continue
+        seen.add(id(item))
+        total += sys.getsizeof(item)
+
+        pb = getattr(item, '_pb', item)
+        byte_size = getattr(pb, 'ByteSize', None)
+        if callable(byte_size) and hasattr(pb, 'SerializeToString'):
+            total += byte_size()
+            continue
+        if isinstance(item, (str, bytes, bytearray, int, float, bool)) or item is None:
+            continue
+        if isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset)):
+            stack.extend(item)
+        else:
+            attributes = getattr(item, '__dict__', None)
+            if attributes is not None:
+                stack.append(attributes)
+            for slot in getattr(type(item), '__slots__', ()):
+                if hasattr(item, slot):
+                    stack.append(getattr(item, slot))
+    return total
+
+
+def session_size(session, exclude=()):
+    """Bytes of one session, split into its messages, SDK chats and everything else."""
+    chats = [session.get('chat_instance')] + list(session.get('model_chats', {}).values())
+    sizes = {
+        'messages': deep_sizeof(session.get('messages', []), exclude),
+        # The SDK chats keep their own copy of every prompt, often the biggest part
+        'chat_instance': deep_sizeof([chat for chat in chats if chat is not None], exclude)
+    }
+    rest = {key: value for key, value in session.items() if key not in ('messages', 'chat_instance', 'model_chats')}
+    sizes['other'] = deep_sizeof(rest, exclude)
+    sizes['bytes'] = sum(sizes.values())
+    return sizes
+
+
+def session_report(chat_history, exclude=(), top=TOP_SESSIONS):
+    """Totals over every session plus the `top` largest ones."""
+    # Copy first, requests keep adding sessions while we walk them
+    sessions = list(chat_history.items())
+    totals = {'messages': 0, 'chat_instance': 0, 'other': 0, 'bytes': 0}
+    sized = []
+    for session_id, session in sessions:
+        sizes = session_size(session, exclude)
+        for key in totals:
+            totals[key] += sizes[key]
+        sized.append((sizes['bytes'], session_id, session, sizes))
+    sized.sort(key=lambda entry: entry[0], reverse=True)
+    largest = []
+    for _, session_id, session, sizes in sized[:top]:
+        last_access = session.get('last_access')
+        largest.append(dict(
+            sessionId=session_id,
+            message_count=len(session.get('messages', [])),
+            last_access=last_access.isoformat() if hasattr(last_access, 'isoformat') else last_access,
+            **sizes
+        ))
+    return {'count': len(sessions), 'breakdown': totals, 'top': largest}
+
+
+def process_memory():
+    """Current and peak resident set size in bytes, where the platform tells us."""
+    memory = {'rss_bytes': None, 'peak_rss_bytes': None}
+    try:
+        with open('/proc/self/statm') as f:
+            memory['rss_bytes'] = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports kilobytes, macOS bytes
+        memory['peak_rss_bytes'] = peak if sys.platform == 'darwin' else peak * 1024
+    except ImportError:
+        pass
+    return memory
+
+
+class AllocationTracer:
+    """Starts tracemalloc on request and reports the top allocation sites.
+
+    Tracing slows every allocation down, so it's off until an admin starts
+    it and should be stopped again once done. Each snapshot is also compared
+    with the previous one to show what grew in between.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.previous = None
+        self.started_at = None
+
+    def start(self, frames=TRACE_FRAMES):
+        with self.lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(frames)
+                self.started_at = time.time()
+                self.previous = None
+        return self.status()
+
+    def stop(self):
+        with self.lock:
+            if tracemalloc.is_tracing():
+                tracemalloc.stop()
+            self.previous = None
+            self.started_at = None
+        return self.status()
+
+    def status(self):
+        tracing = tracemalloc.is_tracing()
+        status = {'tracing': tracing, 'started_at': self.started_at}
+        if tracing:
+            current, peak = tracemalloc.get_traced_memory()
+            status.update(traced_bytes=current, traced_peak_bytes=peak,
+                          overhead_bytes=tracemalloc.get_tracemalloc_memory())
+        return status
+
+    def snapshot(self, limit=TOP_ALLOCATIONS):
+        """Top allocation sites by size, and by growth since the last snapshot."""
+        with self.lock:
+            if not tracemalloc.is_tracing():
+                raise ValueError("Allocation tracing is off, start it first")
+            snapshot = tracemalloc.take_snapshot().filter_traces((
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, linecache.__file__),
+                tracemalloc.Filter(False, '<frozen importlib._bootstrap>')
+            ))
+            report = dict(self.status(), top=[
+                site(stat.traceback, stat.size, stat.count) for stat in snapshot.statistics('lineno')[:limit]
+            ])
+            if self.previous is not None:
+                report['growth'] = [
+                    dict(site(stat.traceback, stat.size, stat.count), size_diff=stat.size_diff, count_diff=stat.count_diff)
+                    for stat in snapshot.compare_to(self.previous, 'lineno')[:limit]
+                    if stat.size_diff > 0
+                ]
+            self.previous = snapshot
+            return report
+
+
+def site(traceback, size, count):
+    frame = traceback[0]
+    return {'file': frame.filename, 'line': frame.lineno, 'bytes': size, 'count': count}
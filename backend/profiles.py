@@ -0,0 +1,112 @@
+import re
+import threading
+from collections import deque
+
+# Add generation profiles, each one only overrides what differs from MODEL_CONFIG
+STOP_SEQUENCES = ["\nuser:", "\nQuestion:"]  # the model continuing our prompt format
+GENERATION_PROFILES = {
+    'quick': {
+        "max_output_tokens": 512,
+        "temperature": 0.3,
+        "stop_sequences": STOP_SEQUENCES
+    },
+    'chat': {
+        "max_output_tokens": 2048,
+        "temperature": 0.7,
+        "stop_sequences": STOP_SEQUENCES
+    },
+    'code': {
+        "max_output_tokens": 4096,
+        "temperature": 0.2,
+        "stop_sequences": ["\nuser:"]
+    },
+    'long_form': {
+        "max_output_tokens": 4096,
+        "temperature": 0.8,
+        "stop_sequences": STOP_SEQUENCES
+    }
+}
+DEFAULT_PROFILE = 'chat'
+# The MODEL_CONFIG values the profiles were tuned against, a reloaded config scales them
+REFERENCE_TEMPERATURE = 0.7
+REFERENCE_MAX_OUTPUT_TOKENS = 4096
+MAX_TEMPERATURE = 2.0
+LATENCY_SAMPLES = 500   # recent latencies kept per name for percentiles
+QUICK_MAX_WORDS = 12
+LONG_FORM_MIN_CHARS = 800
+
+# Add classifier patterns
+CODE_SYNTAX = re.compile(r"```|Traceback \(most recent call last\)|^\s*(def|class|import|from|function|const|let|SELECT)\b"
+                         r"|[;{}]\s*$|\w+\([^()]*\)\s*[:{]", re.MULTILINE)
+CODE_REQUEST = re.compile(r"\b(write|implement|build|create|generate|fix|debug|refactor|optimi[sz]e|convert)\b.*"
+                          r"\b(code|function|script|program|class|method|api|service|endpoint|query|regex|component"
+                          r"|module|bug|test)s?\b", re.IGNORECASE | re.DOTALL)
+CODE_TERMS = re.compile(r"\b(python|javascript|typescript|java|c\+\+|rust|golang|sql|html|css|react|flask|django"
+                        r"|numpy|pandas|compile[rd]?|stack ?trace|exception|segfault)\b", re.IGNORECASE)
+LONG_FORM_REQUEST = re.compile(r"\b(essay|article|story|report|tutorial|guide|in detail|in depth|step[- ]by[- ]step"
+                               r"|comprehensive|pros and cons|compare|explain how|write (a|an|me))\b", re.IGNORECASE)
+QUICK_QUESTION = re.compile(r"^\s*(what|who|when|where|which|is|are|does|do|can|how (much|many|old|far|long))\b"
+                            r"|^[\d\s.+\-*/^()=x?]+$", re.IGNORECASE)
+
+
+def classify_message(message):
+    """Pick a generation profile from cheap features of the message."""
+    text = message.strip()
+    if CODE_SYNTAX.search(text) or CODE_REQUEST.search(text) or CODE_TERMS.search(text):
+        return 'code'
+    if len(text) >= LONG_FORM_MIN_CHARS or LONG_FORM_REQUEST.search(text):
+        return 'long_form'
+    if len(text.split()) <= QUICK_MAX_WORDS and QUICK_QUESTION.search(text):
+        return 'quick'
+    return DEFAULT_PROFILE
+
+
+def generation_config_for(profile, base=None):
+    """A profile's generation config, scaled to the running `base` config when given.
+
+    Profiles are relative: with MODEL_TEMPERATURE halved every profile runs
+    at half its temperature, and the same goes for MODEL_MAX_OUTPUT_TOKENS.
+    """
+    config = dict(GENERATION_PROFILES[profile])
+    if base:
+        if base.get("temperature") is not None:
+            scaled = config["temperature"] * base["temperature"] / REFERENCE_TEMPERATURE
+            config["temperature"] = round(min(MAX_TEMPERATURE, scaled), 3)
+        if base.get("max_output_tokens"):
+            scaled = config["max_output_tokens"] * base["max_output_tokens"] // REFERENCE_MAX_OUTPUT_TOKENS
+            config["max_output_tokens"] = max(1, scaled)
+    return config
+
+
+class LatencyStats:
+    """Request counts and latency percentiles per name (profile, model, ...)."""
+
+    def __init__(self, names=GENERATION_PROFILES):
+        self.lock = threading.Lock()
+        self.names = list(names)
+        self.latencies = {name: deque(maxlen=LATENCY_SAMPLES) for name in self.names}
+        self.counts = {name: 0 for name in self.names}
+
+    def record(self, name, seconds):
+        with self.lock:
+            self.counts[name] += 1
+            self.latencies[name].append(seconds)
+
+    def snapshot(self):
+        with self.lock:
+            stats = {}
+            for name in self.names:
+                latencies = sorted(self.latencies[name])
+                stats[name] = {
+                    'requests': self.counts[name],
+                    'latency_ms_p50': _percentile_ms(latencies, 0.50),
+                    'latency_ms_p95': _percentile_ms(latencies, 0.95),
+                    'latency_ms_p99': _percentile_ms(latencies, 0.99)
+                }
+            return stats
+
+
+def _percentile_ms(values, fraction):
+    if not values:
+        return 0.0
+    return round(values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))] * 1000, 1)
@@ -0,0 +1,368 @@
+import socket
+import sqlite3
+from abc import ABC, abstractmethod
+import threading
+import time
+from functools import wraps
+from urllib.parse import urlparse
+
+from flask import request
+from flask_limiter.util import get_remote_address
+from errors import ServiceBusyError, busy_response
+
+# Add token bucket constants
+DEFAULT_CAPACITY = 5
+DEFAULT_PERIOD = 60  # seconds to refill a full bucket
+PRUNE_EVERY = 1000   # bucket writes between stale-row cleanups
+IP_BUCKET_FACTOR = 10  # an IP's shared bucket holds this many clients' worth of tokens
+
+
+class BucketStorage(ABC):
+    """Base class for token bucket storage shared between workers."""
+
+    @abstractmethod
+    def take(self, key, capacity, refill_rate, cost=1, force=False):
+        """Refill the bucket and try to remove `cost` tokens.
+
+        Returns (allowed, tokens_left). With force=True the tokens are
+        always removed, letting the bucket go into debt.
+        """
+
+    @staticmethod
+    def _apply(tokens, last, now, capacity, refill_rate, cost, force):
+        # Shared refill/take arithmetic used by the local backends
+        if tokens is None:
+            tokens, last = capacity, now
+        tokens = min(capacity, tokens + max(0.0, now - last) * refill_rate)
+        allowed = force or tokens >= cost
+        if allowed:
+            tokens = min(capacity, tokens - cost)
+        return allowed, tokens
+
+
+class MemoryBucketStorage(BucketStorage):
+    """Process-local storage, only shared between threads."""
+
+    def __init__(self):
+        self.buckets = {}
+        self.lock = threading.Lock()
+        self.writes = 0
+
+    def take(self, key, capacity, refill_rate, cost=1, force=False):
+        now = time.time()
+        with self.lock:
+            tokens, last, _ = self.buckets.get(key, (None, None, None))
+            allowed, tokens = self._apply(tokens, last, now, capacity, refill_rate, cost, force)
+            # Also keep when the bucket is full again, from then on it carries no state
+            self.buckets[key] = (tokens, now, now + (capacity - tokens) / refill_rate)
+            self.writes += 1
+            if self.writes % PRUNE_EVERY == 0:
+                self.prune(now)
+        return allowed, tokens
+
+    def prune(self, now=None):
+        """Drop buckets that have refilled, a new one starts full anyway. Call holding the lock."""
+        now = time.time() if now is None else now
+        for key in [key for key, (_, _, full_at) in self.buckets.items() if full_at <= now]:
+            del self.buckets[key]
+
+
+class SQLiteBucketStorage(BucketStorage):
+    """Storage in a SQLite file shared by every worker on the host."""
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        self.writes = 0
+        self._connect().execute(
+            "CREATE TABLE IF NOT EXISTS buckets ("
+            "key TEXT PRIMARY KEY, tokens REAL NOT NULL, ts REAL NOT NULL)"
+        )
+
+    def _connect(self):
+        # SQLite connections can't be shared between threads
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    def take(self, key, capacity, refill_rate, cost=1, force=False):
+        conn = self._connect()
+        # BEGIN IMMEDIATE takes the write lock so workers can't interleave
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            row = conn.execute(
+                "SELECT tokens, ts FROM buckets WHERE key = ?", (key,)
+            ).fetchone()
+            tokens, last = row if row else (None, None)
+            allowed, tokens = self._apply(tokens, last, now, capacity, refill_rate, cost, force)
+            conn.execute(
+                "INSERT OR REPLACE INTO buckets (key, tokens, ts) VALUES (?, ?, ?)",
+                (key, tokens, now)
+            )
+            self.writes += 1
+            if self.writes % PRUNE_EVERY == 0:
+                # Full buckets carry no state, drop rows idle for a day
+                conn.execute("DELETE FROM buckets WHERE ts < ?", (now - 86400,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return allowed, tokens
+
+
+# Lua script keeps refill and take atomic on the Redis server
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local force = tonumber(ARGV[4])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local last = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - last) * rate)
+local allowed = 0
+if force == 1 or tokens >= cost then
+    tokens = math.min(capacity, tokens - cost)
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return {allowed, tostring(tokens)}
+"""
+
+
+class RedisError(Exception):
+    pass
+
+
+class RedisConnection:
+    """Minimal RESP client, enough to run scripts against Redis-compatible servers."""
+
+    def __init__(self, host='localhost', port=6379, db=0, password=None, timeout=2.0):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.timeout = timeout
+        self.sock = None
+        self.reader = None
+
+    def connect(self):
+        self.sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.reader = self.sock.makefile('rb')
+        if self.password:
+            self._call('AUTH', self.password)
+        if self.db:
+            self._call('SELECT', self.db)
+
+    def close(self):
+        if self.sock:
+            try:
+                self.reader.close()
+                self.sock.close()
+            finally:
+                self.sock = None
+                self.reader = None
+
+    def execute(self, *args):
+        """Send one command, reconnecting once if the socket went stale."""
+        for attempt in range(2):
+            try:
+                if self.sock is None:
+                    self.connect()
+                return self._call(*args)
+            except (OSError, ConnectionError):
+                self.close()
+                if attempt:
+                    raise
+
+    def _call(self, *args):
+        self.sock.sendall(encode_command(*args))
+        return read_reply(self.reader)
+
+
+def encode_command(*args):
+    # Commands are sent as RESP arrays of bulk strings
+    parts = [b'*%d\r\n' % len(args)]
+    for arg in args:
+        if not isinstance(arg, bytes):
+            arg = str(arg).encode('utf-8')
+        parts.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+    return b''.join(parts)
+
+
+def read_reply(reader):
+    line = reader.readline()
+    if not line:
+        raise ConnectionError("Connection closed by Redis server")
+    kind, payload = line[:1], line[1:-2]
+    if kind == b'+':
+        return payload.decode('utf-8')
+    if kind == b'-':
+        raise RedisError(payload.decode('utf-8'))
+    if kind == b':':
+        return int(payload)
+    if kind == b'$':
+        length = int(payload)
+        if length < 0:
+            return None
+        data = reader.read(length + 2)
+        return data[:-2]
+    if kind == b'*':
+        length = int(payload)
+        if length < 0:
+            return None
+        return [read_reply(reader) for _ in range(length)]
+    raise RedisError(f"Unknown reply type: {line!r}")
+
+
+class RedisBucketStorage(BucketStorage):
+    """Storage on a Redis-protocol server, shared across hosts."""
+
+    def __init__(self, host='localhost', port=6379, db=0, password=None, prefix='chatgenie:bucket:'):
+        self.options = dict(host=host, port=port, db=db, password=password)
+        self.prefix = prefix
+        self.local = threading.local()
+        self.script_sha = None
+
+    def _connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = self.local.conn = RedisConnection(**self.options)
+        return conn
+
+    def take(self, key, capacity, refill_rate, cost=1, force=False):
+        conn = self._connection()
+        args = (1, self.prefix + key, capacity, refill_rate, cost, int(force))
+        if self.script_sha is None:
+            self.script_sha = conn.execute('SCRIPT', 'LOAD', TOKEN_BUCKET_SCRIPT).decode('ascii')
+        try:
+            reply = conn.execute('EVALSHA', self.script_sha, *args)
+        except RedisError as e:
+            if not str(e).startswith('NOSCRIPT'):
+                raise
+            reply = conn.execute('EVAL', TOKEN_BUCKET_SCRIPT, *args)
+        return bool(reply[0]), float(reply[1])
+
+
+def create_bucket_storage(uri):
+    """Build a storage backend from memory://, sqlite:///path or redis://host:port/db."""
+    parsed = urlparse(uri)
+    if parsed.scheme == 'memory':
+        return MemoryBucketStorage()
+    if parsed.scheme == 'sqlite':
+        # sqlite:///relative.db and sqlite:////absolute/path.db
+        path = uri[len('sqlite:///'):] if uri.startswith('sqlite:///') else parsed.path
+        if not path:
+            raise ValueError("SQLite rate limit storage needs a file path")
+        return SQLiteBucketStorage(path)
+    if parsed.scheme == 'redis':
+        db = int(parsed.path.lstrip('/') or 0)
+        return RedisBucketStorage(
+            host=parsed.hostname or 'localhost',
+            port=parsed.port or 6379,
+            db=db,
+            password=parsed.password
+        )
+    raise ValueError(f"Unsupported rate limit storage: {uri}")
+
+
+def rate_limit_key():
+    """Key buckets by user, then session, falling back to the client IP."""
+    user_id = request.headers.get('X-User-Id')
+    if user_id:
+        return f"user:{user_id}"
+    data = request.get_json(silent=True)
+    if isinstance(data, dict) and data.get('sessionId'):
+        return f"session:{data['sessionId']}"
+    return f"ip:{get_remote_address()}"
+
+
+class TokenBucketLimiter:
+    """Token bucket rate limiting on top of a shared BucketStorage.
+
+    User and session ids come from the client, so each request also takes
+    from a bucket shared by its IP that holds `ip_factor` times as many
+    tokens. Rotating ids then only helps until the IP's bucket is empty.
+    """
+
+    def __init__(self, storage, key_func=rate_limit_key, ip_factor=IP_BUCKET_FACTOR):
+        self.storage = storage
+        self.key_func = key_func
+        self.ip_factor = ip_factor
+        self.metrics = {'allowed': 0, 'limited': 0, 'ip_limited': 0, 'storage_errors': 0}
+
+    def hit(self, key, capacity, period, cost=1):
+        """Take `cost` tokens for `key`, returning (allowed, retry_after)."""
+        refill_rate = capacity / period
+        allowed, tokens = self.storage.take(key, capacity, refill_rate, cost)
+        if allowed:
+            self.metrics['allowed'] += 1
+            return True, 0.0
+        self.metrics['limited'] += 1
+        return False, (cost - tokens) / refill_rate
+
+    def check(self, key, capacity, period, cost=1):
+        """Like hit(), but fails open so a storage outage doesn't take chat down."""
+        try:
+            return self.hit(key, capacity, period, cost)
+        except Exception:
+            self.metrics['storage_errors'] += 1
+            return True, 0.0
+
+    def check_client(self, scope, key, ip, capacity, period, cost=1):
+        """check() the client's own bucket, then the bigger one shared by its IP.
+
+        When the IP's bucket refuses, the client's tokens are given back,
+        a request that never ran doesn't cost the client anything.
+        """
+        allowed, retry_after = self.check(f"{scope}:{key}", capacity, period, cost)
+        if allowed and self.ip_factor and ip and key != f"ip:{ip}":
+            allowed, retry_after = self.check(f"{scope}:ip:{ip}", capacity * self.ip_factor, period, cost)
+            if not allowed:
+                self.metrics['ip_limited'] += 1
+                self.refund(f"{scope}:{key}", capacity, period, cost)
+        return allowed, retry_after
+
+    def refund(self, key, capacity, period, cost=1):
+        """Put `cost` tokens back into `key`'s bucket, never above capacity."""
+        try:
+            self.storage.take(key, capacity, capacity / period, -cost, force=True)
+            self.metrics['allowed'] -= 1
+        except Exception:
+            self.metrics['storage_errors'] += 1
+
+    def limit(self, capacity=DEFAULT_CAPACITY, period=DEFAULT_PERIOD, scope='default', cost=None):
+        """Decorate a view so it answers 429 with Retry-After once the bucket is empty.
+
+        `cost` may be a callable evaluated per request, e.g. to charge batches by size.
+        `capacity` and `period` may be callables too, so reloaded limits apply at once.
+        """
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                amount = cost() if callable(cost) else (cost or 1)
+                allowed, retry_after = self.check_client(
+                    scope,
+                    self.key_func(),
+                    get_remote_address(),
+                    capacity() if callable(capacity) else capacity,
+                    period() if callable(period) else period,
+                    amount
+                )
+                if not allowed:
+                    return busy_response(ServiceBusyError(
+                        "⏳ Too many requests, please slow down",
+                        retry_after=max(1, retry_after)
+                    ))
+                return view(*args, **kwargs)
+            return wrapper
+        return decorator
@@ -0,0 +1,347 @@
+import argparse
+import hashlib
+import json
+import logging
+import queue
+import threading
+import uuid
+from bisect import bisect_right
+import requests
+from flask import Flask, Response, jsonify, request, stream_with_context
+from errors import ServiceBusyError, busy_response
+from drain import DRAINING_HEADER
+
+logger = logging.getLogger(__name__)
+
+# Add router constants
+VIRTUAL_NODES = 160         # ring points per backend, more points = smoother spread
+HEALTH_INTERVAL = 2.0       # seconds between health check rounds
+HEALTH_TIMEOUT = 1.0
+FAIL_THRESHOLD = 2          # consecutive failed checks before a node leaves the ring
+CONNECT_TIMEOUT = 2.0
+READ_TIMEOUT = 120.0        # model calls can be slow, batches slower still
+HOP_BY_HOP_HEADERS = {
+    'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization',
+    'te', 'trailer', 'trailers', 'transfer-encoding', 'upgrade', 'host', 'content-length'
+}
+
+
+def _hash(value):
+    return int.from_bytes(hashlib.md5(value.encode('utf-8')).digest()[:8], 'big')
+
+
+class HashRing:
+    """Consistent hash ring with virtual nodes.
+
+    Adding or removing a node only moves the keys that land on its points,
+    about 1/N of them, everything else keeps its owner.
+    """
+
+    def __init__(self, nodes=(), vnodes=VIRTUAL_NODES):
+        self.vnodes = vnodes
+        self.lock = threading.Lock()
+        self.points = []
+        self.owners = []
+        self.nodes = set()
+        for node in nodes:
+            self.add(node)
+
+    def add(self, node):
+        with self.lock:
+            if node in self.nodes:
+                return False
+            self.nodes.add(node)
+            self._rebuild()
+            return True
+
+    def remove(self, node):
+        with self.lock:
+            if node not in self.nodes:
+                return False
+            self.nodes.discard(node)
+            self._rebuild()
+            return True
+
+    def _rebuild(self):
+        ring = sorted((_hash(f"{node}#{i}"), node) for node in self.nodes for i in range(self.vnodes))
+        # Swap both lists at once so readers never see a half-built ring
+        self.points, self.owners = [point for point, _ in ring], [node for _, node in ring]
+
+    def get(self, key):
+        points, owners = self.points, self.owners
+        if not points:
+            return None
+        index = bisect_right(points, _hash(key)) % len(points)
+        return owners[index]
+
+    def __len__(self):
+        return len(self.nodes)
+
+
+class SessionRouter:
+    """Front process that pins each session to one backend worker.
+
+    Backends join the ring once they pass a health check and leave it after
+    FAIL_THRESHOLD failures in a row (or a refused connection), so only the
+    sessions owned by a dead node move.
+    """
+
+    def __init__(self, backends, vnodes=VIRTUAL_NODES, health_interval=HEALTH_INTERVAL,
+                 health_timeout=HEALTH_TIMEOUT, fail_threshold=FAIL_THRESHOLD):
+        self.backends = [backend.rstrip('/') for backend in backends]
+        self.ring = HashRing(vnodes=vnodes)
+        self.health_interval = health_interval
+        self.health_timeout = health_timeout
+        self.fail_threshold = fail_threshold
+        # Failure counts and metrics change on request threads and the health thread
+        self.lock = threading.Lock()
+        self.failures = {backend: 0 for backend in self.backends}
+        self.http = requests.Session()
+        self.stopped = threading.Event()
+        self.checker = None
+        self.metrics = {
+            'requests': {backend: 0 for backend in self.backends},
+            'failovers': 0,
+            'joins': 0,
+            'leaves': 0
+        }
+
+    # Membership
+
+    def start(self):
+        # One synchronous round so the ring is populated before the first request
+        self.check_health()
+        self.checker = threading.Thread(target=self._health_loop, name='router-health', daemon=True)
+        self.checker.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+
+    def _health_loop(self):
+        while not self.stopped.wait(self.health_interval):
+            self.check_health()
+
+    def check_health(self):
+        for backend in self.backends:
+            try:
+                healthy = self.http.get(f"{backend}/health", timeout=self.health_timeout).status_code == 200
+            except requests.RequestException:
+                healthy = False
+            if healthy:
+                with self.lock:
+                    self.failures[backend] = 0
+                if self.ring.add(backend):
+                    self.count('joins')
+                    logger.info(f"Backend joined: {backend}")
+            else:
+                with self.lock:
+                    self.failures[backend] += 1
+                    failed = self.failures[backend] >= self.fail_threshold
+                if failed:
+                    self.mark_down(backend)
+
+    def mark_down(self, backend, failover=False):
+        with self.lock:
+            if failover:
+                # Unreachable or draining, don't wait for more failed checks
+                self.failures[backend] = self.fail_threshold
+                self.metrics['failovers'] += 1
+        if self.ring.remove(backend):
+            self.count('leaves')
+            logger.warning(f"Backend left: {backend}")
+
+    def count(self, name):
+        with self.lock:
+            self.metrics[name] += 1
+
+    def status(self):
+        with self.lock:
+            return dict(self.failures), dict(self.metrics, requests=dict(self.metrics['requests']))
+
+    # Routing
+
+    def forward(self, key, path, body, headers, method='POST', params=None):
+        """Send one request to the key's owner, failing over once if it's unreachable or draining."""
+        for _ in range(2):
+            backend = self.ring.get(key)
+            if backend is None:
+                break
+            try:
+                upstream = self.http.request(
+                    method, f"{backend}/{path}", params=params, data=body,
+                    headers=headers, stream=True, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT)
+                )
+            except requests.ConnectionError:
+                self.mark_down(backend, failover=True)
+                continue
+            if upstream.status_code == 503 and upstream.headers.get(DRAINING_HEADER):
+                # The owner is shutting down, send its sessions to the next node now
+                upstream.close()
+                self.mark_down(backend, failover=True)
+                continue
+            with self.lock:
+                self.metrics['requests'][backend] += 1
+            return upstream
+        raise ServiceBusyError("🚦 No chat backends are available right now", retry_after=self.health_interval,
+                               status_code=503)
+
+    def create_app(self):
+        app = Flask(__name__)
+
+        @app.route('/router/status', methods=['GET'])
+        def router_status():
+            failures, metrics = self.status()
+            return jsonify({
+                "healthy": sorted(self.ring.nodes),
+                "backends": self.backends,
+                "failures": failures,
+                "metrics": metrics
+            })
+
+        @app.route('/chat/batch', methods=['POST', 'OPTIONS'])
+        def batch():
+            if request.method == 'OPTIONS':
+                return proxy('chat/batch')
+            try:
+                return self.proxy_batch()
+            except ServiceBusyError as e:
+                return busy_response(e)
+
+        @app.route('/', defaults={'path': ''}, methods=['GET', 'POST', 'PUT', 'DELETE', 'OPTIONS'])
+        @app.route('/<path:path>', methods=['GET', 'POST', 'PUT', 'DELETE', 'OPTIONS'])
+        def proxy(path):
+            try:
+                key, body = session_key(path)
+                upstream = self.forward(key, path, body, forward_headers(), request.method, request.args)
+            except ServiceBusyError as e:
+                return busy_response(e)
+            # Pass bytes through untouched so compressed and streamed responses stay as they are
+            response = Response(
+                stream_with_context(upstream.raw.stream(8192, decode_content=False)),
+                status=upstream.status_code,
+                headers=response_headers(upstream)
+            )
+            response.call_on_close(upstream.close)
+            return response
+
+        return app
+
+    def proxy_batch(self):
+        """Split a batch by owner, send the parts in parallel and merge the NDJSON streams."""
+        data = request.get_json(silent=True)
+        items = data.get('items') if isinstance(data, dict) else None
+        if not isinstance(items, list) or not items:
+            key, body = session_key('chat/batch')
+            upstream = self.forward(key, 'chat/batch', body, forward_headers())
+            return Response(upstream.content, status=upstream.status_code, headers=response_headers(upstream))
+
+        # Give new sessions their IDs here so they're created on the node that owns them
+        parts = {}
+        for index, item in enumerate(items):
+            if isinstance(item, dict) and not item.get('sessionId'):
+                item = dict(item, sessionId=f"batch-{uuid.uuid4().hex}")
+            key = item.get('sessionId') if isinstance(item, dict) else str(index)
+            parts.setdefault(self.ring.get(str(key)), []).append((index, item, key))
+        if None in parts:
+            raise ServiceBusyError("🚦 No chat backends are available right now",
+                                   retry_after=self.health_interval, status_code=503)
+
+        headers = forward_headers()
+        headers['Content-Type'] = 'application/json'
+        headers.pop('Content-Encoding', None)
+        headers.pop('Accept-Encoding', None)
+        results = queue.Queue()
+
+        def run_part(part):
+            indexes = [index for index, _, _ in part]
+            body = dict(data, items=[item for _, item, _ in part])
+            try:
+                upstream = self.forward(str(part[0][2]), 'chat/batch', _json_bytes(body), headers)
+                for line in upstream.iter_lines():
+                    if not line:
+                        continue
+                    result = json.loads(line)
+                    # Map the sub-batch index back to the caller's index
+                    if isinstance(result, dict) and isinstance(result.get('index'), int):
+                        result['index'] = indexes[result['index']]
+                    results.put(result)
+            except Exception as e:
+                for index in indexes:
+                    results.put({"index": index, "status": "error", "error": str(e)})
+            finally:
+                results.put(None)
+
+        for part in parts.values():
+            threading.Thread(target=run_part, args=(part,), daemon=True).start()
+
+        def merged():
+            remaining = len(parts)
+            while remaining:
+                result = results.get()
+                if result is None:
+                    remaining -= 1
+                    continue
+                yield _json_bytes(result) + b"\n"
+
+        return Response(merged(), mimetype='application/x-ndjson')
+
+
+def session_key(path):
+    """Pick the routing key for the current request, plus the body to forward.
+
+    Compressed bodies are forwarded without being read, so those requests
+    keep their session's backend only when they carry ?sessionId=.
+    """
+    body = request.get_data()
+    if path.startswith('sessions/'):
+        return path.split('/')[1], body
+    if request.args.get('sessionId'):
+        return request.args['sessionId'], body
+    data = request.get_json(silent=True) if body and not request.content_encoding else None
+    if isinstance(data, dict):
+        if not data.get('sessionId') and path == 'chat':
+            # Name the session here so the backend that creates it is the one that owns it
+            data['sessionId'] = str(uuid.uuid4())
+            body = _json_bytes(data)
+        if data.get('sessionId'):
+            return str(data['sessionId']), body
+    return request.headers.get('X-User-Id') or request.remote_addr or 'anonymous', body
+
+
+def forward_headers():
+    headers = {name: value for name, value in request.headers.items() if name.lower() not in HOP_BY_HOP_HEADERS}
+    forwarded = request.headers.get('X-Forwarded-For')
+    headers['X-Forwarded-For'] = f"{forwarded}, {request.remote_addr}" if forwarded else request.remote_addr
+    return headers
+
+
+def response_headers(upstream):
+    headers = [(name, value) for name, value in upstream.headers.items() if name.lower() not in HOP_BY_HOP_HEADERS]
+    if 'Content-Length' in upstream.headers and 'Transfer-Encoding' not in upstream.headers:
+        headers.append(('Content-Length', upstream.headers['Content-Length']))
+    return headers
+
+
+def _json_bytes(data):
+    return json.dumps(data, ensure_ascii=False).encode('utf-8')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Consistent-hash session router for ChatGenie backends")
+    parser.add_argument('--backend', action='append', required=True,
+                        help="Backend base URL, e.g. http://127.0.0.1:5001 (repeat for each node)")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--vnodes', type=int, default=VIRTUAL_NODES)
+    parser.add_argument('--health-interval', type=float, default=HEALTH_INTERVAL)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    router = SessionRouter(args.backend, vnodes=args.vnodes, health_interval=args.health_interval).start()
+    logger.info(f"Routing sessions across {len(router.ring)}/{len(args.backend)} healthy backends")
+    router.create_app().run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == '__main__':
+    main()
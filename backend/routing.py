@@ -0,0 +1,66 @@
+import threading
+from collections import Counter
+from profiles import LatencyStats, classify_message
+
+# Add routing constants
+FAST_PROFILES = {'quick', 'chat'}   # profiles the fast model answers well enough
+
+
+class ModelRouter:
+    """Sends simple turns to a fast model and hard ones to a capable model.
+
+    Code and long-form turns go straight to the capable model, as do
+    regenerates since the user didn't like the last answer. Anything the
+    fast model answers that fails validation is escalated once.
+    """
+
+    def __init__(self, models, fast='fast', capable='capable'):
+        self.models = models
+        self.fast = fast if fast in models else capable
+        self.capable = capable
+        self.lock = threading.Lock()
+        self.decisions = Counter()
+        self.escalations = Counter()
+        self.latency = LatencyStats(models)
+
+    def choose(self, message, profile=None, regenerate=False):
+        """Return (model name, reason) for a turn."""
+        if regenerate:
+            return self._decide(self.capable, 'regenerate')
+        profile = profile or classify_message(message)
+        if profile in FAST_PROFILES:
+            return self._decide(self.fast, f"profile:{profile}")
+        return self._decide(self.capable, f"profile:{profile}")
+
+    def escalate(self, reason):
+        with self.lock:
+            self.escalations[reason] += 1
+            self.decisions[f"{self.capable}:escalated"] += 1
+        return self.capable
+
+    def can_escalate(self, name):
+        return name != self.capable
+
+    def record_latency(self, name, seconds):
+        self.latency.record(name, seconds)
+
+    def _decide(self, name, reason):
+        with self.lock:
+            self.decisions[f"{name}:{reason}"] += 1
+        return name, reason
+
+    def stats(self):
+        with self.lock:
+            routed = Counter()
+            for key, count in self.decisions.items():
+                if not key.endswith(':escalated'):
+                    routed[key.split(':', 1)[0]] += count
+            fast_turns = routed[self.fast] if self.fast != self.capable else 0
+            escalated = sum(self.escalations.values())
+            return {
+                'decisions': dict(self.decisions),
+                'routed': dict(routed),
+                'escalations': dict(self.escalations),
+                'escalation_rate': round(escalated / fast_turns, 4) if fast_turns else 0.0,
+                'latency': self.latency.snapshot()
+            }
@@ -0,0 +1,166 @@
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from errors import ServiceBusyError
+
+# Add scheduler constants (classes listed from highest to lowest priority)
+PRIORITY_CLASSES = ('interactive', 'regenerate', 'batch')
+DEFAULT_SLOTS = 8
+DEFAULT_MAX_WAIT = 30.0  # seconds before a queued request is shed
+WAIT_SAMPLES = 500       # recent wait times kept per class for percentiles
+
+
+class _Ticket:
+    def __init__(self, priority, flow, finish_tag, start_tag):
+        self.priority = priority
+        self.flow = flow
+        self.finish_tag = finish_tag
+        self.start_tag = start_tag
+        self.granted = threading.Event()
+        self.cancelled = False
+
+
+class RequestScheduler:
+    """Hands out a bounded number of upstream slots.
+
+    Classes are served in strict priority order. Inside a class, flows
+    (users or sessions) share slots by weighted fair queuing: each request
+    gets a virtual finish tag and the smallest tag goes next, so one busy
+    flow can't starve the others.
+    """
+
+    def __init__(self, slots=DEFAULT_SLOTS, max_wait=DEFAULT_MAX_WAIT, weights=None):
+        self.slots = slots
+        self.free = slots
+        self.max_wait = max_wait
+        self.weights = weights or {}
+        self.lock = threading.Lock()
+        self.counter = itertools.count()
+        self.queues = {name: [] for name in PRIORITY_CLASSES}
+        self.virtual_time = {name: 0.0 for name in PRIORITY_CLASSES}
+        self.last_finish = {}
+        self.waits = {name: deque(maxlen=WAIT_SAMPLES) for name in PRIORITY_CLASSES}
+        self.metrics = {
+            'granted': {name: 0 for name in PRIORITY_CLASSES},
+            'queued': {name: 0 for name in PRIORITY_CLASSES},
+            'shed': {name: 0 for name in PRIORITY_CLASSES},
+            'max_queue_depth': {name: 0 for name in PRIORITY_CLASSES}
+        }
+
+    @contextmanager
+    def slot(self, priority='interactive', flow='anonymous', cost=1.0, on_queued=None):
+        """Hold an upstream slot for the duration of the block."""
+        self.acquire(priority, flow, cost, on_queued)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def acquire(self, priority='interactive', flow='anonymous', cost=1.0, on_queued=None):
+        """Wait for a slot; `on_queued(depth)` is called if the request has to queue."""
+        if priority not in self.queues:
+            priority = 'interactive'
+        started = time.monotonic()
+        with self.lock:
+            # Fast path: a slot is free and nobody is waiting for one
+            if self.free and not any(self.queues.values()):
+                self.free -= 1
+                self._record_grant(priority, 0.0)
+                return 0.0
+            key = (priority, flow)
+            weight = self.weights.get(flow, 1.0)
+            start_tag = max(self.virtual_time[priority], self.last_finish.get(key, 0.0))
+            finish_tag = start_tag + cost / weight
+            self.last_finish[key] = finish_tag
+            ticket = _Ticket(priority, flow, finish_tag, start_tag)
+            heapq.heappush(self.queues[priority], (finish_tag, next(self.counter), ticket))
+            self.metrics['queued'][priority] += 1
+            depth = len(self.queues[priority])
+            if depth > self.metrics['max_queue_depth'][priority]:
+                self.metrics['max_queue_depth'][priority] = depth
+            # Slots may be free behind cancelled tickets
+            self._dispatch()
+
+        if on_queued and not ticket.granted.is_set():
+            on_queued(depth)
+        if ticket.granted.wait(self.max_wait):
+            waited = time.monotonic() - started
+            with self.lock:
+                self._record_grant(priority, waited)
+            return waited
+
+        with self.lock:
+            if ticket.granted.is_set():
+                # Granted just as we timed out, keep the slot
+                waited = time.monotonic() - started
+                self._record_grant(priority, waited)
+                return waited
+            ticket.cancelled = True
+            self.metrics['shed'][priority] += 1
+        raise ServiceBusyError("🚦 The AI service is busy right now, please try again shortly",
+                               retry_after=self.max_wait / 2, status_code=503)
+
+    def release(self):
+        with self.lock:
+            self.free += 1
+            self._dispatch()
+
+    def _dispatch(self):
+        # Hand free slots to the best waiting tickets
+        while self.free:
+            ticket = self._pop_next()
+            if ticket is None:
+                return
+            self.free -= 1
+            self.virtual_time[ticket.priority] = ticket.start_tag
+            ticket.granted.set()
+
+    def _pop_next(self):
+        for name in PRIORITY_CLASSES:
+            queue = self.queues[name]
+            while queue:
+                _, _, ticket = heapq.heappop(queue)
+                if not ticket.cancelled:
+                    return ticket
+        return None
+
+    def _record_grant(self, priority, waited):
+        self.metrics['granted'][priority] += 1
+        self.waits[priority].append(waited)
+        if not any(self.queues.values()):
+            # Idle: reset tags so old flows don't carry credit forever
+            self.last_finish.clear()
+            for name in PRIORITY_CLASSES:
+                self.virtual_time[name] = 0.0
+
+    def stats(self):
+        """Snapshot of queue depth, slot usage and wait time per class."""
+        with self.lock:
+            classes = {}
+            for name in PRIORITY_CLASSES:
+                waits = sorted(self.waits[name])
+                classes[name] = {
+                    'queue_depth': sum(1 for _, _, t in self.queues[name] if not t.cancelled),
+                    'max_queue_depth': self.metrics['max_queue_depth'][name],
+                    'granted': self.metrics['granted'][name],
+                    'queued': self.metrics['queued'][name],
+                    'shed': self.metrics['shed'][name],
+                    'wait_p50': _percentile(waits, 0.50),
+                    'wait_p95': _percentile(waits, 0.95),
+                    'wait_max': waits[-1] if waits else 0.0
+                }
+            return {
+                'slots': self.slots,
+                'in_use': self.slots - self.free,
+                'classes': classes
+            }
+
+
+def _percentile(values, fraction):
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, int(round(fraction * (len(values) - 1))))
+    return values[index]
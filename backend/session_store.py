@@ -0,0 +1,284 @@
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from collections.abc import ItemsView, MutableMapping
+from datetime import datetime
+
+# orjson encodes sessions several times faster when it's installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+# Add session store constants
+DEFAULT_IDLE_SECONDS = 300.0     # sessions untouched this long move to disk
+DEFAULT_SPILL_INTERVAL = 30.0    # seconds between idle sweeps
+SPILL_BATCH = 200                # sessions written per transaction, the lock is released in between
+COMPRESS_LEVEL = 1               # chat text compresses well even at the fastest level
+# Live objects rebuilt on the next turn, never written out
+TRANSIENT_KEYS = ('chat_instance', 'model_chats', 'model_generation', 'turn_lock', 'spare_fetch')
+
+
+def _dumps(state):
+    if orjson is not None:
+        return orjson.dumps(state)
+    return json.dumps(state, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def _loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def encode_session(session):
+    """Compressed bytes for a session without its live SDK chats and locks."""
+    state = {key: value for key, value in session.items() if key not in TRANSIENT_KEYS}
+    if isinstance(state.get('last_access'), datetime):
+        state['last_access'] = state['last_access'].isoformat()
+    return zlib.compress(_dumps(state), COMPRESS_LEVEL)
+
+
+def decode_session(data):
+    """A session dict back from encode_session; its chat instance is started on the next turn."""
+    session = _loads(zlib.decompress(data))
+    if isinstance(session.get('last_access'), str):
+        session['last_access'] = datetime.fromisoformat(session['last_access'])
+    if 'artifacts' in session:
+        # Compaction evicts the oldest artifact first, keep the order type
+        session['artifacts'] = OrderedDict(session['artifacts'])
+    session['chat_instance'] = None
+    return session
+
+
+class _ItemsView(ItemsView):
+    def __iter__(self):
+        yield from self._mapping.iter_items()
+
+
+class TieredSessionStore(MutableMapping):
+    """Chat sessions kept in memory while in use and in SQLite once idle.
+
+    Works as the `chat_history` dict. Sessions nobody touched for
+    `idle_seconds` are written to disk by a background sweep and dropped
+    from memory, along with their SDK chats; reading one brings it back
+    and the chat is rebuilt from the stored messages on its next turn.
+    Sessions in the middle of a turn are never moved.
+
+    The file is a spill area for this process, not durable storage: it
+    starts empty and is removed on close. The conversation log is what
+    survives restarts. A given `path` gets the process id appended, so
+    workers started with the same setting never empty each other's file.
+    """
+
+    def __init__(self, path=None, idle_seconds=DEFAULT_IDLE_SECONDS, spill_interval=DEFAULT_SPILL_INTERVAL):
+        self.idle_seconds = idle_seconds
+        self.spill_interval = spill_interval
+        if path is None:
+            fd, path = tempfile.mkstemp(prefix='chatgenie-sessions-', suffix='.db')
+            os.close(fd)
+        else:
+            root, ext = os.path.splitext(path)
+            path = f"{root}-{os.getpid()}{ext}"
+        self.path = path
+        self.lock = threading.RLock()
+        self.hot = {}
+        self.touched = {}
+        self.cold = set()
+        self.stopped = threading.Event()
+        self.sweeper = None
+        self.metrics = {'spilled': 0, 'rehydrated': 0, 'unspillable': 0, 'spill_errors': 0, 'cold_bytes': 0}
+        # One connection used under the lock, so it's shared between threads
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=OFF")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, data BLOB NOT NULL)")
+        self.conn.execute("DELETE FROM sessions")
+
+    # Mapping interface
+
+    def __getitem__(self, session_id):
+        with self.lock:
+            session = self.hot.get(session_id)
+            if session is None:
+                if session_id not in self.cold:
+                    raise KeyError(session_id)
+                session = self._rehydrate(session_id)
+            self.touched[session_id] = time.monotonic()
+            return session
+
+    def __setitem__(self, session_id, session):
+        with self.lock:
+            if session_id in self.cold:
+                self._delete_cold(session_id)
+            self.hot[session_id] = session
+            self.touched[session_id] = time.monotonic()
+
+    def __delitem__(self, session_id):
+        with self.lock:
+            if session_id in self.hot:
+                del self.hot[session_id]
+                self.touched.pop(session_id, None)
+            elif session_id in self.cold:
+                self._delete_cold(session_id)
+            else:
+                raise KeyError(session_id)
+
+    def __contains__(self, session_id):
+        # Checked without loading, so a lookup alone doesn't pull a session back into memory
+        with self.lock:
+            return session_id in self.hot or session_id in self.cold
+
+    def __iter__(self):
+        with self.lock:
+            session_ids = list(self.hot) + list(self.cold)
+        return iter(session_ids)
+
+    def __len__(self):
+        with self.lock:
+            return len(self.hot) + len(self.cold)
+
+    def setdefault(self, session_id, default=None):
+        # Atomic, two requests creating the same session get the same dict
+        with self.lock:
+            if session_id not in self:
+                self[session_id] = default
+            return self[session_id]
+
+    def items(self):
+        return _ItemsView(self)
+
+    def iter_items(self, session_ids=None):
+        """(session_id, session) for every session, or the given ids that exist.
+
+        Cold sessions are decoded one at a time and left on disk, for
+        read-only walks like exports and cleanup that would otherwise pull
+        every idle session back into memory.
+        """
+        if session_ids is None:
+            with self.lock:
+                session_ids = list(self.hot) + list(self.cold)
+        for session_id in session_ids:
+            with self.lock:
+                session = self.hot.get(session_id)
+                if session is None and session_id in self.cold:
+                    row = self.conn.execute("SELECT data FROM sessions WHERE id = ?", (session_id,)).fetchone()
+                    session = decode_session(row[0]) if row else None
+            if session is not None:
+                yield session_id, session
+
+    # Spilling
+
+    def spill_idle(self, now=None):
+        """Move sessions idle for `idle_seconds` to disk; returns how many moved."""
+        cutoff = (time.monotonic() if now is None else now) - self.idle_seconds
+        with self.lock:
+            candidates = [session_id for session_id, touched in self.touched.items() if touched <= cutoff]
+        spilled = 0
+        for start in range(0, len(candidates), SPILL_BATCH):
+            with self.lock:
+                spilled += self._spill(candidates[start:start + SPILL_BATCH], cutoff)
+        return spilled
+
+    def _spill(self, session_ids, cutoff):
+        rows = []
+        for session_id in session_ids:
+            session = self.hot.get(session_id)
+            # Touched since the candidates were picked, or gone
+            if session is None or self.touched.get(session_id, 0) > cutoff:
+                continue
+            lock = session.get('turn_lock')
+            if lock is not None and lock.locked():
+                continue
+            # A background spare fetch still writes into this dict
+            fetch = session.get('spare_fetch')
+            if fetch is not None and not fetch.done():
+                continue
+            try:
+                rows.append((session_id, encode_session(session)))
+            except (TypeError, ValueError) as e:
+                # Stays in memory, something in it doesn't serialize
+                self.metrics['unspillable'] += 1
+                logger.warning(f"Session {session_id} can't be moved to disk: {e}")
+        if not rows:
+            return 0
+        try:
+            self.conn.execute("BEGIN")
+            self.conn.executemany("INSERT OR REPLACE INTO sessions (id, data) VALUES (?, ?)", rows)
+            self.conn.execute("COMMIT")
+        except sqlite3.Error as e:
+            self.conn.execute("ROLLBACK")
+            self.metrics['spill_errors'] += 1
+            logger.error(f"Moving idle sessions to disk failed: {e}")
+            return 0
+        for session_id, data in rows:
+            del self.hot[session_id]
+            del self.touched[session_id]
+            self.cold.add(session_id)
+            self.metrics['cold_bytes'] += len(data)
+        self.metrics['spilled'] += len(rows)
+        return len(rows)
+
+    def _rehydrate(self, session_id):
+        # Holding the lock
+        row = self.conn.execute("SELECT data FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        if row is None:
+            self.cold.discard(session_id)
+            raise KeyError(session_id)
+        session = decode_session(row[0])
+        self._delete_cold(session_id, len(row[0]))
+        self.hot[session_id] = session
+        self.metrics['rehydrated'] += 1
+        return session
+
+    def _delete_cold(self, session_id, size=None):
+        # Holding the lock
+        if size is None:
+            row = self.conn.execute("SELECT length(data) FROM sessions WHERE id = ?", (session_id,)).fetchone()
+            size = row[0] if row else 0
+        self.conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+        self.cold.discard(session_id)
+        self.metrics['cold_bytes'] -= size
+
+    def stats(self):
+        with self.lock:
+            return dict(self.metrics, hot=len(self.hot), cold=len(self.cold))
+
+    # Lifecycle
+
+    def start(self):
+        self.sweeper = threading.Thread(target=self._sweep_loop, name='session-spill', daemon=True)
+        self.sweeper.start()
+        return self
+
+    def _sweep_loop(self):
+        while not self.stopped.wait(self.spill_interval):
+            try:
+                self.spill_idle()
+            except Exception as e:
+                logger.error(f"Idle session sweep failed: {e}")
+
+    def close(self):
+        self.stopped.set()
+        if self.sweeper is not None:
+            self.sweeper.join(5)
+            self.sweeper = None
+        with self.lock:
+            if self.conn is None:
+                return
+            self.conn.close()
+            self.conn = None
+        # Only this process used the file
+        for suffix in ('', '-wal', '-shm'):
+            try:
+                os.remove(self.path + suffix)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,277 @@
+"""Stream chat sessions out of one ChatGenie server and into another.
+
+The format is a 6 byte header (magic, version, codec) followed by one
+compressed stream of length-prefixed records:
+
+    S  session start  {"id", "meta", "count"}
+    M  messages       [message, ...]   up to MESSAGE_CHUNK per record
+    E  end of stream  {"sessions", "messages"}
+
+Records are written and read one at a time, so neither side ever holds more
+than one session. The reader decompresses at most `read_size` bytes per
+step and refuses records over MAX_RECORD_BYTES, so a small compressed body
+can't expand into a large buffer. Readers skip record types they don't know.
+
+CLI, run from the backend directory:
+    python session_transfer.py export --url http://old:5000 --token $ADMIN_TOKEN -o sessions.cgs
+    python session_transfer.py import --url http://new:5000 --token $ADMIN_TOKEN -i sessions.cgs
+    python session_transfer.py inspect -i sessions.cgs
+"""
+import argparse
+import json
+import struct
+import sys
+import zlib
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Add transfer format constants
+MAGIC = b"CGSX"
+VERSION = 1
+CODECS = {'none': 0, 'zlib': 1, 'zstd': 2}
+HEADER = struct.Struct('>4sBB')
+RECORD = struct.Struct('>cI')   # type, payload length
+MESSAGE_CHUNK = 1000            # messages per M record
+READ_SIZE = 64 * 1024
+MAX_RECORD_BYTES = 64 * 1024 * 1024
+SESSION_META = ('next_seq', 'turn', 'last_model', 'owner')
+
+
+def _dumps(value):
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def _loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def default_codec():
+    return 'zstd' if zstandard else 'zlib'
+
+
+class _Identity:
+    def compress(self, data):
+        return data
+
+    def flush(self):
+        return b""
+
+
+class _ZlibReader:
+    """Reads a zlib stream, returning at most `size` decompressed bytes per read."""
+
+    def __init__(self, stream, read_size):
+        self.stream = stream
+        self.read_size = read_size
+        self.decompressor = zlib.decompressobj()
+        self.pending = b""
+
+    def read(self, size):
+        while not self.decompressor.eof:
+            if not self.pending:
+                self.pending = self.stream.read(self.read_size)
+                if not self.pending:
+                    break
+            # Input that would produce more than `size` bytes stays in unconsumed_tail
+            data = self.decompressor.decompress(self.pending, size)
+            self.pending = self.decompressor.unconsumed_tail
+            if data:
+                return data
+        return b""
+
+
+def _compressor(codec):
+    if codec == 'zstd':
+        if not zstandard:
+            raise ValueError("zstd export needs the zstandard package")
+        return zstandard.ZstdCompressor(level=3).compressobj()
+    if codec == 'zlib':
+        return zlib.compressobj(6)
+    return _Identity()
+
+
+def _reader(codec, stream, read_size):
+    # A read() that never returns more than it's asked for, whatever the compression ratio
+    if codec == 'zstd':
+        if not zstandard:
+            raise ValueError("This export is zstd compressed, install zstandard to import it")
+        return zstandard.ZstdDecompressor().stream_reader(stream, read_size=read_size)
+    if codec == 'zlib':
+        return _ZlibReader(stream, read_size)
+    return stream
+
+
+def _record(kind, value):
+    payload = _dumps(value)
+    return RECORD.pack(kind, len(payload)) + payload
+
+
+def session_records(session_id, session, messages):
+    """Encoded records for one session with the given copy of its messages."""
+    meta = {key: session[key] for key in SESSION_META if session.get(key) is not None}
+    yield _record(b'S', {'id': session_id, 'meta': meta, 'count': len(messages)})
+    for start in range(0, len(messages), MESSAGE_CHUNK):
+        yield _record(b'M', messages[start:start + MESSAGE_CHUNK])
+
+
+def export_stream(sessions, codec=None):
+    """Yield the encoded export of (session_id, session) pairs chunk by chunk."""
+    codec = codec or default_codec()
+    compressor = _compressor(codec)
+    yield HEADER.pack(MAGIC, VERSION, CODECS[codec])
+    session_count = message_count = 0
+    for session_id, session in sessions:
+        # Copy the list, the session may get new turns while we stream it
+        messages = list(session.get('messages', []))
+        for record in session_records(session_id, session, messages):
+            chunk = compressor.compress(record)
+            if chunk:
+                yield chunk
+        session_count += 1
+        message_count += len(messages)
+    yield compressor.compress(_record(b'E', {'sessions': session_count, 'messages': message_count}))
+    yield compressor.flush()
+
+
+def read_sessions(stream, read_size=READ_SIZE, max_record_bytes=MAX_RECORD_BYTES):
+    """Yield (session_id, meta, messages) from an export, one session at a time.
+
+    `stream` is any object with read(), e.g. a file or a request body.
+    Raises ValueError for a foreign, newer or truncated export, or a record
+    over `max_record_bytes`.
+    """
+    header = stream.read(HEADER.size)
+    if len(header) < HEADER.size:
+        raise ValueError("Not a session export: too short")
+    magic, version, codec_id = HEADER.unpack(header)
+    if magic != MAGIC:
+        raise ValueError("Not a session export")
+    if version > VERSION:
+        raise ValueError(f"Session export version {version} is newer than this server supports ({VERSION})")
+    codecs = {value: name for name, value in CODECS.items()}
+    if codec_id not in codecs:
+        raise ValueError(f"Unknown session export codec {codec_id}")
+    reader = _reader(codecs[codec_id], stream, read_size)
+
+    buffer = bytearray()
+    current = None
+    seen = {'sessions': 0, 'messages': 0}
+    ended = False
+    while not ended:
+        # Bounded, the buffer holds at most one record plus one read
+        chunk = reader.read(read_size)
+        buffer += chunk
+        # Parse every whole record in the buffer
+        offset = 0
+        while len(buffer) - offset >= RECORD.size:
+            kind, length = RECORD.unpack_from(buffer, offset)
+            if length > max_record_bytes:
+                raise ValueError("Session export record is too large")
+            end = offset + RECORD.size + length
+            if end > len(buffer):
+                break
+            value = _loads(bytes(buffer[offset + RECORD.size:end]))
+            offset = end
+            if kind == b'S':
+                if current:
+                    yield _finish(current)
+                current = (value['id'], value.get('meta', {}), [], value.get('count'))
+                seen['sessions'] += 1
+            elif kind == b'M':
+                if current is None:
+                    raise ValueError("Session export has messages before a session")
+                current[2].extend(value)
+                seen['messages'] += len(value)
+            elif kind == b'E':
+                if value != seen:
+                    raise ValueError(f"Session export is inconsistent: expected {value}, read {seen}")
+                ended = True
+                break
+        del buffer[:offset]
+        if not chunk and not ended:
+            raise ValueError("Session export is truncated")
+    if current:
+        yield _finish(current)
+
+
+def _finish(current):
+    session_id, meta, messages, count = current
+    if count is not None and count != len(messages):
+        raise ValueError(f"Session {session_id} has {len(messages)} messages, expected {count}")
+    return session_id, meta, messages
+
+
+# CLI
+
+def _http(args):
+    import requests
+    return requests, {'X-Admin-Token': args.token}
+
+
+def export_command(args):
+    requests, headers = _http(args)
+    params = {'codec': args.codec} if args.codec else {}
+    if args.sessions:
+        params['sessions'] = args.sessions
+    with requests.get(f"{args.url}/admin/sessions/export", headers=headers, params=params,
+                      stream=True, timeout=(5, None)) as response:
+        response.raise_for_status()
+        with open(args.output, 'wb') as f:
+            for chunk in response.iter_content(READ_SIZE):
+                f.write(chunk)
+    return inspect_command(argparse.Namespace(input=args.output))
+
+
+def import_command(args):
+    requests, headers = _http(args)
+    headers['Content-Type'] = 'application/octet-stream'
+    with open(args.input, 'rb') as f:
+        # A file object is streamed, the export isn't loaded into memory
+        response = requests.post(f"{args.url}/admin/sessions/import", headers=headers, data=f,
+                                 params={'on_conflict': args.on_conflict}, timeout=(5, None))
+    print(response.text.strip())
+    return 0 if response.ok else 1
+
+
+def inspect_command(args):
+    sessions = messages = 0
+    with open(args.input, 'rb') as f:
+        for _, _, session_messages in read_sessions(f):
+            sessions += 1
+            messages += len(session_messages)
+    print(f"{args.input}: {sessions} sessions, {messages} messages")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+    for name in ('export', 'import'):
+        command = commands.add_parser(name)
+        command.add_argument('--url', default='http://127.0.0.1:5000')
+        command.add_argument('--token', required=True, help='the server\'s ADMIN_TOKEN')
+    commands.choices['export'].add_argument('-o', '--output', required=True)
+    commands.choices['export'].add_argument('--codec', choices=sorted(CODECS))
+    commands.choices['export'].add_argument('--sessions', help='comma separated session ids, default all')
+    commands.choices['import'].add_argument('-i', '--input', required=True)
+    commands.choices['import'].add_argument('--on-conflict', choices=('skip', 'replace'), default='skip')
+    commands.add_parser('inspect').add_argument('-i', '--input', required=True)
+    args = parser.parse_args(argv)
+    handler = {'export': export_command, 'import': import_command, 'inspect': inspect_command}[args.command]
+    return handler(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,132 @@
+import threading
+import pytest
+from flask import Flask
+from admission import TokenAdmissionController
+from chat import ChatService
+from fake_model import FakeModel
+from scheduler import RequestScheduler
+from errors import ServiceBusyError, handle_chat_error
+from ratelimit import MemoryBucketStorage
+from tokens import estimate_tokens
+
+class Usage:
+    def __init__(self, prompt_token_count):
+        self.prompt_token_count = prompt_token_count
+
+@pytest.fixture
+def controller():
+    return TokenAdmissionController(MemoryBucketStorage(), tokens_per_minute=100, max_wait=0.05)
+
+def test_estimate_tokens():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("abc") == 1
+    assert estimate_tokens("x" * 400) == 100
+
+def test_admit_within_budget(controller):
+    ticket = controller.admit("x" * 200)
+    assert ticket.estimate == 50
+    assert controller.metrics['admitted'] == 1
+    assert controller.metrics['estimated_tokens'] == 50
+
+def test_admit_sheds_when_budget_exhausted(controller):
+    controller.admit("x" * 360)
+    with pytest.raises(ServiceBusyError) as exc_info:
+        controller.admit("x" * 200)
+    assert exc_info.value.status_code == 429
+    assert exc_info.value.retry_after > 0
+    assert controller.metrics['queued'] == 1
+    assert controller.metrics['shed'] == 1
+
+def test_admit_queues_until_budget_refills():
+    controller = TokenAdmissionController(MemoryBucketStorage(), tokens_per_minute=6000, max_wait=1.0)
+    controller.admit("x" * 24000)
+    ticket = controller.admit("x" * 40)
+    assert ticket.waited > 0
+    assert controller.metrics['queued'] == 1
+    assert controller.metrics['shed'] == 0
+
+def test_admit_rejects_oversized_prompt(controller):
+    with pytest.raises(ServiceBusyError) as exc_info:
+        controller.admit("x" * 1000)
+    assert exc_info.value.status_code == 413
+
+def test_reconcile_charges_underestimate(controller):
+    ticket = controller.admit("x" * 40)
+    controller.reconcile(ticket, Usage(95))
+    assert controller.metrics['actual_tokens'] == 95
+    with pytest.raises(ServiceBusyError):
+        controller.admit("x" * 40)
+
+def test_reconcile_refunds_overestimate(controller):
+    ticket = controller.admit("x" * 360)
+    controller.reconcile(ticket, Usage(10))
+    assert controller.admit("x" * 200).estimate == 50
+
+def test_reconcile_without_usage_metadata(controller):
+    ticket = controller.admit("x" * 40)
+    controller.reconcile(ticket, None)
+    assert controller.metrics['actual_tokens'] == 0
+
+def test_busy_error_response():
+    app = Flask(__name__)
+    with app.app_context():
+        response = handle_chat_error(ServiceBusyError("Busy", retry_after=2.2))
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == "3"
+    assert response.json["retryAfter"] == 3
+
+def test_queue_limit_holds_under_concurrency():
+    controller = TokenAdmissionController(MemoryBucketStorage(), tokens_per_minute=6000, max_wait=2.0, max_queue=2)
+    controller.admit("x" * 24000)
+    start = threading.Barrier(20)
+    shed = []
+
+    def admit():
+        start.wait()
+        try:
+            controller.admit("x" * 80)
+        except ServiceBusyError:
+            shed.append(1)
+
+    threads = [threading.Thread(target=admit) for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    assert len(shed) == 18
+    assert controller.metrics['queued'] == 2
+    assert controller.waiting == 0
+
+class RecordingAdmission(TokenAdmissionController):
+    def __init__(self, scheduler, **kwargs):
+        super().__init__(MemoryBucketStorage(), **kwargs)
+        self.scheduler = scheduler
+        self.calls = []
+
+    def admit(self, prompt):
+        self.calls.append((prompt, self.scheduler.free))
+        return super().admit(prompt)
+
+def test_budget_is_reserved_before_the_upstream_slot():
+    scheduler = RequestScheduler(slots=1)
+    admission = RecordingAdmission(scheduler)
+    service = ChatService(FakeModel(latency=0, tokens_per_second=0), admission=admission, scheduler=scheduler)
+    for message in ("first question", "second question"):
+        data = service.parse_payload({"message": message, "sessionId": "s1"})
+        service.generate_response(service.get_or_create_session(data), data)
+
+    assert [free for _, free in admission.calls] == [1, 1]
+    # The second estimate covers the chat history sent along with the prompt
+    first_reply = service.chat_history["s1"]['messages'][1]['content']
+    assert first_reply in admission.calls[1][0]
+
+def test_budget_is_refunded_when_no_slot_comes():
+    scheduler = RequestScheduler(slots=1, max_wait=0.05)
+    admission = TokenAdmissionController(MemoryBucketStorage(), tokens_per_minute=100)
+    service = ChatService(FakeModel(latency=0, tokens_per_second=0), admission=admission, scheduler=scheduler)
+    scheduler.acquire()
+    with pytest.raises(ServiceBusyError):
+        with service.upstream_call({}, "x" * 360):
+            pass
+    scheduler.release()
+    assert admission.admit("x" * 360).estimate == 90
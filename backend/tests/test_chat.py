@@ -4,6 +4,11 @@ from flask import Flask, Request
 from chat import ChatService, SESSION_TIMEOUT
 from validation import validate_model_response
 from collections import Counter
+from contextlib import nullcontext
+from admission import TokenAdmissionController
+from errors import ServiceBusyError
+from ratelimit import MemoryBucketStorage
+from scheduler import RequestScheduler
 
 # Mock Gemini model for testing
 class MockGeminiModel:
@@ -329,6 +334,239 @@ def test_generate_response_no_history(chat_service):
     assert response.text == "Test response with proper punctuation."
     assert len(session['messages']) == 2
 
+def test_generate_response_with_admission():
+    """Test that admission control runs before the model is called"""
+    admission = TokenAdmissionController(MemoryBucketStorage(), tokens_per_minute=100, max_wait=0)
+    chat_service = ChatService(MockGeminiModel(), admission=admission)
+    data = {
+        "message": "x" * 300,
+        "username": "TestUser",
+        "timestamp": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        "session_id": "test_session"
+    }
+    session = chat_service.get_or_create_session(data)
+
+    with pytest.raises(ServiceBusyError):
+        chat_service.generate_response(session, data)
+    assert session['messages'] == []
+    assert admission.metrics['shed'] == 1
+
+def test_generate_response_uses_scheduler_classes():
+    """Test upstream calls go through the scheduler with the right priority"""
+    scheduler = RequestScheduler(slots=1)
+    chat_service = ChatService(MockGeminiModel(), scheduler=scheduler)
+    data = {
+        "message": "Hello",
+        "username": "TestUser",
+        "timestamp": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        "session_id": "test_session"
+    }
+    session = chat_service.get_or_create_session(data)
+    chat_service.generate_response(session, data)
+    chat_service.generate_response(session, dict(data, regenerate=True))
+    list(chat_service.generate_batch([{"message": "Hi"}]))
+
+    granted = {name: c['granted'] for name, c in scheduler.stats()['classes'].items()}
+    assert granted == {'interactive': 1, 'regenerate': 1, 'batch': 1}
+    assert scheduler.stats()['in_use'] == 0
+
+def test_generate_response_applies_generation_profile():
+    """Test the chosen profile's config reaches the model and can be overridden"""
+    class RecordingChatInstance(MockChatInstance):
+        def __init__(self):
+            self.configs = []
+
+        def send_message(self, text, stream=False, generation_config=None):
+            self.configs.append(generation_config)
+            return super().send_message(text, stream)
+
+    chat_service = ChatService(MockGeminiModel(), adaptive_profiles=True)
+    data = chat_service.parse_payload({"message": "what's 2+2", "sessionId": "test_session"})
+    session = chat_service.get_or_create_session(data)
+    session['chat_instance'] = instance = RecordingChatInstance()
+
+    chat_service.generate_response(session, data)
+    chat_service.generate_response(session, chat_service.parse_payload(
+        {"message": "what's 2+2", "sessionId": "test_session", "profile": "long_form"}
+    ))
+
+    assert [config["max_output_tokens"] for config in instance.configs] == [512, 4096]
+    assert data['profile'] == 'quick'
+    stats = chat_service.profile_stats.snapshot()
+    assert stats['quick']['requests'] == 1 and stats['long_form']['requests'] == 1
+
+    with pytest.raises(ValueError, match="Unknown profile"):
+        chat_service.parse_payload({"message": "Hi", "profile": "turbo"})
+
+def test_regenerate_replaces_last_turn(chat_service):
+    """Test regenerate swaps the last answer instead of appending a duplicate"""
+    data = {
+        "message": "Hello",
+        "username": "TestUser",
+        "timestamp": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        "session_id": "test_session"
+    }
+    session = chat_service.get_or_create_session(data)
+    session['messages'] = [
+        {"role": "user", "content": "Earlier"},
+        {"role": "assistant", "content": "Earlier answer"},
+        {"role": "user", "content": "Hello"},
+        {"role": "assistant", "content": "Old answer"}
+    ]
+
+    chat_service.generate_response(session, dict(data, regenerate=True))
+    assert [m["content"] for m in session['messages']] == [
+        "Earlier", "Earlier answer", "Hello", "Test response with proper punctuation."
+    ]
+
+    # Regenerating an older message is answered as a new turn
+    chat_service.generate_response(session, dict(data, message="Earlier", regenerate=True))
+    assert len(session['messages']) == 6
+
+def test_messages_since_returns_deltas(chat_service):
+    """Test sequence numbers let clients fetch only new or replaced messages"""
+    data = {
+        "message": "Hello",
+        "username": "TestUser",
+        "timestamp": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        "session_id": "test_session"
+    }
+    session = chat_service.get_or_create_session(data)
+    chat_service.generate_response(session, dict(data))
+    chat_service.generate_response(session, dict(data, message="Again"))
+    assert [m["seq"] for m in session['messages']] == [1, 2, 3, 4]
+    assert data.get('seq') is None
+
+    messages, last_seq, has_more = chat_service.get_messages_since("test_session", since=1, limit=2)
+    assert [m["seq"] for m in messages] == [2, 3]
+    assert last_seq == 4 and has_more
+
+    # A regenerated turn shows up as new seqs pointing at what they replace
+    chat_service.generate_response(session, dict(data, message="Again", regenerate=True))
+    messages, last_seq, has_more = chat_service.get_messages_since("test_session", since=4)
+    assert [(m["seq"], m.get("replaces")) for m in messages] == [(5, 3), (6, 4)]
+    assert last_seq == 6 and not has_more
+
+    assert chat_service.get_messages_since("missing") is None
+
+def test_messages_since_only_serves_the_owner(chat_service):
+    """Test a session created with a user id isn't readable by other users"""
+    data = chat_service.parse_payload({"message": "Hello"})
+    data['user_id'] = "alice"
+    assert len(data['session_id']) == 32
+    session = chat_service.get_or_create_session(data)
+    chat_service.generate_response(session, dict(data))
+
+    assert chat_service.get_messages_since(data['session_id'], user_id="alice")[1] == 2
+    assert chat_service.get_messages_since(data['session_id'], user_id="mallory") is None
+    assert chat_service.get_messages_since(data['session_id']) is None
+    assert chat_service.parse_payload({"message": "Hello"})['session_id'] != data['session_id']
+
+def test_restore_sessions_continues_sequence(chat_service):
+    """Test restored sessions keep numbering after the highest stored seq"""
+    chat_service.restore_sessions({
+        "old": [{"role": "user", "content": "Hi"}, {"role": "assistant", "content": "Hey"}],
+        "new": [{"role": "user", "content": "Hi", "seq": 7}, {"role": "assistant", "content": "Hey", "seq": 8}]
+    })
+    assert [m["seq"] for m in chat_service.chat_history["old"]["messages"]] == [1, 2]
+    assert chat_service.chat_history["new"]["next_seq"] == 9
+
+def test_regenerate_served_from_spare_candidates():
+    """Test spare candidates fetched in the background answer a regenerate"""
+    class Part:
+        def __init__(self, text):
+            self.text = text
+
+    class Candidate:
+        def __init__(self, text):
+            self.content = type("Content", (), {"parts": [Part(text)]})()
+
+    class SpareModel(MockGeminiModel):
+        def __init__(self):
+            self.configs = []
+
+        def generate_content(self, text, generation_config=None):
+            self.configs.append(generation_config)
+            response = MockResponse("unused")
+            response.candidates = [Candidate("Spare answer one."), Candidate("bad"), Candidate("Spare answer two.")]
+            return response
+
+    class CountingChat(MockChatInstance):
+        calls = 0
+
+        def send_message(self, text, stream=False):
+            CountingChat.calls += 1
+            return super().send_message(text, stream)
+
+    model = SpareModel()
+    model.start_chat = lambda history: CountingChat()
+    chat_service = ChatService(model, spare_candidates=3)
+    data = {
+        "message": "Hello",
+        "username": "TestUser",
+        "timestamp": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        "session_id": "test_session"
+    }
+    session = chat_service.get_or_create_session(data)
+    chat_service.generate_response(session, data)
+    chat_service.background.shutdown(wait=True)
+    chat_service.background = None
+    assert model.configs == [{"candidate_count": 3}]
+    assert session['spare_candidates']['texts'] == ["Spare answer one.", "Spare answer two."]
+
+    response = chat_service.generate_response(session, dict(data, regenerate=True))
+    assert response.text == "Spare answer one."
+    assert CountingChat.calls == 1
+    assert session['messages'][-1]["content"] == "Spare answer one."
+    assert len(session['messages']) == 2
+    assert chat_service.metrics['spare_hits'] == 1
+
+    # A new turn drops the spares of the previous one
+    chat_service.spare_candidates = 0
+    chat_service.generate_response(session, dict(data, message="Next"))
+    assert 'spare_candidates' not in session
+
+def test_spare_candidates_do_not_reach_the_turns_client():
+    """Test the background spare fetch runs without the request's event callback"""
+    chat_service = ChatService(MockGeminiModel(), spare_candidates=2)
+    slots = []
+    chat_service.upstream_slot = lambda data: slots.append(data) or nullcontext()
+    events = []
+    data = chat_service.parse_payload({"message": "Hello", "sessionId": "s"})
+    data['on_event'] = lambda event, fields: events.append(event)
+    chat_service.generate_response(chat_service.get_or_create_session(data), data)
+    chat_service.background.shutdown(wait=True)
+
+    spare_data = slots[-1]
+    assert spare_data['priority'] == 'batch'
+    assert 'on_event' not in spare_data and 'stream' not in spare_data
+    assert 'on_event' in data
+
+def test_generate_batch_keeps_session_order(chat_service):
+    """Test batch fan-out keeps turns of one session in order"""
+    items = [
+        {"message": "First", "sessionId": "a"},
+        {"message": "Other", "sessionId": "b"},
+        {"message": "Second", "sessionId": "a"},
+        {"message": "Third", "sessionId": "a"}
+    ]
+    results = list(chat_service.generate_batch(items, max_workers=2))
+
+    assert sorted(r["index"] for r in results) == [0, 1, 2, 3]
+    assert all(r["status"] == "success" for r in results)
+    user_turns = [m["content"] for m in chat_service.chat_history["a"]["messages"] if m["role"] == "user"]
+    assert user_turns == ["First", "Second", "Third"]
+    assert chat_service.metrics['batch_items'] == 4
+
+def test_generate_batch_reports_invalid_items(chat_service):
+    """Test invalid batch items fail on their own without stopping the batch"""
+    items = [{"message": "Hello"}, {"username": "NoMessage"}, "not-a-dict"]
+    results = sorted(chat_service.generate_batch(items), key=lambda r: r["index"])
+
+    assert [r["status"] for r in results] == ["success", "error", "error"]
+    assert results[0]["sessionId"].startswith("batch-")
+    assert "include a message" in results[1]["error"]
+
 def test_generate_response_invalid_session(chat_service):
     """Test response generation with invalid session"""
     data = {
@@ -0,0 +1,125 @@
+import json
+import threading
+import pytest
+from flask import Flask
+from werkzeug.serving import make_server
+from chat import ChatService
+from chat_socket import Outbox, init_chat_socket, CLOSE_SERVICE_RESTART
+from drain import DrainController
+from fake_model import FakeModel
+from scheduler import RequestScheduler
+
+def test_outbox_coalesces_unsent_chunks():
+    """Test chunks merge while waiting so a slow reader doesn't grow the queue"""
+    outbox = Outbox()
+    outbox.put({"type": "queued", "id": "a"})
+    for text in ("one ", "two ", "three"):
+        outbox.put({"type": "chunk", "id": "a", "text": text})
+    outbox.put({"type": "done", "id": "a"})
+    outbox.close()
+    events = list(iter(outbox.get, None))
+    assert [e["type"] for e in events] == ["queued", "chunk", "done"]
+    assert events[1]["text"] == "one two three"
+    assert outbox.coalesced == 2
+    assert outbox.put({"type": "chunk", "id": "b", "text": "late"}) is False
+
+def test_streamed_turn_emits_chunks():
+    """Test a streaming turn emits chunks that add up to the saved answer"""
+    service = ChatService(FakeModel(latency=0, tokens_per_second=0))
+    events = []
+    data = service.parse_payload({"message": "Write a python function to chunk a list", "sessionId": "s"})
+    data['stream'] = True
+    data['on_event'] = lambda event, fields: events.append((event, fields))
+    response = service.generate_response(service.get_or_create_session(data), data)
+    chunks = [fields['text'] for event, fields in events if event == 'chunk']
+    assert len(chunks) > 1
+    assert "".join(chunks) == response.text
+    assert service.chat_history["s"]['messages'][-1]['content'] == response.text
+
+def test_scheduler_reports_queued_requests():
+    """Test on_queued fires only for requests that have to wait"""
+    scheduler = RequestScheduler(slots=1, max_wait=1)
+    depths = []
+    scheduler.acquire('interactive', 'a', on_queued=depths.append)
+    assert depths == []
+    waiter = threading.Thread(target=scheduler.acquire, args=('interactive', 'b'), kwargs={'on_queued': depths.append})
+    waiter.start()
+    scheduler.release()
+    waiter.join(2)
+    assert depths == [1]
+
+class SocketServer:
+    """A chat app with the WebSocket route on a local port"""
+    def __init__(self, **kwargs):
+        pytest.importorskip("flask_sock")
+        self.app = Flask(__name__)
+        self.drain = DrainController(timeout=2)
+        self.service = ChatService(FakeModel(latency=0.05, tokens_per_second=2000))
+        self.socket = init_chat_socket(self.app, self.service, drain=self.drain, **kwargs)
+        self.server = make_server('127.0.0.1', 0, self.app, threaded=True)
+        self.url = f"ws://127.0.0.1:{self.server.server_port}/chat/ws"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def connect(self, session_id):
+        from simple_websocket import Client
+        ws = Client.connect(f"{self.url}?sessionId={session_id}")
+        assert json.loads(ws.receive(5))["type"] == "ready"
+        return ws
+
+    def stop(self):
+        self.server.shutdown()
+
+@pytest.fixture
+def socket_server():
+    server = SocketServer(max_pending=2)
+    yield server
+    server.stop()
+
+def receive_until_done(ws, count):
+    events = []
+    finished = 0
+    while finished < count:
+        event = json.loads(ws.receive(5))
+        events.append(event)
+        finished += event["type"] in ("done", "error")
+    return events
+
+def test_turns_over_one_connection(socket_server):
+    """Test several turns stream over one connection and run in order"""
+    ws = socket_server.connect("ws-session")
+    ws.send(json.dumps({"id": "t1", "message": "hi there"}))
+    ws.send(json.dumps({"id": "t2", "message": "and how are you"}))
+    events = receive_until_done(ws, 2)
+    ws.close()
+
+    assert {"type": "queued", "id": "t2", "reason": "turn", "position": 1} in events
+    done = [e for e in events if e["type"] == "done"]
+    assert [e["id"] for e in done] == ["t1", "t2"]
+    assert done[1]["seq"] == 4
+    text = "".join(e["text"] for e in events if e["type"] == "chunk" and e["id"] == "t1")
+    assert text == done[0]["response"]
+    assert len(socket_server.service.chat_history["ws-session"]['messages']) == 4
+    assert socket_server.socket.metrics['turns'] == 2
+
+def test_too_many_pending_turns_are_refused(socket_server):
+    """Test messages beyond the pending limit get an error instead of queuing"""
+    ws = socket_server.connect("busy-session")
+    for n in range(3):
+        ws.send(json.dumps({"id": f"t{n}", "message": "hi there"}))
+    events = receive_until_done(ws, 3)
+    ws.close()
+    errors = [e for e in events if e["type"] == "error"]
+    assert [e["id"] for e in errors] == ["t2"]
+    assert errors[0]["retryAfter"] == 1
+    assert socket_server.socket.metrics['rejected'] == 1
+
+def test_drain_closes_idle_connections(socket_server):
+    """Test a draining server refuses new turns and closes the connection for a reconnect"""
+    from simple_websocket import ConnectionClosed
+    ws = socket_server.connect("drain-session")
+    socket_server.drain.start()
+    with pytest.raises(ConnectionClosed) as exc_info:
+        while True:
+            ws.receive(5)
+    assert exc_info.value.reason == CLOSE_SERVICE_RESTART
+    assert socket_server.drain.drained.wait(5)
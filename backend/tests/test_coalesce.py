@@ -0,0 +1,118 @@
+import threading
+import time
+import pytest
+from chat import ChatService
+from coalesce import TurnCoalescer, merge_turns
+from fake_model import FakeModel
+
+def send_together(service, messages, gap=0.02, **extra):
+    """Send messages to one session from separate threads, a few ms apart"""
+    results = [None] * len(messages)
+
+    def send(index, message):
+        data = service.parse_payload(dict({"message": message, "sessionId": "s1"}, **extra))
+        session = service.get_or_create_session(data)
+        results[index] = service.respond(session, data)
+
+    threads = []
+    for index, message in enumerate(messages):
+        thread = threading.Thread(target=send, args=(index, message))
+        thread.start()
+        threads.append(thread)
+        time.sleep(gap)
+    for thread in threads:
+        thread.join(5)
+    return results
+
+def test_merge_turns_joins_messages():
+    """Test a burst becomes one message with the newest metadata"""
+    items = [
+        {"message": "hi", "timestamp": "t1", "profile": None},
+        {"message": "quick question", "timestamp": "t2", "profile": "code"},
+        {"message": "how do I sort a list?", "timestamp": "t3", "profile": None}
+    ]
+    merged = merge_turns(items)
+    assert merged["message"] == "hi\n\nquick question\n\nhow do I sort a list?"
+    assert merged["timestamp"] == "t3"
+    assert merged["profile"] == "code"
+    assert merged["coalesced"] == 3
+    assert merge_turns(items[:1]) is items[0]
+
+def test_rapid_messages_share_one_turn():
+    """Test messages inside the window get one model call and the same answer"""
+    model = FakeModel(latency=0, tokens_per_second=0)
+    service = ChatService(model)
+    results = send_together(service, ["hi", "one more thing", "what is a closure?"], coalesceMs=200)
+
+    assert model.calls == 1
+    texts = {response.text for response, _ in results}
+    assert len(texts) == 1
+    assert all(data["coalesced"] == 3 for _, data in results)
+    messages = service.chat_history["s1"]['messages']
+    assert [m['role'] for m in messages] == ["user", "assistant"]
+    assert messages[0]['content'] == "hi\n\none more thing\n\nwhat is a closure?"
+    assert service.coalescer.metrics == {'turns': 1, 'merged_turns': 1, 'merged_messages': 3}
+
+def test_window_sticks_to_the_session():
+    """Test a session keeps its window for later messages, others are unaffected"""
+    model = FakeModel(latency=0, tokens_per_second=0)
+    service = ChatService(model)
+    send_together(service, ["first"], coalesceMs=150)
+    assert service.chat_history["s1"]['coalesce_ms'] == 150
+    send_together(service, ["second", "third"])
+    assert model.calls == 2
+
+    other = ChatService(FakeModel(latency=0, tokens_per_second=0))
+    send_together(other, ["second", "third"])
+    assert other.model.calls == 2
+
+def test_turns_on_a_session_do_not_interleave():
+    """Test concurrent turns without a window run one at a time"""
+    model = FakeModel(latency=0.05, tokens_per_second=0)
+    service = ChatService(model)
+    active = []
+    overlap = []
+    reply = model.reply
+
+    def tracked_reply(prompt):
+        active.append(prompt)
+        overlap.append(len(active))
+        try:
+            return reply(prompt)
+        finally:
+            active.remove(prompt)
+
+    model.reply = tracked_reply
+    send_together(service, ["first", "second", "third"], gap=0)
+    assert model.calls == 3
+    assert max(overlap) == 1
+    roles = [m['role'] for m in service.chat_history["s1"]['messages']]
+    assert roles == ["user", "assistant"] * 3
+
+def test_errors_reach_every_request_in_the_burst():
+    """Test a failed merged turn fails all of its requests"""
+    coalescer = TurnCoalescer()
+    errors = []
+
+    def run(data):
+        raise ConnectionError("upstream down")
+
+    def submit(message):
+        try:
+            coalescer.submit("s1", {"message": message, "profile": None}, 0.1, run)
+        except ConnectionError as e:
+            errors.append(str(e))
+
+    threads = [threading.Thread(target=submit, args=(m,)) for m in ("a", "b")]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.02)
+    for thread in threads:
+        thread.join(5)
+    assert errors == ["upstream down", "upstream down"]
+
+def test_invalid_window_is_rejected():
+    """Test coalesceMs has to be a number"""
+    service = ChatService(FakeModel(latency=0, tokens_per_second=0))
+    with pytest.raises(ValueError):
+        service.parse_payload({"message": "hi", "coalesceMs": "soon"})
@@ -0,0 +1,135 @@
+import os
+import sys
+from collections import OrderedDict
+from chat import MAX_HISTORY_LENGTH, ChatService, chat_turn_text
+from compaction import HistoryCompactor, block_ref
+from fake_model import FakeModel
+from tokens import estimate_tokens
+from test_routing import FakeBackend
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+from bench_compaction import load_corpus, replay, replay_requests  # noqa: E402
+
+PYTHON_BLOCK = "```python\n" + "\n".join(f"def step_{i}(rows):\n    return rows" for i in range(6)) + "\n```"
+SQL_BLOCK = "```sql\n" + "\n".join(f"SELECT id FROM orders_{i};" for i in range(10)) + "\n```"
+TABLE = "\n".join(["| Name | Cost |", "|---|---|"] + [f"| plan {i} | {i} |" for i in range(8)])
+
+def conversation():
+    return [
+        {"role": "user", "content": "Show me the steps"},
+        {"role": "assistant", "content": f"## Steps\n{PYTHON_BLOCK}\nDone."},
+        {"role": "user", "content": "And the queries?"},
+        {"role": "assistant", "content": f"## Queries\n{SQL_BLOCK}\n\n{TABLE}"},
+        {"role": "user", "content": "Thanks"},
+        {"role": "assistant", "content": "You're welcome."}
+    ]
+
+def test_compact_replaces_long_blocks_with_stubs():
+    """Test long code blocks and tables become stubs and short ones stay"""
+    compactor = HistoryCompactor()
+    artifacts = OrderedDict()
+    short = "```bash\npip install flask\n```"
+    text = compactor.compact(f"{PYTHON_BLOCK}\n{short}\n\n{TABLE}", artifacts)
+
+    assert f"[elided code: python, 12 lines, ref {block_ref(PYTHON_BLOCK)}]" in text
+    assert "[elided table: 2 columns, 8 rows, ref" in text
+    assert short in text and "def step_0" not in text
+    assert artifacts[block_ref(PYTHON_BLOCK)]['content'] == PYTHON_BLOCK
+
+def test_render_keeps_blocks_out_until_referenced():
+    """Test old blocks are stubbed and only the referenced one comes back"""
+    compactor = HistoryCompactor()
+    session = {}
+    history = conversation()
+
+    text = compactor.render(history, "Explain recursion", session)
+    assert "def step_0" not in text and "orders_3" not in text
+    assert text.startswith("user: Show me the steps") and "assistant: You're welcome." in text
+
+    text = compactor.render(history, "Why does step_2 return rows unchanged?", session)
+    assert PYTHON_BLOCK in text and "orders_3" not in text
+
+    text = compactor.render(history, "Can that sql query use an index?", session)
+    assert SQL_BLOCK in text and "def step_0" not in text
+
+    text = compactor.render(history, "Sort the table above by cost", session)
+    assert TABLE in text and SQL_BLOCK not in text
+
+def test_recent_message_stays_verbatim():
+    """Test the newest message in the window is never compacted"""
+    compactor = HistoryCompactor()
+    history = conversation()[:4]
+    text = compactor.render(history, "Thanks", {})
+    assert SQL_BLOCK in text and "def step_0" not in text
+
+def test_reference_to_block_outside_window():
+    """Test a referenced block that left the history window is added back"""
+    compactor = HistoryCompactor()
+    session = {}
+    compactor.render(conversation()[:2], "ok", session)
+    text = compactor.render(conversation()[4:], "Rename step_3 please", session)
+    assert text.endswith("Referenced earlier content:\n" + PYTHON_BLOCK)
+    assert compactor.metrics['inflated'] == 1
+
+def test_chat_service_sends_compacted_history():
+    """Test the prompt sent to the model carries stubs instead of old code"""
+    backend = FakeBackend("An answer that passes validation.")
+    service = ChatService(backend, compact_history=True)
+    data = service.parse_payload({"message": "Next question", "sessionId": "s1"})
+    session = service.get_or_create_session(data)
+    session['messages'] = conversation()
+    service.generate_response(session, data)
+
+    context = session['chat_instance'].history[-2]
+    assert "[elided code: python, 12 lines" in context and "def step_0" not in context
+    assert service.compactor.metrics['elided'] == 3
+
+def test_chat_service_sends_compacted_chat_history():
+    """Test the SDK chat history resent with the turn is compacted, not the raw prompts"""
+    backend = FakeBackend("An answer that passes validation.")
+    service = ChatService(backend, compact_history=True)
+    data = service.parse_payload({"message": "Next question", "sessionId": "s1"})
+    session = service.get_or_create_session(data)
+    session['messages'] = conversation()
+    session['chat_instance'].history = ["an old full prompt"] * 6
+    service.generate_response(session, data)
+
+    sent = session['chat_instance'].history[:-2]
+    assert [turn['role'] for turn in sent] == ["user", "model"] * 3
+    assert all("def step_0" not in turn['parts'][0] and "orders_3" not in turn['parts'][0] for turn in sent)
+    assert sent[1]['parts'][0] == f"## Steps\n[elided code: python, 12 lines, ref {block_ref(PYTHON_BLOCK)}]\nDone."
+    assert sent[-1]['parts'][0] == "You're welcome."
+
+def test_chat_history_stays_bounded_without_compaction():
+    """Test the SDK chat is rebuilt once it outgrows the budget instead of growing every turn"""
+    for budget in (600, None):
+        service = ChatService(FakeModel(latency=0, tokens_per_second=0), history_token_budget=budget)
+        data = service.parse_payload({"message": "hello", "sessionId": "s1"})
+        session = service.get_or_create_session(data)
+        for n in range(40):
+            data = service.parse_payload({"message": f"question {n} " + "word " * 40, "sessionId": "s1"})
+            service.generate_response(session, data)
+            # Everything before the turn just sent is what went upstream with it
+            sent = session['chat_instance'].history[:-2]
+            assert len(sent) <= MAX_HISTORY_LENGTH
+            if budget:
+                assert sum(estimate_tokens(chat_turn_text(turn)) for turn in sent) <= budget
+        assert len(session['messages']) == 80
+
+def test_replay_corpus_saves_prompt_tokens():
+    """Test compaction cuts history tokens on the bundled replay corpus"""
+    compactor = HistoryCompactor()
+    plain = compacted = 0
+    for messages in load_corpus().values():
+        p, c, _ = replay(messages, compactor)
+        plain, compacted = plain + p, compacted + c
+    assert compacted < plain * 0.75
+    assert compactor.metrics['inflated'] > 0
+
+def test_replay_corpus_saves_request_tokens():
+    """Test compaction cuts the whole request, SDK chat history included"""
+    plain = compacted = 0
+    for messages in load_corpus().values():
+        p, c, _ = replay_requests(messages, HistoryCompactor())
+        plain, compacted = plain + p, compacted + c
+    assert compacted < plain * 0.5
@@ -0,0 +1,119 @@
+import gzip
+import zlib
+import pytest
+from flask import Flask, Response, jsonify, request, stream_with_context
+import compression
+from compression import init_compression, negotiate_encoding, decompress, StreamCompressor
+from errors import ServiceBusyError
+
+@pytest.fixture
+def client():
+    app = Flask(__name__)
+    app.config['TESTING'] = True
+    init_compression(app, min_size=100)
+
+    @app.route('/big')
+    def big():
+        return jsonify({"response": "x" * 2000})
+
+    @app.route('/small')
+    def small():
+        return jsonify({"response": "hi"})
+
+    @app.route('/stream')
+    def stream():
+        lines = (f'{{"index": {i}}}\n' for i in range(3))
+        return Response(stream_with_context(lines), mimetype='application/x-ndjson')
+
+    @app.route('/echo', methods=['POST'])
+    def echo():
+        return jsonify(request.get_json())
+
+    return app.test_client()
+
+def test_negotiate_encoding(monkeypatch):
+    monkeypatch.setattr(compression, 'brotli', None)
+    monkeypatch.setattr(compression, 'zstandard', None)
+    assert negotiate_encoding(None) is None
+    assert negotiate_encoding("gzip, deflate") == "gzip"
+    assert negotiate_encoding("br") is None
+    assert negotiate_encoding("gzip;q=0") is None
+    assert negotiate_encoding("*") == "gzip"
+
+def test_negotiate_prefers_quality_then_our_order():
+    if not (compression.brotli and compression.zstandard):
+        pytest.skip("brotli and zstandard not installed")
+    assert negotiate_encoding("gzip, br, zstd") == "zstd"
+    assert negotiate_encoding("gzip;q=1.0, br;q=0.5") == "gzip"
+    assert negotiate_encoding("br, gzip") == "br"
+
+def test_large_response_is_gzipped(client):
+    response = client.get('/big', headers={"Accept-Encoding": "gzip"})
+    assert response.headers['Content-Encoding'] == "gzip"
+    assert "Accept-Encoding" in response.headers['Vary']
+    assert b"x" * 2000 in gzip.decompress(response.data)
+
+def test_small_response_skips_compression(client):
+    response = client.get('/small', headers={"Accept-Encoding": "gzip"})
+    assert 'Content-Encoding' not in response.headers
+    assert response.json == {"response": "hi"}
+
+def test_no_accept_encoding_returns_identity(client):
+    response = client.get('/big')
+    assert 'Content-Encoding' not in response.headers
+    assert response.json["response"] == "x" * 2000
+
+def test_streamed_response_flushes_each_chunk(client):
+    response = client.get('/stream', headers={"Accept-Encoding": "gzip"}, buffered=False)
+    assert response.headers['Content-Encoding'] == "gzip"
+    chunks = list(response.response)
+    decoder = zlib.decompressobj(wbits=31)
+    # Every chunk decodes to a full line without waiting for the next one
+    assert decoder.decompress(chunks[0]) == b'{"index": 0}\n'
+    body = b"".join(decoder.decompress(c) for c in chunks[1:])
+    assert body == b'{"index": 1}\n{"index": 2}\n'
+
+@pytest.mark.parametrize("encoding", ["gzip", "br", "zstd"])
+def test_stream_compressor_round_trip(encoding):
+    if encoding == "br" and not compression.brotli:
+        pytest.skip("brotli not installed")
+    if encoding == "zstd" and not compression.zstandard:
+        pytest.skip("zstandard not installed")
+    data = b"".join(StreamCompressor(encoding).wrap([b"hello ", "world"]))
+    assert decompress(data, encoding) == b"hello world"
+
+def test_compressed_request_body(client):
+    body = gzip.compress(b'{"message": "Hello"}')
+    response = client.post('/echo', data=body, headers={
+        "Content-Type": "application/json",
+        "Content-Encoding": "gzip"
+    })
+    assert response.status_code == 200
+    assert response.json == {"message": "Hello"}
+
+def test_compressed_request_rejections(client):
+    bad = client.post('/echo', data=b"not gzip", headers={"Content-Encoding": "gzip"})
+    assert bad.status_code == 400
+    unknown = client.post('/echo', data=b"{}", headers={"Content-Encoding": "compress"})
+    assert unknown.status_code == 415
+
+def test_decompress_size_limit():
+    bomb = gzip.compress(b"0" * 5000)
+    with pytest.raises(ServiceBusyError) as exc_info:
+        decompress(bomb, "gzip", max_size=1000)
+    assert exc_info.value.status_code == 413
+
+def test_brotli_bodies_need_a_bounded_decoder(monkeypatch):
+    """Test br request bodies are refused when brotli can't cap the decoded size"""
+    if not compression.brotli:
+        pytest.skip("brotli not installed")
+    body = compression.brotli.compress(b'{"message": "Hello"}')
+    assert decompress(body, "br") == b'{"message": "Hello"}'
+    with pytest.raises(ServiceBusyError) as exc_info:
+        decompress(compression.brotli.compress(b"0" * 5000), "br", max_size=1000)
+    assert exc_info.value.status_code == 413
+
+    monkeypatch.setattr(compression, 'BROTLI_BOUNDED', False)
+    with pytest.raises(ServiceBusyError) as exc_info:
+        decompress(body, "br")
+    assert exc_info.value.status_code == 415
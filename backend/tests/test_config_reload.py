@@ -0,0 +1,192 @@
+import json
+import os
+import threading
+import time
+import pytest
+import config
+import validation
+from chat import ChatService
+from config import apply_settings, current_settings, load_settings, validate_settings
+from config_reload import ConfigReloader
+from test_chat import MockChatInstance, MockGeminiModel
+
+class TrackingModel(MockGeminiModel):
+    def __init__(self, name):
+        self.name = name
+        self.histories = []
+
+    def start_chat(self, history):
+        self.histories.append(history)
+        return super().start_chat(history)
+
+@pytest.fixture(autouse=True)
+def restore_settings():
+    saved = current_settings()
+    yield
+    apply_settings(saved)
+
+@pytest.fixture
+def files(tmp_path):
+    return str(tmp_path / '.env'), str(tmp_path / 'chatgenie.json')
+
+def write(path, text):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    # Make sure the watcher sees a new mtime even on coarse filesystems
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+def make_reloader(files, built):
+    env_file, config_file = files
+
+    def build_models(settings):
+        models = {"capable": TrackingModel(settings["capable_model"])}
+        built.append(settings)
+        return models
+
+    service = ChatService(TrackingModel("startup"))
+    return service, ConfigReloader(service, env_file=env_file, config_file=config_file, build_models=build_models)
+
+def test_load_settings_layers_env_and_json(files):
+    """Test .env and the JSON file both override the running settings"""
+    env_file, config_file = files
+    write(env_file, "MIN_RESPONSE_LENGTH=5\nMODEL_TEMPERATURE=0.2\nGEMINI_API_KEY=ignored\n")
+    write(config_file, json.dumps({"max_response_length": 9000, "generation_config": {"top_k": 10}}))
+
+    settings = load_settings(env_file, config_file)
+    assert settings["min_response_length"] == 5
+    assert settings["max_response_length"] == 9000
+    assert settings["generation_config"]["temperature"] == 0.2
+    assert settings["generation_config"]["top_k"] == 10
+    assert settings["generation_config"]["max_output_tokens"] == config.MODEL_CONFIG["generation_config"]["max_output_tokens"]
+
+def test_validate_settings_rejects_bad_values():
+    """Test every problem in a bad edit is reported"""
+    settings = current_settings()
+    settings["min_response_length"] = 9000
+    settings["generation_config"]["temperature"] = 5
+    settings["safety_settings"] = [{"category": "HARM_CATEGORY_HARASSMENT", "threshold": "SOMETIMES"}]
+    with pytest.raises(ValueError) as error:
+        validate_settings(settings)
+    assert "temperature" in str(error.value) and "safety" in str(error.value)
+
+    settings = current_settings()
+    settings["min_response_length"] = settings["max_response_length"]
+    with pytest.raises(ValueError, match="below max_response_length"):
+        validate_settings(settings)
+
+def test_threshold_change_applies_without_new_models(files):
+    """Test validation thresholds and limits swap in place"""
+    built = []
+    service, reloader = make_reloader(files, built)
+    write(files[0], "MAX_RESPONSE_LENGTH=100\nRATE_LIMIT_CHAT_CAPACITY=7\n")
+
+    assert reloader.check() == ["chat_capacity", "max_response_length"]
+    assert validation.MAX_RESPONSE_LENGTH == 100
+    assert config.RATE_LIMIT_CONFIG["chat_capacity"] == 7
+    assert built == [] and service.model_generation == 0
+    assert reloader.check() is None
+
+def test_model_change_swaps_models_and_keeps_sessions(files):
+    """Test a new model is built, swapped in and sessions rebuild their chats from history"""
+    built = []
+    service, reloader = make_reloader(files, built)
+    data = service.parse_payload({"message": "Hello", "sessionId": "s1"})
+    session = service.get_or_create_session(data)
+    service.generate_response(session, data)
+
+    write(files[1], json.dumps({"capable_model": "models/gemini-2.5-pro", "model_routing": False}))
+    assert "capable_model" in reloader.check()
+    assert service.model.name == "models/gemini-2.5-pro"
+    assert service.router is None and service.model_generation == 1
+
+    # The session keeps its messages and its new chat is seeded with them
+    session = service.get_or_create_session(data)
+    assert len(session['messages']) == 2
+    assert [turn["parts"][0] for turn in service.model.histories[-1]] == ["Hello", "Test response with proper punctuation."]
+    service.generate_response(session, data)
+    assert len(session['messages']) == 4
+
+def test_invalid_change_is_rejected_whole(files):
+    """Test a bad edit leaves everything as it was"""
+    built = []
+    service, reloader = make_reloader(files, built)
+    before = current_settings()
+    write(files[0], "MAX_RESPONSE_LENGTH=100\nMODEL_TEMPERATURE=hot\n")
+
+    assert reloader.check() is None
+    assert current_settings() == before
+    assert reloader.metrics['rejected'] == 1
+    assert "MODEL_TEMPERATURE" in reloader.metrics['last_error']
+    assert built == []
+
+def test_reloaded_temperature_reaches_profiled_requests(files):
+    """Test a new MODEL_TEMPERATURE is what gets sent when profiles pick the config"""
+    class RecordingChatInstance(MockChatInstance):
+        configs = []
+
+        def send_message(self, text, stream=False, generation_config=None):
+            self.configs.append(generation_config)
+            return super().send_message(text, stream)
+
+    class RecordingModel(MockGeminiModel):
+        def start_chat(self, history):
+            return RecordingChatInstance()
+
+    env_file, config_file = files
+    service = ChatService(RecordingModel(), adaptive_profiles=True,
+                          generation_config=config.MODEL_CONFIG["generation_config"])
+    reloader = ConfigReloader(service, env_file=env_file, config_file=config_file,
+                              build_models=lambda settings: {"capable": RecordingModel()})
+    data = service.parse_payload({"message": "Tell me a joke", "sessionId": "s1"})
+    service.generate_response(service.get_or_create_session(data), data)
+
+    write(env_file, "MODEL_TEMPERATURE=0.35\nMODEL_MAX_OUTPUT_TOKENS=1024\n")
+    assert reloader.check() == ["generation_config"]
+    service.generate_response(service.get_or_create_session(data), data)
+
+    first, second = RecordingChatInstance.configs
+    assert data['profile'] == 'chat'
+    assert (first["temperature"], first["max_output_tokens"]) == (0.7, 2048)
+    assert (second["temperature"], second["max_output_tokens"]) == (0.35, 512)
+
+def test_replaced_models_close_after_running_turns(files):
+    """Test the old models' channels are closed once turns started on them finish"""
+    release = threading.Event()
+
+    class ClosingModel(TrackingModel):
+        closed = False
+
+        def close(self):
+            self.closed = True
+
+    class SlowChat(MockChatInstance):
+        def send_message(self, text, stream=False):
+            release.wait(5)
+            return super().send_message(text, stream)
+
+    old = ClosingModel("startup")
+    service = ChatService(old)
+    reloader = ConfigReloader(service, env_file=files[0], config_file=files[1],
+                              build_models=lambda settings: {"capable": ClosingModel(settings["capable_model"])})
+    data = service.parse_payload({"message": "Hello", "sessionId": "s1"})
+    session = service.get_or_create_session(data)
+    session['chat_instance'] = SlowChat()
+    turn = threading.Thread(target=service.generate_response, args=(session, data))
+    turn.start()
+    while not service.turns_by_generation:
+        time.sleep(0.01)
+
+    write(files[1], json.dumps({"capable_model": "models/gemini-2.5-pro"}))
+    assert "capable_model" in reloader.check()
+    time.sleep(0.1)
+    assert not old.closed
+
+    release.set()
+    turn.join(5)
+    for _ in range(100):
+        if old.closed:
+            break
+        time.sleep(0.02)
+    assert old.closed and not service.model.closed
+    assert reloader.metrics['retired_models'] == 1
@@ -0,0 +1,97 @@
+import threading
+import time
+from flask import Flask, Response, jsonify
+from drain import DrainController, DRAINING_HEADER
+
+def make_app(drain, release):
+    """A tiny app whose /slow view blocks until `release` is set"""
+    app = Flask(__name__)
+
+    @app.route('/slow')
+    @drain.guard
+    def slow():
+        release.wait(5)
+        return jsonify({"status": "done"})
+
+    @app.route('/stream')
+    @drain.guard
+    def stream():
+        def chunks():
+            yield "one\n"
+            release.wait(5)
+            yield "two\n"
+        return Response(chunks(), mimetype='text/plain')
+
+    return app
+
+def test_guard_rejects_new_work_while_draining():
+    """Test guarded views answer 503 with the draining header once draining starts"""
+    drain = DrainController(timeout=1)
+    release = threading.Event()
+    release.set()
+    client = make_app(drain, release).test_client()
+    assert client.get('/slow').status_code == 200
+
+    drain.start()
+    response = client.get('/slow')
+    assert response.status_code == 503
+    assert response.headers[DRAINING_HEADER] == 'true'
+    assert "Retry-After" in response.headers
+    assert drain.metrics['rejected'] == 1
+    assert drain.drained.wait(2)
+
+def test_drain_waits_for_inflight_requests():
+    """Test hooks only run after requests already running have finished"""
+    drain = DrainController(timeout=5)
+    release = threading.Event()
+    client = make_app(drain, release).test_client()
+    order = []
+    drain.add_hook('flush', lambda: order.append('flush'))
+
+    results = []
+    worker = threading.Thread(target=lambda: results.append(client.get('/slow').status_code))
+    worker.start()
+    while drain.inflight == 0:
+        time.sleep(0.01)
+
+    drain.start()
+    time.sleep(0.1)
+    assert not drain.drained.is_set() and order == []
+    release.set()
+    worker.join(2)
+    assert drain.drained.wait(2)
+    assert results == [200]
+    assert order == ['flush']
+    assert drain.metrics['finished_while_draining'] == 1
+    assert drain.metrics['abandoned'] == 0
+
+def test_streamed_responses_count_until_closed():
+    """Test a streaming response stays in flight until its last chunk is read"""
+    drain = DrainController(timeout=5)
+    release = threading.Event()
+    client = make_app(drain, release).test_client()
+
+    response = client.get('/stream', buffered=False)
+    assert drain.inflight == 1
+    chunks = response.response
+    assert next(chunks) == b"one\n"
+    release.set()
+    assert b"".join(chunks) == b"two\n"
+    response.close()
+    assert drain.inflight == 0
+
+def test_deadline_abandons_stuck_requests():
+    """Test hooks still run when requests outlive the deadline"""
+    drain = DrainController(timeout=0.2)
+    hooks = []
+    drain.add_hook('broken', lambda: 1 / 0)
+    drain.add_hook('flush', lambda: hooks.append('flush'))
+    drain.begin()
+
+    drain.start()
+    assert drain.drained.wait(2)
+    # A failing hook doesn't stop the ones after it
+    assert hooks == ['flush']
+    assert drain.metrics['abandoned'] == 1
+    assert drain.metrics['drain_seconds'] >= 0.2
+    assert drain.start() is False
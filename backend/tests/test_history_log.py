@@ -0,0 +1,92 @@
+import os
+from datetime import datetime
+import pytest
+from chat import ChatService
+from history_log import ConversationLog
+from test_chat import MockGeminiModel
+
+def user(text):
+    return {"role": "user", "content": text}
+
+def assistant(text):
+    return {"role": "assistant", "content": text}
+
+@pytest.fixture
+def log(tmp_path):
+    log = ConversationLog(str(tmp_path), fsync_interval=0.01).start()
+    yield log
+    log.close()
+
+def test_append_and_recover(tmp_path, log):
+    log.append("a", [user("Hi"), assistant("Hello!")])
+    log.append("b", [user("Yo"), assistant("Hey!")])
+    log.append("a", [user("More"), assistant("Sure.")])
+    assert log.flush(timeout=2)
+    sessions = ConversationLog(str(tmp_path)).recover()
+    assert [m["content"] for m in sessions["a"]] == ["Hi", "Hello!", "More", "Sure."]
+    assert len(sessions["b"]) == 2
+    assert log.metrics['fsyncs'] >= 1
+
+def test_truncate_and_drop_are_replayed(tmp_path, log):
+    log.append("a", [user("Hi"), assistant("First")])
+    log.truncate("a", 2)
+    log.append("a", [user("Hi"), assistant("Second")])
+    log.append("b", [user("Bye"), assistant("Later")])
+    log.drop("b")
+    log.flush(timeout=2)
+    sessions = ConversationLog(str(tmp_path)).recover()
+    assert [m["content"] for m in sessions["a"]] == ["Hi", "Second"]
+    assert "b" not in sessions
+
+def test_torn_last_line_is_ignored(tmp_path, log):
+    log.append("a", [user("Hi"), assistant("Hello!")])
+    log.close()
+    segment = sorted(n for n in os.listdir(tmp_path) if n.startswith("segment-"))[-1]
+    with open(tmp_path / segment, "ab") as f:
+        f.write(b'{"s":"a","op":"add","m":[{"role"')
+    assert len(ConversationLog(str(tmp_path)).recover()["a"]) == 2
+
+def test_rotation_and_compaction(tmp_path):
+    log = ConversationLog(str(tmp_path), fsync_interval=0.01, segment_bytes=200, compact_after=2).start()
+    for i in range(20):
+        log.append(f"s{i % 3}", [user(f"Question {i}"), assistant(f"Answer {i}.")])
+        log.flush(timeout=2)
+    log.truncate("s0", 2)
+    log.close()
+    log.compact()
+
+    names = os.listdir(tmp_path)
+    assert len([n for n in names if n.startswith("snapshot-")]) == 1
+    assert len([n for n in names if n.startswith("segment-")]) <= 2
+    sessions = ConversationLog(str(tmp_path)).recover()
+    assert sum(len(m) for m in sessions.values()) == 38
+    assert sessions["s0"][-1]["content"] == "Answer 15."
+
+def test_restart_continues_after_snapshot(tmp_path):
+    log = ConversationLog(str(tmp_path), fsync_interval=0.01).start()
+    log.append("a", [user("Hi"), assistant("Hello!")])
+    log.close()
+    log.compact()
+    restarted = ConversationLog(str(tmp_path), fsync_interval=0.01).start()
+    restarted.append("a", [user("Again"), assistant("Welcome back.")])
+    restarted.close()
+    assert len(ConversationLog(str(tmp_path)).recover()["a"]) == 4
+
+def test_chat_service_logs_and_restores(tmp_path, log):
+    chat_service = ChatService(MockGeminiModel(), history_log=log)
+    data = {
+        "message": "Hello",
+        "username": "TestUser",
+        "timestamp": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        "session_id": "persisted"
+    }
+    session = chat_service.get_or_create_session(data)
+    chat_service.generate_response(session, data)
+    chat_service.generate_response(session, dict(data, regenerate=True))
+    log.flush(timeout=2)
+
+    restored = ChatService(MockGeminiModel())
+    assert restored.restore_sessions(ConversationLog(str(tmp_path)).recover()) == 1
+    assert restored.chat_history["persisted"]["messages"] == session["messages"]
+    session = restored.get_or_create_session(data)
+    assert session["chat_instance"] is not None
@@ -0,0 +1,132 @@
+import threading
+import time
+import pytest
+from flask import Flask, jsonify, request
+from idempotency import IdempotencyCache, REPLAYED_HEADER
+
+class CountingApp:
+    """A /chat stand-in that counts how often it really runs"""
+    def __init__(self, **kwargs):
+        self.cache = IdempotencyCache(**kwargs)
+        self.calls = 0
+        self.release = threading.Event()
+        self.release.set()
+        self.status = 200
+        self.body = {}
+        app = Flask(__name__)
+
+        @app.route('/chat', methods=['POST'])
+        @self.cache.idempotent
+        def chat():
+            self.calls += 1
+            self.release.wait(5)
+            return jsonify(dict({"response": f"answer {self.calls}", "echo": request.get_json()["message"]},
+                                **self.body)), self.status
+
+        self.client = app.test_client()
+
+    def post(self, message="hi", key="key-1", ip="127.0.0.1", session_id=None, **headers):
+        if key:
+            headers['Idempotency-Key'] = key
+        body = {"message": message, "sessionId": session_id} if session_id else {"message": message}
+        return self.client.post('/chat', json=body, headers=headers, environ_base={'REMOTE_ADDR': ip})
+
+@pytest.fixture
+def chat():
+    return CountingApp()
+
+def test_retry_is_answered_from_the_cache(chat):
+    """Test a retried request gets the first response without running again"""
+    first = chat.post()
+    retry = chat.post()
+    assert chat.calls == 1
+    assert retry.status_code == 200
+    assert retry.json == first.json
+    assert retry.headers[REPLAYED_HEADER] == 'true'
+    assert REPLAYED_HEADER not in first.headers
+    assert chat.cache.stats()['replayed'] == 1
+
+def test_requests_without_a_key_always_run(chat):
+    """Test the header is opt-in"""
+    chat.post(key=None)
+    chat.post(key=None)
+    assert chat.calls == 2
+
+def test_key_reused_for_another_body_is_rejected(chat):
+    """Test a key can't be replayed for a different request"""
+    chat.post("hi")
+    response = chat.post("something else")
+    assert response.status_code == 422
+    assert chat.calls == 1
+
+def test_keys_are_scoped_per_user(chat):
+    """Test two users picking the same key don't see each other's answers"""
+    chat.post(**{"X-User-Id": "alice"})
+    chat.post(**{"X-User-Id": "bob"})
+    assert chat.calls == 2
+
+def test_keys_are_scoped_per_address(chat):
+    """Test a client claiming another user's id can't replay that user's answer"""
+    chat.post(ip="10.0.0.1", **{"X-User-Id": "alice"})
+    stolen = chat.post(ip="10.0.0.2", **{"X-User-Id": "alice"})
+    assert chat.calls == 2
+    assert REPLAYED_HEADER not in stolen.headers
+    assert chat.post(ip="10.0.0.1", **{"X-User-Id": "alice"}).headers[REPLAYED_HEADER] == 'true'
+
+def test_anonymous_keys_are_scoped_per_session(chat):
+    """Test clients behind one address can't replay each other's answers by reusing a key"""
+    chat.post(session_id="a3f9c2")
+    other = chat.post(session_id="77b1e0")
+    assert chat.calls == 2
+    assert REPLAYED_HEADER not in other.headers
+    assert chat.post(session_id="a3f9c2").headers[REPLAYED_HEADER] == 'true'
+
+def test_concurrent_duplicate_waits_for_the_original(chat):
+    """Test a duplicate arriving mid-request waits and shares the answer"""
+    chat.release.clear()
+    responses = []
+    original = threading.Thread(target=lambda: responses.append(chat.post()))
+    original.start()
+    while chat.calls == 0:
+        time.sleep(0.01)
+    duplicate = threading.Thread(target=lambda: responses.append(chat.post()))
+    duplicate.start()
+    time.sleep(0.1)
+    chat.release.set()
+    original.join(5)
+    duplicate.join(5)
+    assert chat.calls == 1
+    assert [r.json for r in responses] == [responses[0].json] * 2
+    assert chat.cache.stats()['waited'] == 1
+
+def test_errors_are_not_cached(chat):
+    """Test a retry after a failed request runs again"""
+    chat.status = 500
+    assert chat.post().status_code == 500
+    chat.status = 200
+    assert chat.post().status_code == 200
+    assert chat.calls == 2
+
+def test_delayed_answers_are_not_cached(chat):
+    """Test a 200 that reports a queued or failed turn isn't replayed to retries"""
+    chat.body = {"status": "delayed", "message": "Request queued for processing"}
+    assert chat.post().status_code == 200
+    chat.body = {"status": "success"}
+    retry = chat.post()
+    assert chat.calls == 2
+    assert REPLAYED_HEADER not in retry.headers
+    assert chat.post().headers[REPLAYED_HEADER] == 'true'
+
+def test_entries_expire_and_stay_bounded():
+    """Test old keys are dropped by TTL and by the entry limit"""
+    chat = CountingApp(ttl=0.1, max_entries=2)
+    for key in ("a", "b", "c"):
+        chat.post(key=key)
+    assert chat.cache.stats()['entries'] == 2
+    assert chat.cache.stats()['evicted'] == 1
+    chat.post(key="a")
+    assert chat.calls == 4
+
+    time.sleep(0.15)
+    chat.post(key="c")
+    assert chat.calls == 5
@@ -0,0 +1,54 @@
+import json
+from collections import Counter
+from datetime import datetime
+import pytest
+from flask import Flask, jsonify, request
+import json_provider
+from json_provider import FastJSONProvider
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+    app.config['TESTING'] = True
+    app.json = FastJSONProvider(app)
+
+    @app.route('/echo', methods=['POST'])
+    def echo():
+        return jsonify(request.json)
+
+    return app
+
+def test_jsonify_matches_default_provider(app):
+    payload = {
+        "status": "success",
+        "response": "Ünïcode ✨ text",
+        "errors": Counter({"Timeout": 2}),
+        "when": datetime(2025, 3, 1, 12, 0, 0)
+    }
+    with app.app_context():
+        body = jsonify(payload).get_data()
+    assert json.loads(body) == {
+        "errors": {"Timeout": 2},
+        "response": "Ünïcode ✨ text",
+        "status": "success",
+        "when": "Sat, 01 Mar 2025 12:00:00 GMT"
+    }
+    # Keys stay sorted like Flask's default provider
+    assert body.index(b'"errors"') < body.index(b'"status"')
+
+def test_request_json_round_trip(app):
+    response = app.test_client().post('/echo', json={"message": "Hello", "sessionId": "a"})
+    assert response.json == {"message": "Hello", "sessionId": "a"}
+
+def test_invalid_json_is_a_bad_request(app):
+    response = app.test_client().post('/echo', data=b"{not json", content_type="application/json")
+    assert response.status_code == 400
+
+def test_falls_back_for_unsupported_values(app):
+    assert json.loads(app.json.dumps({"big": 2 ** 70})) == {"big": 2 ** 70}
+    assert app.json.dumps({"a": 1}, indent=4) == json.dumps({"a": 1}, indent=4)
+
+def test_works_without_orjson(app, monkeypatch):
+    monkeypatch.setattr(json_provider, 'orjson', None)
+    assert app.json.loads('{"a": [1, 2]}') == {"a": [1, 2]}
+    assert app.json.dumps_bytes({"b": 1, "a": 2}) == b'{"a":2,"b":1}'
@@ -0,0 +1,122 @@
+import os
+import sys
+import threading
+import pytest
+import requests
+from flask import Flask, jsonify, request
+from werkzeug.serving import make_server
+from chat import ChatService
+from fake_model import FakeModel
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+import loadtest  # noqa: E402
+
+class FakeServer:
+    """/chat backed by ChatService and the fake model on a local port"""
+    def __init__(self, error_rate=0.0):
+        self.service = ChatService(FakeModel(latency=0.01, tokens_per_second=0, error_rate=error_rate, seed=1))
+        app = Flask(__name__)
+
+        @app.route('/health')
+        def health():
+            return jsonify({"status": "healthy"})
+
+        @app.route('/chat', methods=['POST'])
+        def chat():
+            try:
+                data = self.service.validate_request(request)
+                session = self.service.get_or_create_session(data)
+                return self.service.format_chat_response(self.service.generate_response(session, data), data)
+            except Exception as e:
+                return jsonify({"error": str(e), "status": "error"}), 500
+
+        self.server = make_server('127.0.0.1', 0, app, threaded=True)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+@pytest.fixture
+def server():
+    server = FakeServer()
+    yield server
+    server.stop()
+
+def test_fake_model_answers_like_the_sdk():
+    """Test the fake model supports the chat calls ChatService makes"""
+    model = FakeModel(latency=0, tokens_per_second=0)
+    chat = model.start_chat(history=[])
+    response = chat.send_message("Question: write a python function to split a list", stream=False)
+    assert "```python" in response.text
+    assert response.usage_metadata.candidates_token_count > 0
+    chat.rewind()
+    assert chat.history == []
+    assert len(model.generate_content("hi", generation_config={"candidate_count": 2}).candidates) == 2
+
+def test_fake_model_errors_at_the_configured_rate():
+    """Test error_rate fails about that share of calls"""
+    model = FakeModel(latency=0, tokens_per_second=0, error_rate=0.5, seed=3)
+    failures = 0
+    for _ in range(200):
+        try:
+            model.reply("hello")
+        except ConnectionError:
+            failures += 1
+    assert 60 < failures < 140
+
+def test_percentile_nearest_rank():
+    values = list(range(1, 101))
+    assert loadtest.percentile(values, 50) == 50
+    assert loadtest.percentile(values, 99) == 99
+    assert loadtest.percentile([7], 95) == 7
+    assert loadtest.percentile([], 50) is None
+
+def test_check_slo_reports_violations():
+    """Test endpoint limits override the shared ones and every breach is listed"""
+    report = {"chat": {"p50_ms": 100, "p95_ms": 900, "p99_ms": 1500, "max_ms": 2000,
+                       "error_rate": 0.05, "throughput": 3.0}}
+    assert loadtest.check_slo(report, {"p95_ms": 1000, "max_error_rate": 0.1}) == []
+    violations = loadtest.check_slo(report, {"p95_ms": 1000, "chat": {"p95_ms": 500, "max_error_rate": 0.01}})
+    assert violations == ["chat: p95_ms 900 > 500", "chat: error_rate 0.05 > 0.01"]
+    with pytest.raises(ValueError, match="p90_ms"):
+        loadtest.check_slo(report, {"p90_ms": 1})
+
+def make_response(status_code, body):
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = body
+    return response
+
+def test_error_kind_classifies_answers():
+    """Test only a 200 with status success counts as a good answer"""
+    assert loadtest.error_kind(make_response(200, b'{"status": "success", "response": "hi"}')) is None
+    # A quota error is answered 200 "delayed", the turn never ran
+    assert loadtest.error_kind(make_response(200, b'{"status": "delayed"}')) == "status_delayed"
+    assert loadtest.error_kind(make_response(429, b'{"status": "error"}')) == "http_429"
+    assert loadtest.error_kind(make_response(200, b'<html>')) == "bad_json"
+
+def test_load_run_against_fake_model(server, tmp_path):
+    """Test a short run completes multi-turn conversations and meets a loose SLO"""
+    slo = tmp_path / "slo.json"
+    slo.write_text('{"p99_ms": 5000, "max_error_rate": 0.0}')
+    args = ["--url", server.url, "--users", "3", "--duration", "1", "--think-time", "0", "--slo", str(slo),
+            "--json", str(tmp_path / "report.json")]
+    assert loadtest.main(args) == 0
+
+    # Every user went past the first turn of their conversation
+    assert len(server.service.chat_history) >= 3
+    assert max(len(s['messages']) for s in server.service.chat_history.values()) >= 4
+    assert (tmp_path / "report.json").exists()
+
+def test_load_run_fails_slo_on_errors(tmp_path):
+    """Test the exit code is 1 when the error rate breaks the SLO"""
+    server = FakeServer(error_rate=0.5)
+    try:
+        slo = tmp_path / "slo.json"
+        slo.write_text('{"max_error_rate": 0.01}')
+        args = ["--url", server.url, "--users", "2", "--duration", "0.5", "--think-time", "0", "--slo", str(slo)]
+        assert loadtest.main(args) == 1
+    finally:
+        server.stop()
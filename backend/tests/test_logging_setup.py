@@ -0,0 +1,79 @@
+import json
+import logging
+import queue
+import pytest
+from flask import Flask, g
+from logging_setup import (
+    JSONFormatter, RequestContextFilter, SamplingFilter, NonBlockingQueueHandler, init_request_context
+)
+
+@pytest.fixture
+def captured():
+    log_queue = queue.Queue(2)
+    handler = NonBlockingQueueHandler(log_queue)
+    handler.addFilter(SamplingFilter(rate=0.0))
+    handler.addFilter(RequestContextFilter())
+    logger = logging.getLogger('test_logging_setup')
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    yield logger, handler, log_queue
+    logger.removeHandler(handler)
+
+def test_records_carry_request_context(captured):
+    """Test request and session IDs are attached before the record is queued"""
+    logger, _, log_queue = captured
+    app = Flask(__name__)
+    with app.test_request_context('/chat'):
+        g.request_id = 'req-1'
+        g.session_id = 'session-1'
+        logger.info("Chat turn", extra={'duration_ms': 12.5})
+
+    entry = json.loads(JSONFormatter().format(log_queue.get_nowait()))
+    assert entry['message'] == "Chat turn"
+    assert entry['request_id'] == 'req-1'
+    assert entry['session_id'] == 'session-1'
+    assert entry['duration_ms'] == 12.5
+
+def test_exceptions_are_formatted_before_queueing(captured):
+    """Test tracebacks survive the hand-off to the listener thread"""
+    logger, _, log_queue = captured
+    try:
+        raise RuntimeError("boom")
+    except RuntimeError as e:
+        logger.error("Unexpected error", exc_info=e)
+
+    record = log_queue.get_nowait()
+    assert record.exc_info is None
+    assert 'RuntimeError: boom' in json.loads(JSONFormatter().format(record))['exception']
+
+def test_sampling_drops_success_logs_only(captured):
+    """Test sampled records are dropped while warnings always get through"""
+    logger, _, log_queue = captured
+    logger.info("GET /health 200", extra={'sampled': True})
+    logger.warning("POST /chat 429", extra={'sampled': True})
+    assert log_queue.qsize() == 1
+    assert log_queue.get_nowait().levelname == 'WARNING'
+
+def test_full_queue_drops_instead_of_blocking(captured):
+    """Test logging never blocks the caller when the listener falls behind"""
+    logger, handler, log_queue = captured
+    for i in range(5):
+        logger.info(f"message {i}")
+    assert log_queue.qsize() == 2
+    assert handler.dropped == 3
+
+def test_request_ids_are_returned(captured):
+    """Test each response echoes the request ID it was logged under"""
+    app = Flask(__name__)
+    init_request_context(app)
+
+    @app.route('/ping')
+    def ping():
+        return {"requestId": g.request_id}
+
+    client = app.test_client()
+    response = client.get('/ping', headers={'X-Request-Id': 'abc'})
+    assert response.headers['X-Request-Id'] == 'abc'
+    assert response.json['requestId'] == 'abc'
+    assert len(client.get('/ping').headers['X-Request-Id']) == 32
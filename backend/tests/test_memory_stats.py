@@ -0,0 +1,74 @@
+import pytest
+from flask import Flask, jsonify
+from admin import admin_required
+from memory_stats import AllocationTracer, deep_sizeof, session_report, session_size
+from test_routing import FakeBackend
+
+def make_session(backend, turns):
+    chat = backend.start_chat()
+    messages = []
+    for i in range(turns):
+        chat.send_message(f"question {i} " * 20)
+        messages += [{"role": "user", "content": f"question {i} " * 20}, {"role": "assistant", "content": backend.reply}]
+    return {'messages': messages, 'chat_instance': chat, 'turn': turns}
+
+def test_deep_sizeof_counts_shared_objects_once():
+    """Test objects reachable twice are counted once and excluded ones not at all"""
+    text = "x" * 10000
+    assert deep_sizeof([text, text]) < deep_sizeof([text, "y" * 10000])
+    holder = {"big": text}
+    assert deep_sizeof(holder, exclude=[text]) < 1000 < deep_sizeof(holder)
+
+def test_session_size_splits_messages_and_chats():
+    """Test the breakdown charges the SDK chat's own history to chat_instance"""
+    backend = FakeBackend("An answer that passes validation. " * 50)
+    sizes = session_size(make_session(backend, 3), exclude=[backend])
+    assert sizes['messages'] > 3000 and sizes['chat_instance'] > 3000
+    assert sizes['bytes'] == sizes['messages'] + sizes['chat_instance'] + sizes['other']
+    # The model behind every chat isn't charged to any one session
+    backend.padding = "z" * 100000
+    assert session_size(make_session(backend, 3), exclude=[backend])['bytes'] < 100000
+
+def test_session_report_lists_largest_first():
+    """Test totals cover every session and top is sorted by size"""
+    backend = FakeBackend("An answer that passes validation.")
+    history = {f"s{turns}": make_session(backend, turns) for turns in (1, 5, 3)}
+    report = session_report(history, exclude=[backend], top=2)
+    assert report['count'] == 3
+    assert [s['sessionId'] for s in report['top']] == ["s5", "s3"]
+    assert report['top'][0]['message_count'] == 10
+    assert report['breakdown']['bytes'] == sum(session_size(s, [backend])['bytes'] for s in history.values())
+
+def test_allocation_tracer_on_demand():
+    """Test tracing only runs between start and stop and snapshots show growth"""
+    tracer = AllocationTracer()
+    assert not tracer.status()['tracing']
+    with pytest.raises(ValueError):
+        tracer.snapshot()
+    tracer.start()
+    try:
+        first = tracer.snapshot()
+        assert 'growth' not in first
+        kept = [bytearray(1024) for _ in range(200)]
+        second = tracer.snapshot(limit=5)
+        assert second['growth'] and second['growth'][0]['size_diff'] >= 200 * 1024
+        assert len(kept) == 200
+    finally:
+        assert not tracer.stop()['tracing']
+
+def test_admin_required_checks_token():
+    """Test admin routes are hidden without a token and need the right one"""
+    token = {"value": ""}
+    app = Flask(__name__)
+
+    @app.route('/admin/ping')
+    @admin_required(lambda: token["value"])
+    def ping():
+        return jsonify({"status": "ok"})
+
+    client = app.test_client()
+    assert client.get('/admin/ping').status_code == 404
+    token["value"] = "secret"
+    assert client.get('/admin/ping').status_code == 403
+    assert client.get('/admin/ping', headers={"X-Admin-Token": "wrong"}).status_code == 403
+    assert client.get('/admin/ping', headers={"X-Admin-Token": "secret"}).json == {"status": "ok"}
@@ -0,0 +1,52 @@
+import pytest
+from profiles import GENERATION_PROFILES, LatencyStats, classify_message, generation_config_for
+
+@pytest.mark.parametrize("message, profile", [
+    ("what's 2+2", 'quick'),
+    ("Who is the president of France?", 'quick'),
+    ("write me a service", 'code'),
+    ("def add(a, b):\n    return a + b", 'code'),
+    ("Why does my python script crash?", 'code'),
+    ("Write me an essay about the Roman empire", 'long_form'),
+    ("Explain how TCP congestion control works", 'long_form'),
+    ("word " * 300, 'long_form'),
+    ("Tell me a joke", 'chat'),
+    ("I had a long day at work and just want to talk for a bit about it", 'chat')
+])
+def test_classify_message(message, profile):
+    """Test the classifier picks the expected profile from cheap features"""
+    assert classify_message(message) == profile
+
+def test_profiles_set_budget_and_stops():
+    """Test every profile carries its own decode budget and stop sequences"""
+    for name in GENERATION_PROFILES:
+        config = generation_config_for(name)
+        assert config["max_output_tokens"] > 0
+        assert config["stop_sequences"]
+    assert generation_config_for('quick')["max_output_tokens"] < generation_config_for('code')["max_output_tokens"]
+
+    # Callers get a copy they can extend
+    generation_config_for('quick')["candidate_count"] = 3
+    assert "candidate_count" not in GENERATION_PROFILES['quick']
+
+def test_profile_stats_percentiles():
+    """Test latency is tracked per profile"""
+    stats = LatencyStats()
+    for ms in range(1, 101):
+        stats.record('quick', ms / 1000)
+    stats.record('code', 2.0)
+
+    snapshot = stats.snapshot()
+    assert snapshot['quick']['requests'] == 100
+    assert snapshot['quick']['latency_ms_p50'] == pytest.approx(51.0)
+    assert snapshot['quick']['latency_ms_p99'] == pytest.approx(99.0)
+    assert snapshot['code']['latency_ms_p95'] == 2000.0
+    assert snapshot['chat']['requests'] == 0
+
+def test_profiles_scale_with_the_running_config():
+    """Test a changed model temperature or token cap carries into every profile"""
+    assert generation_config_for('chat', {"temperature": 0.7, "max_output_tokens": 4096}) == generation_config_for('chat')
+    config = generation_config_for('code', {"temperature": 0.35, "max_output_tokens": 1024})
+    assert config["temperature"] == 0.1
+    assert config["max_output_tokens"] == 1024
+    assert generation_config_for('long_form', {"temperature": 2.0})["temperature"] == 2.0
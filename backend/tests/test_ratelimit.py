@@ -0,0 +1,171 @@
+import io
+import os
+import socket
+import threading
+import time
+import pytest
+from flask import Flask
+from ratelimit import (
+    BucketStorage, MemoryBucketStorage, SQLiteBucketStorage, RedisBucketStorage, RedisError,
+    TokenBucketLimiter, create_bucket_storage, encode_command, read_reply
+)
+
+# Fake Redis server answering the two commands the bucket storage sends
+class FakeRedisServer(threading.Thread):
+    def __init__(self, replies):
+        super().__init__(daemon=True)
+        self.replies = list(replies)
+        self.commands = []
+        self.server = socket.socket()
+        self.server.bind(('127.0.0.1', 0))
+        self.server.listen(1)
+        self.port = self.server.getsockname()[1]
+
+    def run(self):
+        conn, _ = self.server.accept()
+        reader = conn.makefile('rb')
+        while self.replies:
+            self.commands.append(read_reply(reader))
+            conn.sendall(self.replies.pop(0))
+        conn.close()
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+    app.config['TESTING'] = True
+    return app
+
+def test_memory_bucket_exhausts_and_refills():
+    storage = MemoryBucketStorage()
+    for _ in range(3):
+        assert storage.take("k", 3, 1000.0)[0] is True
+    allowed, tokens = storage.take("k", 3, 0.001)
+    assert allowed is False
+    assert tokens < 1
+
+def test_force_take_goes_into_debt():
+    storage = MemoryBucketStorage()
+    allowed, tokens = storage.take("k", 10, 0.001, cost=15, force=True)
+    assert allowed is True
+    assert tokens == pytest.approx(-5, abs=0.01)
+
+def test_sqlite_bucket_shared_between_instances(tmp_path):
+    path = str(tmp_path / "buckets.db")
+    first = SQLiteBucketStorage(path)
+    second = SQLiteBucketStorage(path)
+    assert first.take("k", 2, 0.001)[0] is True
+    assert second.take("k", 2, 0.001)[0] is True
+    # The second worker sees the tokens the first one spent
+    assert first.take("k", 2, 0.001)[0] is False
+
+def test_create_bucket_storage(tmp_path):
+    assert isinstance(create_bucket_storage("memory://"), MemoryBucketStorage)
+    storage = create_bucket_storage(f"sqlite:///{tmp_path / 'rl.db'}")
+    assert isinstance(storage, SQLiteBucketStorage)
+    redis = create_bucket_storage("redis://:secret@cache:6380/2")
+    assert redis.options == {"host": "cache", "port": 6380, "db": 2, "password": "secret"}
+    with pytest.raises(ValueError, match="Unsupported"):
+        create_bucket_storage("ftp://nope")
+
+def test_resp_encoding_and_parsing():
+    assert encode_command("GET", "key") == b"*2\r\n$3\r\nGET\r\n$3\r\nkey\r\n"
+    reader = io.BytesIO(b"*3\r\n:1\r\n$3\r\n4.5\r\n$-1\r\n")
+    assert read_reply(reader) == [1, b"4.5", None]
+    with pytest.raises(RedisError, match="NOSCRIPT"):
+        read_reply(io.BytesIO(b"-NOSCRIPT No matching script\r\n"))
+
+def test_redis_storage_falls_back_to_eval():
+    server = FakeRedisServer([
+        b"$3\r\nabc\r\n",
+        b"-NOSCRIPT No matching script\r\n",
+        b"*2\r\n:1\r\n$3\r\n4.5\r\n",
+    ])
+    server.start()
+    storage = RedisBucketStorage(port=server.port)
+    assert storage.take("k", 5, 1.0) == (True, 4.5)
+    server.join(timeout=2)
+    assert [c[0] for c in server.commands] == [b"SCRIPT", b"EVALSHA", b"EVAL"]
+    assert server.commands[2][3] == b"chatgenie:bucket:k"
+
+@pytest.mark.skipif(not os.getenv("REDIS_URL"), reason="REDIS_URL not set")
+def test_redis_storage_against_real_server():
+    storage = create_bucket_storage(os.environ["REDIS_URL"])
+    key = f"test-{os.getpid()}"
+    assert storage.take(key, 1, 0.001)[0] is True
+    assert storage.take(key, 1, 0.001)[0] is False
+
+def test_limit_decorator_returns_retry_after(app):
+    limiter = TokenBucketLimiter(MemoryBucketStorage())
+
+    @app.route('/chat', methods=['POST'])
+    @limiter.limit(capacity=2, period=60, scope="chat")
+    def chat():
+        return "ok"
+
+    client = app.test_client()
+    for _ in range(2):
+        assert client.post('/chat', json={"sessionId": "a"}).status_code == 200
+    limited = client.post('/chat', json={"sessionId": "a"})
+    assert limited.status_code == 429
+    assert int(limited.headers['Retry-After']) >= 1
+    assert limited.json["retryAfter"] == int(limited.headers['Retry-After'])
+    # Other sessions behind the same IP keep their own bucket
+    assert client.post('/chat', json={"sessionId": "b"}).status_code == 200
+    assert limiter.metrics['limited'] == 1
+
+def test_limit_key_prefers_user_header(app):
+    limiter = TokenBucketLimiter(MemoryBucketStorage())
+
+    @app.route('/chat', methods=['POST'])
+    @limiter.limit(capacity=1, period=60, scope="chat")
+    def chat():
+        return "ok"
+
+    client = app.test_client()
+    headers = {"X-User-Id": "u1"}
+    assert client.post('/chat', json={"sessionId": "a"}, headers=headers).status_code == 200
+    assert client.post('/chat', json={"sessionId": "b"}, headers=headers).status_code == 429
+    assert client.post('/chat', json={}).status_code == 200
+    assert client.post('/chat', json={}).status_code == 429
+
+def test_rotating_ids_still_hit_the_ip_bucket(app):
+    """Test a new user id per request doesn't get past the bucket shared by the IP"""
+    limiter = TokenBucketLimiter(MemoryBucketStorage(), ip_factor=3)
+
+    @app.route('/chat', methods=['POST'])
+    @limiter.limit(capacity=1, period=60, scope="chat")
+    def chat():
+        return "ok"
+
+    client = app.test_client()
+    statuses = [client.post('/chat', json={}, headers={"X-User-Id": f"u{n}"}).status_code for n in range(5)]
+    assert statuses == [200, 200, 200, 429, 429]
+    assert limiter.metrics['ip_limited'] == 2
+
+def test_ip_denial_refunds_the_client_bucket():
+    """Test a user behind a busy address keeps the token of a request that never ran"""
+    limiter = TokenBucketLimiter(MemoryBucketStorage(), ip_factor=2)
+    assert limiter.check_client("chat", "user:a", "10.0.0.1", 2, 60)[0]
+    assert limiter.check_client("chat", "user:b", "10.0.0.1", 2, 60)[0]
+    assert limiter.check_client("chat", "user:b", "10.0.0.1", 2, 60)[0]
+    assert limiter.check_client("chat", "user:c", "10.0.0.1", 2, 60)[0]
+    # The address is out, user a's own bucket isn't charged for the refusal
+    assert not limiter.check_client("chat", "user:a", "10.0.0.1", 2, 60)[0]
+    assert limiter.check_client("chat", "user:a", "10.0.0.2", 2, 60)[0]
+    assert limiter.check_client("chat", "user:a", "10.0.0.2", 2, 60)[0] is False
+    assert limiter.metrics['ip_limited'] == 1
+
+def test_bucket_storage_is_abstract():
+    """Test a storage has to implement take()"""
+    with pytest.raises(TypeError):
+        BucketStorage()
+
+def test_memory_buckets_are_pruned_once_refilled():
+    """Test buckets that have refilled are dropped instead of piling up"""
+    storage = MemoryBucketStorage()
+    for n in range(3):
+        storage.take(f"k{n}", capacity=2, refill_rate=1, cost=1)
+    storage.take("busy", capacity=100, refill_rate=1, cost=100)
+    with storage.lock:
+        storage.prune(time.time() + 1.5)
+    assert set(storage.buckets) == {"busy"}
@@ -0,0 +1,163 @@
+import gzip
+import json
+import threading
+import pytest
+from flask import Flask, Response, jsonify, request
+from werkzeug.serving import make_server
+from router import HashRing, SessionRouter
+
+class LocalBackend:
+    """A tiny chat backend on a local port that remembers which sessions it served"""
+    def __init__(self, name):
+        self.name = name
+        self.sessions = {}
+        self.draining = False
+        app = Flask(name)
+
+        @app.route('/health')
+        def health():
+            return jsonify({"status": "healthy"})
+
+        @app.route('/chat', methods=['POST'])
+        def chat():
+            if self.draining:
+                return jsonify({"error": "draining"}), 503, {"X-Draining": "true"}
+            if request.content_encoding == 'gzip':
+                session_id = json.loads(gzip.decompress(request.get_data()))['sessionId']
+            else:
+                session_id = request.get_json()['sessionId']
+            self.sessions[session_id] = self.sessions.get(session_id, 0) + 1
+            return jsonify({"node": self.name, "sessionId": session_id, "turn": self.sessions[session_id]})
+
+        @app.route('/chat/batch', methods=['POST'])
+        def batch():
+            items = request.get_json()['items']
+            lines = (json.dumps({"index": i, "sessionId": item["sessionId"], "node": self.name}) + "\n"
+                     for i, item in enumerate(items))
+            return Response(lines, mimetype='application/x-ndjson')
+
+        self.server = make_server('127.0.0.1', 0, app, threaded=True)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+@pytest.fixture
+def backends():
+    nodes = [LocalBackend(f"node{i}") for i in range(3)]
+    yield nodes
+    for node in nodes:
+        try:
+            node.stop()
+        except Exception:
+            pass
+
+def test_ring_spreads_keys_evenly():
+    """Test virtual nodes keep every node's share close to 1/N"""
+    ring = HashRing([f"node{i}" for i in range(4)])
+    counts = {}
+    for i in range(20000):
+        owner = ring.get(f"session-{i}")
+        counts[owner] = counts.get(owner, 0) + 1
+    assert min(counts.values()) > 20000 / 4 * 0.8
+
+def test_ring_moves_few_keys_on_membership_change():
+    """Test joins and leaves only reassign the keys of the node involved"""
+    ring = HashRing([f"node{i}" for i in range(4)])
+    keys = [f"session-{i}" for i in range(10000)]
+    before = {key: ring.get(key) for key in keys}
+
+    ring.add("node4")
+    after = {key: ring.get(key) for key in keys}
+    moved = [key for key in keys if before[key] != after[key]]
+    assert all(after[key] == "node4" for key in moved)
+    assert len(moved) < len(keys) * 0.3
+
+    ring.remove("node1")
+    final = {key: ring.get(key) for key in keys}
+    assert all(final[key] == after[key] for key in keys if after[key] != "node1")
+    assert ring.get("anything") != "node1"
+
+def test_router_keeps_sessions_on_one_backend(backends):
+    """Test every turn of a session reaches the same backend"""
+    router = SessionRouter([node.url for node in backends])
+    router.check_health()
+    client = router.create_app().test_client()
+
+    for session in ("alpha", "beta", "gamma", "delta"):
+        nodes = {client.post('/chat', json={"message": "hi", "sessionId": session}).json["node"] for _ in range(3)}
+        assert len(nodes) == 1
+
+    # Sessions without an ID are named by the router so later turns find them
+    first = client.post('/chat', json={"message": "hi"}).json
+    again = client.post('/chat', json={"message": "hi", "sessionId": first["sessionId"]}).json
+    assert again["node"] == first["node"] and again["turn"] == 2
+
+def test_compressed_bodies_route_by_query_string(backends):
+    """Test a gzip body with ?sessionId= reaches the session's backend"""
+    router = SessionRouter([node.url for node in backends])
+    router.check_health()
+    client = router.create_app().test_client()
+    owner = next(node for node in backends if node.url == router.ring.get("alpha"))
+
+    body = gzip.compress(json.dumps({"message": "hi", "sessionId": "alpha"}).encode())
+    for _ in range(3):
+        response = client.post('/chat?sessionId=alpha', data=body,
+                               headers={"Content-Type": "application/json", "Content-Encoding": "gzip"})
+        assert response.json["node"] == owner.name
+    assert router.status()[1]['requests'][owner.url] == 3
+
+def test_router_drops_unhealthy_backends(backends):
+    """Test a dead backend leaves the ring and its sessions fail over"""
+    router = SessionRouter([node.url for node in backends], fail_threshold=1)
+    router.check_health()
+    assert len(router.ring) == 3
+    client = router.create_app().test_client()
+
+    owner = next(node for node in backends if node.url == router.ring.get("alpha"))
+    owner.stop()
+    response = client.post('/chat', json={"message": "hi", "sessionId": "alpha"})
+    assert response.status_code == 200
+    assert response.json["node"] != owner.name
+    assert owner.url not in router.ring.nodes
+    assert router.metrics['failovers'] == 1
+
+    router.check_health()
+    assert len(router.ring) == 2
+
+def test_router_fails_over_from_draining_backend(backends):
+    """Test a backend that is shutting down hands its sessions to the next node"""
+    router = SessionRouter([node.url for node in backends])
+    router.check_health()
+    client = router.create_app().test_client()
+
+    owner = next(node for node in backends if node.url == router.ring.get("alpha"))
+    owner.draining = True
+    response = client.post('/chat', json={"message": "hi", "sessionId": "alpha"})
+    assert response.status_code == 200
+    assert response.json["node"] != owner.name
+    assert owner.url not in router.ring.nodes
+    assert router.metrics['failovers'] == 1
+
+def test_router_splits_batches_by_owner(backends):
+    """Test batch items go to their session's backend and keep their indexes"""
+    router = SessionRouter([node.url for node in backends])
+    router.check_health()
+    client = router.create_app().test_client()
+    items = [{"message": "hi", "sessionId": f"s{i}"} for i in range(12)]
+
+    results = [json.loads(line) for line in client.post('/chat/batch', json={"items": items}).data.splitlines()]
+    assert sorted(r["index"] for r in results) == list(range(12))
+    for result in results:
+        assert result["sessionId"] == f"s{result['index']}"
+        assert next(n.url for n in backends if n.name == result["node"]) == router.ring.get(result["sessionId"])
+
+def test_router_rejects_when_no_backend_is_up():
+    """Test requests are shed with 503 when the ring is empty"""
+    router = SessionRouter(["http://127.0.0.1:1"], health_timeout=0.2, fail_threshold=1)
+    router.check_health()
+    response = router.create_app().test_client().post('/chat', json={"message": "hi"})
+    assert response.status_code == 503
+    assert "Retry-After" in response.headers
@@ -0,0 +1,114 @@
+from chat import ChatService
+from routing import ModelRouter
+from fake_model import FakeModel
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+class FakeChat:
+    def __init__(self, backend):
+        self.backend = backend
+        self.history = []
+
+    def send_message(self, text, stream=False, **kwargs):
+        self.backend.calls += 1
+        self.history += [text, self.backend.reply]
+        return FakeResponse(self.backend.reply)
+
+    def rewind(self):
+        del self.history[-2:]
+
+class FakeBackend:
+    """Stands in for one Gemini model, always giving the same reply"""
+    def __init__(self, reply):
+        self.reply = reply
+        self.calls = 0
+
+    def start_chat(self, history=None):
+        return FakeChat(self)
+
+def make_service(fast_reply="Fast answer that passes validation."):
+    models = {
+        "fast": FakeBackend(fast_reply),
+        "capable": FakeBackend("Capable answer that passes validation.")
+    }
+    router = ModelRouter(models)
+    return ChatService(models["capable"], router=router), models, router
+
+def turn(service, message, **extra):
+    data = service.parse_payload(dict({"message": message, "sessionId": "s1"}, **extra))
+    session = service.get_or_create_session(data)
+    return service.generate_response(session, data).text, data, session
+
+def test_router_choices():
+    """Test simple turns go fast and complex ones or regenerates go capable"""
+    router = ModelRouter({"fast": FakeBackend("x"), "capable": FakeBackend("y")})
+    assert router.choose("what's 2+2")[0] == "fast"
+    assert router.choose("Tell me a joke")[0] == "fast"
+    assert router.choose("write me a service")[0] == "capable"
+    assert router.choose("Write an essay on rivers")[0] == "capable"
+    assert router.choose("what's 2+2", regenerate=True) == ("capable", "regenerate")
+    assert router.choose("Tell me a joke", profile="code")[0] == "capable"
+
+def test_single_model_router_never_escalates():
+    """Test a router with only the capable model sends everything there"""
+    router = ModelRouter({"capable": FakeBackend("y")})
+    assert router.choose("what's 2+2")[0] == "capable"
+    assert not router.can_escalate("capable")
+
+def test_service_routes_turns_to_models():
+    """Test each turn reaches the model the router picked"""
+    service, models, router = make_service()
+    text, data, session = turn(service, "what's 2+2")
+    assert text.startswith("Fast") and data['model'] == "fast"
+
+    text, data, session = turn(service, "write me a service")
+    assert text.startswith("Capable") and data['model'] == "capable"
+    assert session['last_model'] == "capable"
+    assert models["fast"].calls == 1 and models["capable"].calls == 1
+
+    stats = router.stats()
+    assert stats['routed'] == {"fast": 1, "capable": 1}
+    assert stats['latency']['fast']['requests'] == 1
+    assert stats['escalation_rate'] == 0.0
+
+def test_failed_validation_escalates():
+    """Test a fast answer that fails validation is retried on the capable model"""
+    service, models, router = make_service(fast_reply="no")
+    text, data, session = turn(service, "what's 2+2")
+
+    assert text.startswith("Capable") and data['model'] == "capable"
+    assert models["fast"].calls == 1 and models["capable"].calls == 1
+    # The rejected answer is dropped from the fast model's own history
+    assert session['model_chats']['fast'].history == []
+    stats = router.stats()
+    assert stats['escalations'] == {"Response too short": 1}
+    assert stats['escalation_rate'] == 1.0
+
+def test_regenerate_rewinds_the_model_that_answered():
+    """Test regenerate drops the old turn from the chat that produced it"""
+    service, models, router = make_service()
+    text, data, session = turn(service, "what's 2+2")
+    turn(service, "what's 2+2", regenerate=True)
+
+    assert session['model_chats']['fast'].history == []
+    assert len(session['chat_instance'].history) == 2
+    assert [m["content"] for m in session['messages']][-1].startswith("Capable")
+
+def test_alternating_models_see_every_turn():
+    """Test a model picks up the turns the other model answered since it last ran"""
+    models = {"fast": FakeModel(latency=0, tokens_per_second=0), "capable": FakeModel(latency=0, tokens_per_second=0)}
+    service = ChatService(models["capable"], router=ModelRouter(models))
+    questions = ["what's 2+2", "write me a service", "Tell me a joke", "write me a parser", "thanks"]
+    answered = []
+    for n, question in enumerate(questions):
+        text, data, session = turn(service, question)
+        answered.append(data['model'])
+        chat = session['chat_instance'] if data['model'] == "capable" else session['model_chats']['fast']
+        # Earlier turns reach the model as stored messages or inside an earlier prompt
+        sent = "\n".join(entry['parts'][0] for entry in chat.history[:-2])
+        earlier = session['messages'][:-2]
+        assert len(earlier) == 2 * n
+        assert all(message['content'] in sent for message in earlier)
+    assert answered == ["fast", "capable", "fast", "capable", "fast"]
@@ -0,0 +1,86 @@
+import threading
+import time
+import pytest
+from errors import ServiceBusyError
+from scheduler import RequestScheduler
+
+def queue_waiters(scheduler, requests, order):
+    """Start one thread per (priority, flow), each queued before the next starts."""
+    threads = []
+    for priority, flow in requests:
+        def run(priority=priority, flow=flow):
+            with scheduler.slot(priority, flow):
+                order.append((priority, flow))
+        thread = threading.Thread(target=run)
+        queued = scheduler.metrics['queued'][priority]
+        thread.start()
+        while scheduler.metrics['queued'][priority] == queued:
+            time.sleep(0.001)
+        threads.append(thread)
+    return threads
+
+def test_fast_path_when_slots_free():
+    scheduler = RequestScheduler(slots=2)
+    assert scheduler.acquire('interactive', 'a') == 0.0
+    assert scheduler.stats()['in_use'] == 1
+    scheduler.release()
+    assert scheduler.stats()['in_use'] == 0
+
+def test_priority_classes_served_in_order():
+    scheduler = RequestScheduler(slots=1)
+    order = []
+    scheduler.acquire('interactive', 'holder')
+    threads = queue_waiters(scheduler, [('batch', 'a'), ('regenerate', 'b'), ('interactive', 'c')], order)
+    assert scheduler.stats()['classes']['batch']['queue_depth'] == 1
+    scheduler.release()
+    for thread in threads:
+        thread.join(timeout=2)
+    assert [priority for priority, _ in order] == ['interactive', 'regenerate', 'batch']
+
+def test_fair_queuing_between_flows():
+    scheduler = RequestScheduler(slots=1)
+    order = []
+    scheduler.acquire('batch', 'holder')
+    # A heavy flow queues three requests before a light flow queues one
+    requests = [('batch', 'heavy')] * 3 + [('batch', 'light')]
+    threads = queue_waiters(scheduler, requests, order)
+    scheduler.release()
+    for thread in threads:
+        thread.join(timeout=2)
+    assert [flow for _, flow in order].index('light') <= 1
+
+def test_flow_weights():
+    scheduler = RequestScheduler(slots=1, weights={'vip': 3.0})
+    order = []
+    scheduler.acquire('batch', 'holder')
+    requests = [('batch', 'normal')] * 2 + [('batch', 'vip')] * 3
+    threads = queue_waiters(scheduler, requests, order)
+    scheduler.release()
+    for thread in threads:
+        thread.join(timeout=2)
+    assert [flow for _, flow in order][:3].count('vip') >= 2
+
+def test_queued_request_is_shed_after_max_wait():
+    scheduler = RequestScheduler(slots=1, max_wait=0.05)
+    scheduler.acquire('interactive', 'holder')
+    with pytest.raises(ServiceBusyError) as exc_info:
+        scheduler.acquire('batch', 'late')
+    assert exc_info.value.status_code == 503
+    stats = scheduler.stats()['classes']['batch']
+    assert stats['shed'] == 1
+    assert stats['queue_depth'] == 0
+    # The cancelled ticket doesn't hold on to the slot
+    scheduler.release()
+    assert scheduler.acquire('batch', 'next') == 0.0
+
+def test_wait_time_metrics():
+    scheduler = RequestScheduler(slots=1)
+    order = []
+    scheduler.acquire('interactive', 'holder')
+    threads = queue_waiters(scheduler, [('interactive', 'a')], order)
+    time.sleep(0.02)
+    scheduler.release()
+    threads[0].join(timeout=2)
+    stats = scheduler.stats()['classes']['interactive']
+    assert stats['granted'] == 2
+    assert stats['wait_max'] >= 0.02
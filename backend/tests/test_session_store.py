@@ -0,0 +1,146 @@
+import io
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from datetime import datetime
+import pytest
+from chat import ChatService
+from fake_model import FakeModel
+from session_transfer import export_stream, read_sessions
+from session_store import TieredSessionStore, decode_session, encode_session
+
+@pytest.fixture
+def store(tmp_path):
+    store = TieredSessionStore(str(tmp_path / "sessions.db"), idle_seconds=60)
+    yield store
+    store.close()
+
+def spill_all(store):
+    return store.spill_idle(now=time.monotonic() + store.idle_seconds)
+
+def test_encoding_drops_live_objects():
+    """Test SDK chats and locks stay behind while the rest round-trips"""
+    session = {
+        'messages': [{'role': 'user', 'content': 'hi', 'seq': 1}],
+        'chat_instance': object(),
+        'model_chats': {'fast': object()},
+        'turn_lock': threading.Lock(),
+        'model_generation': 3,
+        'artifacts': OrderedDict([('a1', {'content': 'x'}), ('a2', {'content': 'y'})]),
+        'last_access': datetime(2024, 5, 1, 12, 30),
+        'next_seq': 2
+    }
+    restored = decode_session(encode_session(session))
+    assert restored['messages'] == session['messages']
+    assert restored['chat_instance'] is None
+    assert 'model_chats' not in restored and 'turn_lock' not in restored and 'model_generation' not in restored
+    assert isinstance(restored['artifacts'], OrderedDict)
+    assert list(restored['artifacts']) == ['a1', 'a2']
+    assert restored['last_access'] == session['last_access']
+    assert restored['next_seq'] == 2
+
+def test_idle_sessions_move_to_disk_and_back(store):
+    """Test idle sessions leave memory and come back on access"""
+    store['idle'] = {'messages': [{'role': 'user', 'content': 'hello'}]}
+    assert spill_all(store) == 1
+    assert 'idle' not in store.hot
+    assert 'idle' in store and len(store) == 1
+    # A membership check alone doesn't load it
+    assert store.stats()['cold'] == 1
+
+    session = store['idle']
+    assert session['messages'][0]['content'] == 'hello'
+    stats = store.stats()
+    assert (stats['hot'], stats['cold'], stats['rehydrated'], stats['cold_bytes']) == (1, 0, 1, 0)
+
+def test_recent_and_busy_sessions_stay_in_memory(store):
+    """Test a sweep only moves sessions that are idle and not mid-turn"""
+    store['recent'] = {'messages': []}
+    assert store.spill_idle() == 0
+    store['busy'] = {'messages': [], 'turn_lock': threading.Lock()}
+    store['busy']['turn_lock'].acquire()
+    assert spill_all(store) == 1
+    assert set(store.hot) == {'busy'}
+
+def test_sessions_with_a_spare_fetch_running_stay_in_memory(store):
+    """Test a session a background fetch still writes to isn't dropped from memory"""
+    fetch = Future()
+    store['sparing'] = {'messages': [], 'spare_fetch': fetch}
+    assert spill_all(store) == 0
+    fetch.set_result(None)
+    assert spill_all(store) == 1
+    assert 'spare_fetch' not in store['sparing']
+
+def test_named_file_is_per_process(tmp_path):
+    """Test workers given the same path each get their own file"""
+    store = TieredSessionStore(str(tmp_path / "sessions.db"))
+    assert store.path == str(tmp_path / f"sessions-{os.getpid()}.db")
+    store['a'] = {'messages': []}
+    spill_all(store)
+    store.close()
+    assert not os.path.exists(store.path)
+
+def test_unserializable_session_stays_in_memory(store):
+    """Test a session with a value that can't be written is kept rather than lost"""
+    store['odd'] = {'messages': [], 'extra': object()}
+    assert spill_all(store) == 0
+    assert 'odd' in store.hot
+    assert store.stats()['unspillable'] == 1
+
+def test_delete_and_walk_cover_both_tiers(store):
+    """Test iteration, items and deletes see cold sessions without loading them"""
+    store['a'] = {'messages': []}
+    store['b'] = {'messages': [{'role': 'user', 'content': 'b'}]}
+    spill_all(store)
+    store['c'] = {'messages': []}
+    assert sorted(store) == ['a', 'b', 'c']
+    assert dict(store.items())['b']['messages'][0]['content'] == 'b'
+    assert set(store.hot) == {'c'}
+    del store['a']
+    assert 'a' not in store
+    with pytest.raises(KeyError):
+        store['a']
+
+def test_chat_service_rebuilds_the_chat_after_rehydrating(tmp_path):
+    """Test a spilled session continues the conversation with its history"""
+    store = TieredSessionStore(str(tmp_path / "sessions.db"), idle_seconds=60)
+    service = ChatService(FakeModel(latency=0, tokens_per_second=0), session_store=store)
+    data = service.parse_payload({"message": "hi there", "sessionId": "s1"})
+    service.generate_response(service.get_or_create_session(data), data)
+    spill_all(store)
+    assert store.hot == {}
+
+    data = service.parse_payload({"message": "and again", "sessionId": "s1"})
+    session = service.get_or_create_session(data)
+    assert session['chat_instance'] is not None
+    assert len(session['chat_instance'].history) == 2
+    service.generate_response(session, data)
+    assert [m['seq'] for m in service.chat_history['s1']['messages']] == [1, 2, 3, 4]
+    store.close()
+
+def test_temporary_file_is_removed_on_close():
+    """Test the default spill file doesn't outlive the process"""
+    store = TieredSessionStore().start()
+    path = store.path
+    assert os.path.exists(path)
+    store.close()
+    assert not os.path.exists(path)
+
+def test_export_reads_cold_sessions_in_place(store):
+    """Test exporting streams spilled sessions without loading them back into memory"""
+    for n in range(3):
+        store[f"s{n}"] = {'messages': [{'role': 'user', 'content': f"message {n}", 'seq': 1}], 'next_seq': 2}
+    spill_all(store)
+    store['hot'] = {'messages': [], 'next_seq': 1}
+
+    exported = b"".join(export_stream(store.iter_items()))
+    assert store.stats()['cold'] == 3
+    assert store.stats()['rehydrated'] == 0
+    assert {session_id: len(messages) for session_id, _, messages in read_sessions(io.BytesIO(exported))} == \
+        {'s0': 1, 's1': 1, 's2': 1, 'hot': 0}
+
+    picked = b"".join(export_stream(store.iter_items(['s1', 'missing'])))
+    assert [session_id for session_id, _, _ in read_sessions(io.BytesIO(picked))] == ['s1']
+    assert store.stats()['cold'] == 3
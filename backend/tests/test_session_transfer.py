@@ -0,0 +1,103 @@
+import io
+import tracemalloc
+import zlib
+import pytest
+import session_transfer
+from chat import ChatService
+from session_transfer import export_stream, read_sessions
+from test_routing import FakeBackend
+
+def make_sessions(count, messages_each):
+    return {
+        f"s{i}": {
+            'messages': [{"role": "user" if n % 2 == 0 else "assistant", "content": f"message {n} of s{i}", "seq": n + 1}
+                         for n in range(messages_each)],
+            'next_seq': messages_each + 1,
+            'turn': messages_each // 2,
+            'chat_instance': object()
+        }
+        for i in range(count)
+    }
+
+def export_bytes(sessions, codec=None):
+    return b"".join(export_stream(sessions.items(), codec))
+
+@pytest.mark.parametrize("codec", ["none", "zlib"])
+def test_round_trip(codec):
+    """Test sessions come back with their messages and counters"""
+    sessions = make_sessions(3, 5)
+    restored = list(read_sessions(io.BytesIO(export_bytes(sessions, codec))))
+    assert [session_id for session_id, _, _ in restored] == ["s0", "s1", "s2"]
+    session_id, meta, messages = restored[1]
+    assert messages == sessions["s1"]['messages']
+    assert meta == {"next_seq": 6, "turn": 2}
+
+def test_large_session_is_chunked_and_streamed(monkeypatch):
+    """Test big sessions span several records and small reads still parse"""
+    monkeypatch.setattr(session_transfer, 'MESSAGE_CHUNK', 7)
+    sessions = make_sessions(2, 50)
+    data = export_bytes(sessions, "zlib")
+    restored = list(read_sessions(io.BytesIO(data), read_size=13))
+    assert [len(messages) for _, _, messages in restored] == [50, 50]
+
+def test_export_is_incremental():
+    """Test the export yields per session rather than building one blob"""
+    chunks = list(export_stream(make_sessions(20, 4).items(), "none"))
+    assert len(chunks) > 20
+
+def test_rejects_bad_input():
+    """Test foreign, newer and truncated exports raise ValueError"""
+    data = export_bytes(make_sessions(2, 3), "zlib")
+    with pytest.raises(ValueError, match="Not a session export"):
+        list(read_sessions(io.BytesIO(b"PK\x03\x04 nope")))
+    newer = data[:4] + bytes([session_transfer.VERSION + 1]) + data[5:]
+    with pytest.raises(ValueError, match="newer"):
+        list(read_sessions(io.BytesIO(newer)))
+    with pytest.raises(ValueError, match="truncated"):
+        list(read_sessions(io.BytesIO(data[:-8])))
+
+def test_import_into_chat_service():
+    """Test imported sessions continue where they left off"""
+    source = make_sessions(1, 4)
+    service = ChatService(FakeBackend("An answer that passes validation."))
+    for session_id, meta, messages in read_sessions(io.BytesIO(export_bytes(source))):
+        service.restore_session(session_id, messages, meta)
+
+    data = service.parse_payload({"message": "And then?", "sessionId": "s0"})
+    session = service.get_or_create_session(data)
+    service.generate_response(session, data)
+    assert [m['seq'] for m in session['messages']] == [1, 2, 3, 4, 5, 6]
+    assert session['turn'] == 3
+    assert session['messages'][-1]['content'].startswith("An answer")
+
+def compressed_bomb(codec):
+    # A record header claiming far more than the ceiling, then 64 MB of zeros
+    data = session_transfer.RECORD.pack(b'M', 1 << 30) + bytes(64 * 1024 * 1024)
+    header = session_transfer.HEADER.pack(session_transfer.MAGIC, session_transfer.VERSION,
+                                          session_transfer.CODECS[codec])
+    if codec == 'zstd':
+        return header + session_transfer.zstandard.ZstdCompressor().compress(data)
+    return header + zlib.compress(data, 9)
+
+@pytest.mark.parametrize("codec", ["zlib", "zstd"])
+def test_decompression_is_bounded(codec):
+    """Test a small body that expands hugely is refused without being inflated"""
+    if codec == 'zstd' and session_transfer.zstandard is None:
+        pytest.skip("zstandard is not installed")
+    body = compressed_bomb(codec)
+    assert len(body) < 1024 * 1024
+    tracemalloc.start()
+    try:
+        with pytest.raises(ValueError, match="too large"):
+            list(read_sessions(io.BytesIO(body)))
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert peak < 4 * 1024 * 1024
+
+def test_records_over_the_ceiling_are_refused():
+    """Test the record size ceiling can be lowered per read"""
+    data = export_bytes(make_sessions(1, 50), "zlib")
+    assert len(list(read_sessions(io.BytesIO(data), read_size=64))) == 1
+    with pytest.raises(ValueError, match="too large"):
+        list(read_sessions(io.BytesIO(data), read_size=64, max_record_bytes=256))
@@ -0,0 +1,133 @@
+import pytest
+import tokens
+from chat import ChatService, history_window
+from tokens import TokenEstimator, estimate_tokens, message_tokens
+from fake_model import FakeModel
+from test_routing import FakeBackend
+
+class Usage:
+    def __init__(self, candidates_token_count):
+        self.candidates_token_count = candidates_token_count
+
+class CountedResponse:
+    def __init__(self, text, count):
+        self.text = text
+        self.usage_metadata = Usage(count)
+
+class CountedChat:
+    def __init__(self, reply, count):
+        self.reply = reply
+        self.count = count
+
+    def send_message(self, text, stream=False, **kwargs):
+        return CountedResponse(self.reply, self.count)
+
+class CountedModel:
+    def __init__(self, reply, count):
+        self.reply = reply
+        self.count = count
+
+    def start_chat(self, history=None):
+        return CountedChat(self.reply, self.count)
+
+@pytest.fixture(autouse=True)
+def fresh_estimator(monkeypatch):
+    # Calibration is process wide, keep other tests on the default ratio
+    estimator = TokenEstimator()
+    monkeypatch.setattr(tokens, 'estimator', estimator)
+    monkeypatch.setattr('chat.estimator', estimator)
+    return estimator
+
+def test_calibrate_moves_toward_real_ratio(fresh_estimator):
+    """Test the chars-per-token ratio follows the usage metadata"""
+    text = "x" * 600
+    assert fresh_estimator.estimate(text) == 150
+    for _ in range(50):
+        fresh_estimator.calibrate(text, 300)
+    assert fresh_estimator.chars_per_token == pytest.approx(2.0, abs=0.05)
+    assert fresh_estimator.estimate(text) == pytest.approx(300, rel=0.03)
+    assert fresh_estimator.stats()['samples'] == 50
+
+def test_calibrate_ignores_noise(fresh_estimator):
+    """Test tiny replies and missing counts don't move the ratio"""
+    fresh_estimator.calibrate("ok", 1)
+    fresh_estimator.calibrate("x" * 400, None)
+    fresh_estimator.calibrate("x" * 4000, 10000)
+    assert fresh_estimator.samples == 1
+    assert fresh_estimator.chars_per_token >= 1.5
+
+def test_message_tokens_computed_once():
+    """Test a message's count is stored on it and reused"""
+    message = {"role": "user", "content": "x" * 40}
+    assert message_tokens(message) == 10
+    message['content'] = "x" * 4000
+    assert message_tokens(message) == 10
+
+def test_history_window_fits_budget():
+    """Test the window keeps the newest messages that fit"""
+    messages = [{"role": "user", "content": "x", "tokens": count} for count in (500, 300, 200, 100)]
+    window, total = history_window(messages, 650)
+    assert [m['tokens'] for m in window] == [300, 200, 100] and total == 600
+    window, total = history_window(messages, 50)
+    assert [m['tokens'] for m in window] == [100] and total == 100
+    assert history_window([], 50) == ([], 0)
+
+def test_turn_stores_counts_and_calibrates(fresh_estimator):
+    """Test new messages carry token counts and replies use the real count"""
+    reply = "A reply that is long enough to pass validation. " * 4
+    service = ChatService(CountedModel(reply, 100), history_token_budget=1000)
+    data = service.parse_payload({"message": "x" * 80, "sessionId": "s1"})
+    session = service.get_or_create_session(data)
+    service.generate_response(session, data)
+
+    user, assistant = session['messages']
+    assert user['tokens'] == fresh_estimator.estimate("x" * 80) and assistant['tokens'] == 100
+    assert fresh_estimator.samples == 1 and fresh_estimator.chars_per_token < 4.0
+
+    data = service.parse_payload({"message": "again", "sessionId": "s1"})
+    service.generate_response(session, data)
+    assert data['history_tokens'] == user['tokens'] + 100
+
+def test_restored_messages_get_counts():
+    """Test sessions recovered from the log are counted on restore"""
+    service = ChatService(FakeBackend("An answer that passes validation."))
+    service.restore_sessions({"s1": [{"role": "user", "content": "x" * 40}]})
+    assert service.chat_history["s1"]['messages'][0]['tokens'] == 10
+
+def test_budget_replaces_the_message_count_cut():
+    """Test the prompt holds as many messages as fit the budget, not a fixed few"""
+    prompts = []
+
+    class RecordingChat(CountedChat):
+        def send_message(self, text, stream=False, **kwargs):
+            prompts.append(text)
+            return super().send_message(text, stream)
+
+    model = CountedModel("A reply that is long enough to pass validation.", 20)
+    model.start_chat = lambda history=None: RecordingChat(model.reply, model.count)
+    service = ChatService(model, history_token_budget=1000)
+    # Twelve messages of 100 tokens: over the budget, well under the message limit
+    service.restore_sessions({"s1": [
+        {"role": "user" if n % 2 == 0 else "assistant", "content": f"message number {n:02d}", "tokens": 100}
+        for n in range(12)
+    ]})
+    data = service.parse_payload({"message": "next", "sessionId": "s1"})
+    service.generate_response(service.get_or_create_session(data), data)
+
+    assert data['history_tokens'] == 1000
+    assert "message number 01" not in prompts[0]
+    assert all(f"message number {n:02d}" in prompts[0] for n in range(2, 12))
+
+def test_budget_bounds_the_seeded_chat_history():
+    """Test a chat rebuilt from stored messages keeps to the token budget too"""
+    service = ChatService(FakeModel(latency=0, tokens_per_second=0), history_token_budget=1000)
+    service.restore_sessions({"s1": [
+        {"role": "user" if n % 2 == 0 else "assistant", "content": f"message {n} " + "word " * 150}
+        for n in range(20)
+    ]})
+    data = service.parse_payload({"message": "next", "sessionId": "s1"})
+    seeded = service.get_or_create_session(data)['chat_instance'].history
+
+    assert 0 < len(seeded) < 20
+    assert sum(estimate_tokens(turn['parts'][0]) for turn in seeded) <= 1000
+    assert seeded[-1]['parts'][0].startswith("message 19 ")
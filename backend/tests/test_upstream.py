@@ -0,0 +1,85 @@
+import threading
+import time
+from concurrent import futures
+import grpc
+import pytest
+from upstream import ModelPool, create_model_pool, keepalive_options
+
+class FakeModel:
+    def __init__(self, name):
+        self.name = name
+
+    def start_chat(self, history=None):
+        return self.name
+
+    def generate_content(self, prompt, **kwargs):
+        return self.name
+
+@pytest.fixture
+def grpc_server():
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=2))
+    port = server.add_insecure_port('127.0.0.1:0')
+    server.start()
+    yield f'127.0.0.1:{port}'
+    server.stop(None)
+
+def make_pool(target, size=2):
+    channels = [grpc.insecure_channel(target, options=keepalive_options()) for _ in range(size)]
+    return ModelPool([FakeModel(f"model{i}") for i in range(size)], channels)
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+def test_warm_up_connects_every_channel(grpc_server):
+    """Test warm-up opens all channels and records how long each took"""
+    pool = make_pool(grpc_server)
+    assert pool.warm_up(timeout=5) == 2
+    assert wait_for(lambda: pool.stats()['connects'] == 2)
+
+    stats = pool.stats()
+    assert stats['states'] == ['READY', 'READY']
+    assert len(pool.connect_times) == 2
+    assert stats['connect_ms_max'] >= stats['connect_ms_p50'] > 0
+    pool.close()
+
+def test_calls_rotate_over_channels(grpc_server):
+    """Test chats are spread across the pool and warm calls aren't counted as cold"""
+    pool = make_pool(grpc_server)
+    pool.warm_up(timeout=5)
+    assert wait_for(lambda: pool.stats()['states'] == ['READY', 'READY'])
+
+    assert [pool.start_chat(history=[]) for _ in range(4)] == ["model0", "model1", "model0", "model1"]
+    assert pool.generate_content("hi") == "model0"
+    assert pool.stats()['cold_calls'] == 0
+    pool.close()
+
+def test_calls_on_unready_channels_are_counted():
+    """Test calls that will pay for connection setup show up in the metrics"""
+    pool = make_pool('127.0.0.1:1', size=1)
+    assert pool.warm_up(timeout=0.2) == 0
+    pool.generate_content("hi")
+    assert pool.stats()['cold_calls'] == 1
+    pool.close()
+
+def test_create_model_pool_gives_each_model_its_own_channel():
+    """Test pooled models don't share the SDK's default client"""
+    pool = create_model_pool("test-key", {"model_name": "models/gemini-2.0-flash"}, size=3)
+    clients = {id(model._client) for model in pool.models}
+    assert len(clients) == 3
+    assert [model._client.transport.grpc_channel for model in pool.models] == pool.channels
+    pool.close()
+
+def test_close_stops_connectivity_callbacks(grpc_server, monkeypatch):
+    """Test closing a pool doesn't leave the connectivity poller failing on closed channels"""
+    errors = []
+    monkeypatch.setattr(threading, 'excepthook', errors.append)
+    for _ in range(3):
+        pool = make_pool(grpc_server)
+        pool.warm_up(timeout=5)
+        pool.close()
+        pool.close()
+    time.sleep(0.3)
+    assert errors == []
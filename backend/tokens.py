@@ -0,0 +1,66 @@
+import math
+import threading
+
+# Add token estimation constants
+CHARS_PER_TOKEN = 4.0  # Rough average for English text and code with Gemini's tokenizer
+CALIBRATION_ALPHA = 0.1  # weight of each new sample in the moving average
+MIN_CALIBRATION_TOKENS = 20  # shorter replies are too noisy to learn from
+CHARS_PER_TOKEN_RANGE = (1.5, 8.0)
+
+
+class TokenEstimator:
+    """Local token estimate whose chars-per-token ratio follows real usage.
+
+    Each model reply comes with the number of tokens Gemini counted for it,
+    so the ratio is nudged toward len(reply) / candidates_token_count with
+    an exponential moving average. Estimating stays a division, no round trip.
+    """
+
+    def __init__(self, chars_per_token=CHARS_PER_TOKEN, alpha=CALIBRATION_ALPHA):
+        self.chars_per_token = chars_per_token
+        self.alpha = alpha
+        self.lock = threading.Lock()
+        self.samples = 0
+        self.error = 0.0  # moving average of the relative error before each update
+
+    def estimate(self, text):
+        """Cheaply estimate how many tokens the model will count for `text`."""
+        if not text:
+            return 0
+        return max(1, math.ceil(len(text) / self.chars_per_token))
+
+    def calibrate(self, text, actual_tokens):
+        """Learn from a text the model counted `actual_tokens` for."""
+        if not text or not actual_tokens or actual_tokens < MIN_CALIBRATION_TOKENS:
+            return
+        low, high = CHARS_PER_TOKEN_RANGE
+        ratio = min(high, max(low, len(text) / actual_tokens))
+        with self.lock:
+            error = abs(self.estimate(text) - actual_tokens) / actual_tokens
+            self.error += self.alpha * (error - self.error)
+            self.chars_per_token += self.alpha * (ratio - self.chars_per_token)
+            self.samples += 1
+
+    def stats(self):
+        return {
+            'chars_per_token': round(self.chars_per_token, 3),
+            'samples': self.samples,
+            'relative_error': round(self.error, 4)
+        }
+
+
+# Shared by admission control and the per-message counts
+estimator = TokenEstimator()
+
+
+def estimate_tokens(text):
+    """Cheaply estimate how many tokens the model will count for `text`."""
+    return estimator.estimate(text)
+
+
+def message_tokens(message):
+    """Token count of a stored message, computed on first use and kept on it."""
+    tokens = message.get('tokens')
+    if tokens is None:
+        tokens = message['tokens'] = estimate_tokens(message.get('content'))
+    return tokens
@@ -0,0 +1,162 @@
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+from functools import partial
+import grpc
+import google.generativeai as genai
+from google.api_core import gapic_v1
+from google.ai.generativelanguage_v1beta import GenerativeServiceClient
+from google.ai.generativelanguage_v1beta.services.generative_service.transports import GenerativeServiceGrpcTransport
+
+logger = logging.getLogger(__name__)
+
+# Add upstream connection constants
+POOL_SIZE = 2                 # gRPC channels shared by all worker threads
+KEEPALIVE_TIME = 30.0         # seconds between HTTP/2 pings on an idle channel
+KEEPALIVE_TIMEOUT = 10.0      # seconds to wait for a ping ack before reconnecting
+WARMUP_TIMEOUT = 5.0
+CONNECT_SAMPLES = 200         # recent connection times kept for percentiles
+POLLER_STOP_TIMEOUT = 1.0     # grpc's connectivity poller checks for subscribers every 0.2s
+
+
+def keepalive_options(keepalive_time=KEEPALIVE_TIME, keepalive_timeout=KEEPALIVE_TIMEOUT):
+    return [
+        ("grpc.keepalive_time_ms", int(keepalive_time * 1000)),
+        ("grpc.keepalive_timeout_ms", int(keepalive_timeout * 1000)),
+        ("grpc.keepalive_permit_without_calls", 1),
+        ("grpc.http2.max_pings_without_data", 0),
+        # Never drop to IDLE between chats, reconnecting is what we're avoiding
+        ("grpc.client_idle_timeout_ms", 2 ** 31 - 1)
+    ]
+
+
+class ModelPool:
+    """Spreads Gemini calls over several pre-connected gRPC channels.
+
+    The SDK routes every model through one default client and channel. Here
+    each model copy gets its own channel with keepalive pings, so threads
+    don't pile onto one connection and the TLS handshake happens at startup
+    instead of on a user's first message. Sessions stay on the channel their
+    chat was started on.
+    """
+
+    def __init__(self, models, channels):
+        self.models = models
+        self.channels = channels
+        self.lock = threading.Lock()
+        self.order = itertools.cycle(range(len(models)))
+        self.states = [None] * len(channels)
+        # Channels start connecting as soon as they're subscribed below
+        self.connecting_since = [time.monotonic()] * len(channels)
+        self.connected = [False] * len(channels)
+        self.connect_times = deque(maxlen=CONNECT_SAMPLES)
+        self.metrics = {'connects': 0, 'reconnects': 0, 'connect_failures': 0, 'cold_calls': 0}
+        # Kept so close() can unsubscribe them, the connectivity poller fails on a closed channel otherwise
+        self.callbacks = [partial(self._on_state, index) for index in range(len(channels))]
+        for channel, callback in zip(channels, self.callbacks):
+            # try_to_connect keeps the channel connecting again whenever it drops
+            channel.subscribe(callback, try_to_connect=True)
+
+    def _on_state(self, index, state):
+        now = time.monotonic()
+        with self.lock:
+            self.states[index] = state
+            if state != grpc.ChannelConnectivity.READY and self.connecting_since[index] is None:
+                # Updates can skip CONNECTING, so time from the first state that isn't READY
+                self.connecting_since[index] = now
+            if state == grpc.ChannelConnectivity.READY:
+                started = self.connecting_since[index]
+                if started is not None:
+                    self.connect_times.append(now - started)
+                    self.connecting_since[index] = None
+                self.metrics['reconnects' if self.connected[index] else 'connects'] += 1
+                self.connected[index] = True
+            elif state == grpc.ChannelConnectivity.TRANSIENT_FAILURE:
+                self.metrics['connect_failures'] += 1
+
+    def warm_up(self, timeout=WARMUP_TIMEOUT):
+        """Open every channel now; returns how many are ready."""
+        ready = 0
+        for index, channel in enumerate(self.channels):
+            started = time.monotonic()
+            try:
+                grpc.channel_ready_future(channel).result(timeout=timeout)
+                ready += 1
+                logger.info(f"Upstream channel {index} ready in {(time.monotonic() - started) * 1000:.0f}ms")
+            except grpc.FutureTimeoutError:
+                # Not fatal, the channel keeps trying and calls connect lazily
+                logger.warning(f"Upstream channel {index} not ready after {timeout:.1f}s")
+        return ready
+
+    def _pick(self):
+        with self.lock:
+            index = next(self.order)
+            if self.states[index] != grpc.ChannelConnectivity.READY:
+                # This call pays for connection setup
+                self.metrics['cold_calls'] += 1
+        return self.models[index]
+
+    def start_chat(self, **kwargs):
+        return self._pick().start_chat(**kwargs)
+
+    def generate_content(self, *args, **kwargs):
+        return self._pick().generate_content(*args, **kwargs)
+
+    def count_tokens(self, *args, **kwargs):
+        return self._pick().count_tokens(*args, **kwargs)
+
+    def stats(self):
+        with self.lock:
+            times = sorted(self.connect_times)
+            return {
+                'channels': len(self.channels),
+                'states': [state.name if state else 'UNKNOWN' for state in self.states],
+                'connect_ms_p50': _percentile_ms(times, 0.50),
+                'connect_ms_p99': _percentile_ms(times, 0.99),
+                'connect_ms_max': round(times[-1] * 1000, 1) if times else 0.0,
+                **self.metrics
+            }
+
+    def close(self):
+        for channel, callback in zip(self.channels, self.callbacks):
+            channel.unsubscribe(callback)
+        self.callbacks = []
+        # The poller raises in its thread if the channel closes under it, let it notice it has no subscribers
+        deadline = time.monotonic() + POLLER_STOP_TIMEOUT
+        for channel in self.channels:
+            state = getattr(channel, '_connectivity_state', None)
+            while getattr(state, 'polling', False) and time.monotonic() < deadline:
+                time.sleep(0.01)
+            channel.close()
+
+
+def _percentile_ms(values, fraction):
+    if not values:
+        return 0.0
+    return round(values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))] * 1000, 1)
+
+
+def create_model_pool(api_key, model_kwargs, size=POOL_SIZE, keepalive_time=KEEPALIVE_TIME,
+                      keepalive_timeout=KEEPALIVE_TIMEOUT):
+    """Build `size` GenerativeModels, each with its own keepalive gRPC channel."""
+    extra_options = keepalive_options(keepalive_time, keepalive_timeout)
+
+    def create_channel(host, options=(), **kwargs):
+        return GenerativeServiceGrpcTransport.create_channel(host, options=list(options) + extra_options, **kwargs)
+
+    client_info = gapic_v1.client_info.ClientInfo(user_agent=f"genai-py/{genai.__version__}")
+    models, channels = [], []
+    for _ in range(size):
+        client = GenerativeServiceClient(
+            client_options={"api_key": api_key},
+            client_info=client_info,
+            transport=partial(GenerativeServiceGrpcTransport, channel=create_channel)
+        )
+        model = genai.GenerativeModel(**model_kwargs)
+        # The SDK has no public hook for this; models pick up the default client lazily otherwise
+        model._client = client
+        models.append(model)
+        channels.append(client.transport.grpc_channel)
+    return ModelPool(models, channels)
@@ -5,7 +5,7 @@ import Sidebar from "../components/Sidebar";
 import ChatHeader from "../components/ChatHeader";
 import MessageList from "../components/MessageList";
 import InputArea from "../components/InputArea";
-import { formatDateTime } from "../utils/utils";
+import { formatDateTime, fetchWithRetry } from "../utils/utils";
 import '../Styles/Chat.css';
 
 /*
@@ -211,12 +211,13 @@ export default function Chat() {
       const controller = new AbortController();
       const timeoutId = setTimeout(() => controller.abort(), 30000);
 
-      // Make API request
-      const response = await fetch("http://localhost:5000/chat", {
+      // Make API request, retries carry the same key so the server answers them only once
+      const response = await fetchWithRetry("http://localhost:5000/chat", {
         method: "POST",
         headers: {
           "Content-Type": "application/json",
           Accept: "application/json",
+          "Idempotency-Key": crypto.randomUUID(),
         },
         body: JSON.stringify({
           message: userMessage,
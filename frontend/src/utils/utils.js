@@ -118,4 +118,20 @@ export const formatDateTime = () => {
   
     const normalizedLang = lang.toLowerCase();
     return languageNames[normalizedLang] || lang.charAt(0).toUpperCase() + lang.slice(1);
+  };
+
+  // POST with retries for dropped connections and gateway errors
+  // Retries reuse the same options, so an Idempotency-Key header makes them safe
+  export const fetchWithRetry = async (url, options, retries = 2, delay = 500) => {
+    for (let attempt = 0; ; attempt++) {
+      try {
+        const response = await fetch(url, options);
+        if (attempt >= retries || ![502, 503, 504].includes(response.status))
+          return response;
+      } catch (error) {
+        // fetch rejects with a TypeError on network failures; timeouts and other errors aren't retried
+        if (attempt >= retries || error.name !== "TypeError") throw error;
+      }
+      await new Promise((resolve) => setTimeout(resolve, delay * 2 ** attempt));
+    }
   };
\ No newline at end of file